@@ -4,361 +4,4071 @@ Website Design Style Analyzer
 Scrapes a website and extracts comprehensive design style information
 """
 
+import codecs
+import colorsys
+import cProfile
+import gzip
+import hashlib
+import io
+import mmap
+import os
+import pstats
+import queue
 import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
 import requests
+from array import array
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
-from collections import Counter, defaultdict
+from urllib.parse import urldefrag, urljoin, urlparse
+from bisect import bisect_left
+from collections import Counter, defaultdict, deque
+from collections.abc import Mapping, Sequence
+from functools import lru_cache, partial, wraps
+from html.parser import HTMLParser
+from itertools import islice
 import cssutils
 import logging
-from typing import Dict, List, Set, Tuple
+try:
+    import numpy as np
+except ImportError:  # only needed for the perceptual palette
+    np = None
+try:
+    from lxml import etree
+except ImportError:  # only needed for the lxml HTML backend
+    etree = None
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 import json
+import argparse
 
 # Suppress cssutils warnings
 cssutils.log.setLevel(logging.CRITICAL)
 
+# Progress output; main() routes INFO to stdout, library users opt in
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+# Upper bound on simultaneous stylesheet downloads
+DEFAULT_FETCH_WORKERS = 8
+
+# On-disk HTTP response cache
+DEFAULT_CACHE_DIR = '.design_cache'
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Eviction trims the cache to this fraction of max_bytes, so the bodies directory
+# is listed once per that much new data rather than after every download
+CACHE_EVICT_TARGET = 0.9
+
+# Streamed downloads: bodies over DEFAULT_MAX_BODY_BYTES are refused, and
+# stylesheets over DEFAULT_SPILL_BYTES are spooled to a memory-mapped temp
+# file instead of being held in memory as one string
+DEFAULT_REQUEST_TIMEOUT = 10
+DEFAULT_MAX_BODY_BYTES = 32 * 1024 * 1024
+DEFAULT_SPILL_BYTES = 4 * 1024 * 1024
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+# Bump whenever parse_stylesheet changes what it extracts, so cached
+# parse results from older versions are ignored
+RULE_EXTRACTION_VERSION = 3
+
+# Process-pool parsing only pays off for large inputs: sheets below
+# PARALLEL_PARSE_MIN_SHEET_CHARS are always parsed in-process, and the pool
+# is not started at all unless the sheets to parse total PARALLEL_PARSE_MIN_CHARS
+PARALLEL_PARSE_MIN_SHEET_CHARS = 32 * 1024
+PARALLEL_PARSE_MIN_CHARS = 256 * 1024
+
+# Fetched stylesheets waiting to be parsed in pipeline mode
+PIPELINE_QUEUE_SIZE = 4
+# Seconds a blocked pipeline producer waits between checks for a stopped consumer
+PIPELINE_STOP_POLL = 0.1
+
+# Domain crawl limits
+DEFAULT_CRAWL_DEPTH = 2
+DEFAULT_CRAWL_PAGES = 25
+DEFAULT_CRAWL_CONCURRENCY = 4
+
+# Selectors listed per stylesheet and category in the coverage report
+COVERAGE_REPORT_LIMIT = 25
+
+# Batch mode: sites analyzed at once, minimum seconds between requests to one host
+DEFAULT_BATCH_CONCURRENCY = 4
+DEFAULT_HOST_INTERVAL = 0.5
+DEFAULT_BATCH_OUTPUT_DIR = 'style_guides'
+
+# Links to these are not followed as pages when crawling
+NON_PAGE_EXTENSIONS = {
+    '.pdf', '.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.ico', '.zip', '.mp3', '.mp4',
+    '.mov', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.css', '.js', '.json', '.xml'
+}
+
+# Attribute selectors, quoted strings and pseudo-classes/elements carry no
+# tag/class/id tokens and are stripped before tokenizing a selector
+SELECTOR_NOISE_PATTERN = re.compile(r'\[[^\]]*\]|"[^"]*"|\'[^\']*\'|::?[\w-]+(?:\([^)]*\))?')
+SELECTOR_TOKEN_PATTERN = re.compile(r'([.#]?)(-?[_a-zA-Z][\w-]*)')
+SELECTOR_ATTRIBUTE_PATTERN = re.compile(r'\[\s*([\w-]+)\s*(?:[~|^$*]?=\s*["\']?([^"\'\]]*?)["\']?\s*)?(?:\s[is])?\]')
+# Functional pseudo-classes such as :not([href]), whose arguments are dropped
+# before attribute tokens are read; attributes and strings are matched first
+# so parentheses inside them are left alone
+SELECTOR_PSEUDO_ARGUMENTS_PATTERN = re.compile(r'\[[^\]]*\]|"[^"]*"|\'[^\']*\'|(::?[\w-]+\([^)]*\))')
+
+# Component vocabulary of SelectorClassifier: category -> token patterns. A
+# pattern is a tag, .class, #id or [attr=value] token; '*' matches any run
+# of name characters, so '.btn-*' covers '.btn-primary' but not '.btnx'.
+DEFAULT_SELECTOR_VOCABULARY = {
+    'heading': ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', '.heading', '.heading-*', '.heading--*', '.title', '.title-*',
+                '.title--*', '.*-title', '.*__title', '.*-heading', '.*__heading', '.headline', '.headline-*',
+                '.display-*', '.h1', '.h2', '.h3', '.h4', '.h5', '.h6', '[role=heading]'],
+    'body': ['body', 'p', 'main', 'article', '.text', '.content', '.content-*', '.*__content', '.body-text',
+             '.copy', '.prose', '.lead', '.entry-content', '.rich-text', '.article-body'],
+    'button': ['button', '.btn', '.btn-*', '.btn--*', '.button', '.button-*', '.button--*', '.*-btn', '.*__btn',
+               '.*-button', '.*__button', '.cta', '.cta-*', '[type=submit]', '[type=button]', '[type=reset]',
+               '[role=button]'],
+    'card': ['.card', '.card-*', '.card--*', '.card__*', '.*-card', '.*__card', '.box', '.box-*', '.panel',
+             '.panel-*', '.panel--*', '.tile', '.tile-*', '.tile--*', '.*-tile', '.teaser', '.teaser-*'],
+    'navigation': ['nav', 'header', '.nav', '.nav-*', '.nav--*', '.nav__*', '.navbar', '.navbar-*', '.*-nav',
+                   '.*__nav', '.navigation', '.navigation-*', '.menu', '.menu-*', '.menu--*', '.menu__*',
+                   '.*-menu', '.breadcrumb', '.breadcrumbs', '.breadcrumb-*', '.sidebar-nav', '.site-header',
+                   '.header', '.header-*', '[role=navigation]', '[role=menu]', '[role=menubar]'],
+    'form': ['form', 'input', 'select', 'textarea', 'label', 'fieldset', 'legend', '.form', '.form-*', '.field',
+             '.field-*', '.input', '.input-*', '.checkbox', '.radio', '.select', '.search-form', '.searchbox'],
+    'modal': ['dialog', '.modal', '.modal-*', '.modal__*', '.dialog', '.dialog-*', '.lightbox', '.lightbox-*',
+              '.overlay', '.popup', '.popup-*', '[role=dialog]', '[aria-modal=true]'],
+    'alert': ['.alert', '.alert-*', '.alert--*', '.notice', '.notice-*', '.notification', '.notification-*',
+              '.toast', '.toast-*', '.message', '.flash', '.banner-alert', '[role=alert]', '[role=status]'],
+    'badge': ['.badge', '.badge-*', '.tag', '.tags', '.tag-*', '.chip', '.chip-*', '.pill', '.pill-*', '.label',
+              '.label-*', '.status', '.status-*'],
+    'table': ['table', 'thead', 'tbody', 'tr', 'th', 'td', '.table', '.table-*', '.data-table', '.datatable'],
+    'hero': ['.hero', '.hero-*', '.hero--*', '.hero__*', '.jumbotron', '.masthead', '.banner', '.banner-*',
+             '.splash', '.showcase'],
+    'footer': ['footer', '.footer', '.footer-*', '.footer__*', '.site-footer', '.colophon', '[role=contentinfo]'],
+    'tabs': ['.tab', '.tabs', '.tab-*', '.tabs-*', '.tablist', '[role=tab]', '[role=tablist]', '[role=tabpanel]'],
+    'accordion': ['details', 'summary', '.accordion', '.accordion-*', '.collapse', '.collapsible', '.disclosure'],
+    'dropdown': ['.dropdown', '.dropdown-*', '.dropdown__*', '.popover', '.popover-*', '.select-menu',
+                 '[aria-haspopup]'],
+    'tooltip': ['.tooltip', '.tooltip-*', '.tippy-*', '[role=tooltip]'],
+    'pagination': ['.pagination', '.pagination-*', '.pager', '.page-numbers', '.page-item', '.page-link'],
+    'media': ['img', 'picture', 'figure', 'figcaption', 'video', 'iframe', '.media', '.media-*', '.image',
+              '.image-*', '.img-*', '.thumbnail', '.thumb', '.avatar', '.avatar-*', '.gallery', '.gallery-*'],
+    'carousel': ['.carousel', '.carousel-*', '.slider', '.slider-*', '.slick-*', '.swiper', '.swiper-*',
+                 '.glide', '.glide__*', '.slideshow'],
+    'list': ['ul', 'ol', 'dl', '.list', '.list-*', '.list-group', '.list-group-*', '.listing', '.listing-*'],
+    'grid': ['.grid', '.grid-*', '.grid__*', '.row', '.col', '.col-*', '.columns', '.column', '.container',
+             '.container-*', '.wrapper', '.layout', '.layout-*'],
+}
+SELECTOR_CACHE_SIZE = 16384
+
+# Properties whose value is inherited by descendants; in DOM-weighted mode a
+# declaration of one of them counts every element in the matched subtrees
+INHERITED_PROPERTIES = frozenset({
+    'color', 'font', 'font-family', 'font-size', 'font-style', 'font-variant', 'font-weight', 'letter-spacing',
+    'line-height', 'text-align', 'text-indent', 'text-shadow', 'text-transform', 'white-space', 'word-spacing',
+})
+
+# The CSS named-color table (CSS Color Module Level 4): name -> hex digits
+CSS_NAMED_COLOR_VALUES = {
+    'aliceblue': 'f0f8ff', 'antiquewhite': 'faebd7', 'aqua': '00ffff', 'aquamarine': '7fffd4', 'azure': 'f0ffff',
+    'beige': 'f5f5dc', 'bisque': 'ffe4c4', 'black': '000000', 'blanchedalmond': 'ffebcd', 'blue': '0000ff',
+    'blueviolet': '8a2be2', 'brown': 'a52a2a', 'burlywood': 'deb887', 'cadetblue': '5f9ea0',
+    'chartreuse': '7fff00', 'chocolate': 'd2691e', 'coral': 'ff7f50', 'cornflowerblue': '6495ed',
+    'cornsilk': 'fff8dc', 'crimson': 'dc143c', 'cyan': '00ffff', 'darkblue': '00008b', 'darkcyan': '008b8b',
+    'darkgoldenrod': 'b8860b', 'darkgray': 'a9a9a9', 'darkgreen': '006400', 'darkgrey': 'a9a9a9',
+    'darkkhaki': 'bdb76b', 'darkmagenta': '8b008b', 'darkolivegreen': '556b2f', 'darkorange': 'ff8c00',
+    'darkorchid': '9932cc', 'darkred': '8b0000', 'darksalmon': 'e9967a', 'darkseagreen': '8fbc8f',
+    'darkslateblue': '483d8b', 'darkslategray': '2f4f4f', 'darkslategrey': '2f4f4f', 'darkturquoise': '00ced1',
+    'darkviolet': '9400d3', 'deeppink': 'ff1493', 'deepskyblue': '00bfff', 'dimgray': '696969',
+    'dimgrey': '696969', 'dodgerblue': '1e90ff', 'firebrick': 'b22222', 'floralwhite': 'fffaf0',
+    'forestgreen': '228b22', 'fuchsia': 'ff00ff', 'gainsboro': 'dcdcdc', 'ghostwhite': 'f8f8ff',
+    'gold': 'ffd700', 'goldenrod': 'daa520', 'gray': '808080', 'green': '008000', 'greenyellow': 'adff2f',
+    'grey': '808080', 'honeydew': 'f0fff0', 'hotpink': 'ff69b4', 'indianred': 'cd5c5c', 'indigo': '4b0082',
+    'ivory': 'fffff0', 'khaki': 'f0e68c', 'lavender': 'e6e6fa', 'lavenderblush': 'fff0f5',
+    'lawngreen': '7cfc00', 'lemonchiffon': 'fffacd', 'lightblue': 'add8e6', 'lightcoral': 'f08080',
+    'lightcyan': 'e0ffff', 'lightgoldenrodyellow': 'fafad2', 'lightgray': 'd3d3d3', 'lightgreen': '90ee90',
+    'lightgrey': 'd3d3d3', 'lightpink': 'ffb6c1', 'lightsalmon': 'ffa07a', 'lightseagreen': '20b2aa',
+    'lightskyblue': '87cefa', 'lightslategray': '778899', 'lightslategrey': '778899',
+    'lightsteelblue': 'b0c4de', 'lightyellow': 'ffffe0', 'lime': '00ff00', 'limegreen': '32cd32',
+    'linen': 'faf0e6', 'magenta': 'ff00ff', 'maroon': '800000', 'mediumaquamarine': '66cdaa',
+    'mediumblue': '0000cd', 'mediumorchid': 'ba55d3', 'mediumpurple': '9370db', 'mediumseagreen': '3cb371',
+    'mediumslateblue': '7b68ee', 'mediumspringgreen': '00fa9a', 'mediumturquoise': '48d1cc',
+    'mediumvioletred': 'c71585', 'midnightblue': '191970', 'mintcream': 'f5fffa', 'mistyrose': 'ffe4e1',
+    'moccasin': 'ffe4b5', 'navajowhite': 'ffdead', 'navy': '000080', 'oldlace': 'fdf5e6', 'olive': '808000',
+    'olivedrab': '6b8e23', 'orange': 'ffa500', 'orangered': 'ff4500', 'orchid': 'da70d6',
+    'palegoldenrod': 'eee8aa', 'palegreen': '98fb98', 'paleturquoise': 'afeeee', 'palevioletred': 'db7093',
+    'papayawhip': 'ffefd5', 'peachpuff': 'ffdab9', 'peru': 'cd853f', 'pink': 'ffc0cb', 'plum': 'dda0dd',
+    'powderblue': 'b0e0e6', 'purple': '800080', 'rebeccapurple': '663399', 'red': 'ff0000',
+    'rosybrown': 'bc8f8f', 'royalblue': '4169e1', 'saddlebrown': '8b4513', 'salmon': 'fa8072',
+    'sandybrown': 'f4a460', 'seagreen': '2e8b57', 'seashell': 'fff5ee', 'sienna': 'a0522d', 'silver': 'c0c0c0',
+    'skyblue': '87ceeb', 'slateblue': '6a5acd', 'slategray': '708090', 'slategrey': '708090', 'snow': 'fffafa',
+    'springgreen': '00ff7f', 'steelblue': '4682b4', 'tan': 'd2b48c', 'teal': '008080', 'thistle': 'd8bfd8',
+    'tomato': 'ff6347', 'turquoise': '40e0d0', 'violet': 'ee82ee', 'wheat': 'f5deb3', 'white': 'ffffff',
+    'whitesmoke': 'f5f5f5', 'yellow': 'ffff00', 'yellowgreen': '9acd32',
+}
+CSS_NAMED_COLORS = frozenset(CSS_NAMED_COLOR_VALUES)
+
+# One pass over a value finds every color token in document order. url(...)
+# is matched only so that file names such as "white.png" are skipped, and
+# bare words are kept only when they are in CSS_NAMED_COLORS.
+COLOR_TOKEN_PATTERN = re.compile(
+    r'(?P<url>url\([^)]*\))'
+    r'|(?<![\w-])(?P<func>(?:rgb|hsl)a?\([^)]+\))'
+    r'|(?P<hex>#[0-9a-f]{3,8})(?![\w-])'
+    r'|(?<![\w#-])(?P<word>[a-z]+)(?![\w(-])',
+    re.IGNORECASE
+)
+SHORT_HEX_PATTERN = re.compile(r'^#[0-9a-f]{3}$')
+
+# Number of distinct declaration values whose colors are memoized
+COLOR_CACHE_SIZE = 8192
+
+# Perceptual palette: colors closer than this CIE76 delta E share a cluster
+DEFAULT_PALETTE_DELTA_E = 10.0
+PALETTE_MAX_COLORS = 12
+PALETTE_BLOCK_ROWS = 4096
+_HEX_DIGITS_PATTERN = re.compile(r'^[0-9a-f]+$')
+_COLOR_FUNCTION_PATTERN = re.compile(r'^(rgb|hsl)a?\((.*)\)$', re.DOTALL)
+_COLOR_NUMBER_PATTERN = re.compile(r'([-+]?(?:\d+\.?\d*|\.\d+)(?:e[-+]?\d+)?)(%|deg|rad|grad|turn)?')
+_HUE_UNIT_TURNS = {'deg': 1 / 360, 'rad': 1 / (2 * 3.141592653589793), 'grad': 1 / 400, 'turn': 1.0}
+# sRGB (linear) -> XYZ matrix and the D65 reference white, for CIELAB
+_SRGB_TO_XYZ = ((0.4124564, 0.3575761, 0.1804375),
+                (0.2126729, 0.7151522, 0.0721750),
+                (0.0193339, 0.1191920, 0.9503041))
+_D65_WHITE = (0.95047, 1.0, 1.08883)
+_LAB_DELTA = 6 / 29
+_LAB_EPSILON = _LAB_DELTA ** 3
+
+
+def tokenize_colors(value: str) -> List[str]:
+    """Extract color tokens (hex, rgb(a), hsl(a), named) from a CSS value in document order"""
+    colors = []
+    for match in COLOR_TOKEN_PATTERN.finditer(value):
+        kind = match.lastgroup
+        token = match.group(kind)
+        if kind == 'func':
+            colors.append(token)
+        elif kind == 'hex':
+            if len(token) - 1 in (3, 4, 6, 8):
+                colors.append(token)
+        elif kind == 'word':
+            if token.lower() in CSS_NAMED_COLORS:
+                colors.append(token)
+    return colors
+
+
+def normalize_color(color: str) -> str:
+    """Normalize color format for better grouping"""
+    color = color.lower().strip()
+
+    # Convert 3-digit hex to 6-digit
+    if SHORT_HEX_PATTERN.match(color):
+        color = '#' + ''.join([c*2 for c in color[1:]])
+
+    return color
+
+
+@lru_cache(maxsize=COLOR_CACHE_SIZE)
+def normalized_colors(value: str) -> Tuple[str, ...]:
+    """Normalized colors of a CSS value, memoized per distinct value"""
+    return tuple(normalize_color(color) for color in tokenize_colors(value))
+
+
+@lru_cache(maxsize=COLOR_CACHE_SIZE)
+def color_rgba(color: str) -> Optional[Tuple[float, float, float, float]]:
+    """sRGB channels and alpha, each 0-1, of a color token; None if it cannot be parsed"""
+    color = color.strip().lower()
+    color = '#' + CSS_NAMED_COLOR_VALUES[color] if color in CSS_NAMED_COLOR_VALUES else color
+
+    if color.startswith('#'):
+        digits = color[1:]
+        if len(digits) in (3, 4):
+            digits = ''.join(digit * 2 for digit in digits)
+        if len(digits) not in (6, 8) or not _HEX_DIGITS_PATTERN.match(digits):
+            return None
+        channels = [int(digits[i:i + 2], 16) / 255 for i in range(0, len(digits), 2)]
+        return tuple(channels) if len(channels) == 4 else (*channels, 1.0)
+
+    match = _COLOR_FUNCTION_PATTERN.match(color)
+    if not match:
+        return None
+    numbers = _COLOR_NUMBER_PATTERN.findall(match.group(2))
+    if len(numbers) < 3:
+        return None
+    alpha = 1.0
+    if len(numbers) > 3:
+        value, unit = numbers[3]
+        alpha = float(value) / 100 if unit == '%' else float(value)
+
+    if match.group(1) == 'rgb':
+        rgb = [float(value) / 100 if unit == '%' else float(value) / 255 for value, unit in numbers[:3]]
+    else:
+        (hue, hue_unit), (saturation, _), (lightness, _) = numbers[:3]
+        turns = float(hue) * _HUE_UNIT_TURNS.get(hue_unit, 1 / 360)
+        rgb = colorsys.hls_to_rgb(turns % 1.0, float(lightness) / 100, float(saturation) / 100)
+    return (*(min(max(channel, 0.0), 1.0) for channel in rgb), min(max(alpha, 0.0), 1.0))
+
+
+def srgb_to_lab(rgb: 'np.ndarray') -> 'np.ndarray':
+    """Convert an (n, 3) array of sRGB channels (0-1) to CIELAB (D65)"""
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.array(_SRGB_TO_XYZ).T / np.array(_D65_WHITE)
+    f = np.where(xyz > _LAB_EPSILON, np.cbrt(xyz), xyz / (3 * _LAB_DELTA ** 2) + 4 / 29)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+
+def lab_to_srgb(lab: 'np.ndarray') -> 'np.ndarray':
+    """Inverse of srgb_to_lab, clipped to the sRGB gamut"""
+    fy = (lab[:, 0] + 16) / 116
+    f = np.stack([fy + lab[:, 1] / 500, fy, fy - lab[:, 2] / 200], axis=1)
+    xyz = np.where(f > _LAB_DELTA, f ** 3, 3 * _LAB_DELTA ** 2 * (f - 4 / 29)) * np.array(_D65_WHITE)
+    linear = np.clip(xyz @ np.linalg.inv(np.array(_SRGB_TO_XYZ)).T, 0.0, 1.0)
+    return np.where(linear <= 0.0031308, linear * 12.92, 1.055 * linear ** (1 / 2.4) - 0.055)
+
+
+def cluster_palette(colors: Mapping[str, int], threshold: float = DEFAULT_PALETTE_DELTA_E,
+                    max_colors: int = PALETTE_MAX_COLORS) -> List[Dict]:
+    """Group weighted color tokens into perceptual palette entries
+
+    Every distinct token is parsed once; the color math runs on NumPy
+    arrays. Seeds are picked greedily by weight: the heaviest unclaimed
+    color claims all unclaimed colors within threshold (CIE76 delta E) of
+    it. Every color then joins its nearest seed and each cluster's
+    centroid is its weighted mean in CIELAB. Fully transparent colors are
+    skipped. Returns up to max_colors entries, heaviest first:
+    {'color': centroid hex, 'weight', 'share', 'members': tokens by weight}.
+    """
+    if np is None:
+        raise ImportError("palette clustering requires numpy")
+
+    tokens, rgba, weights = [], [], []
+    for token, count in colors.items():
+        channels = color_rgba(token)
+        if channels is not None and channels[3] > 0:
+            tokens.append(token)
+            rgba.append(channels)
+            weights.append(count)
+    if not tokens:
+        return []
+
+    weights = np.array(weights, dtype=float)
+    lab = srgb_to_lab(np.array(rgba)[:, :3])
+
+    # Greedy seeding: one vectorized distance pass over the still unclaimed colors per cluster
+    unclaimed = np.argsort(-weights, kind='stable')
+    seeds = []
+    while len(unclaimed):
+        seed = unclaimed[0]
+        seeds.append(seed)
+        unclaimed = unclaimed[((lab[unclaimed] - lab[seed]) ** 2).sum(axis=1) > threshold ** 2]
+    centers = lab[seeds]
+
+    # Nearest-seed assignment, in row blocks to bound the distance matrix
+    labels = np.empty(len(tokens), dtype=np.intp)
+    center_norms = (centers ** 2).sum(axis=1)
+    for start in range(0, len(tokens), PALETTE_BLOCK_ROWS):
+        block = lab[start:start + PALETTE_BLOCK_ROWS]
+        distances = center_norms - 2 * block @ centers.T
+        labels[start:start + len(block)] = distances.argmin(axis=1)
+
+    totals = np.bincount(labels, weights=weights, minlength=len(seeds))
+    centroids = np.stack([np.bincount(labels, weights=weights * lab[:, axis], minlength=len(seeds))
+                          for axis in range(3)], axis=1) / np.maximum(totals, 1e-12)[:, None]
+    ranked = np.argsort(-totals, kind='stable')[:max_colors]
+    channels = np.rint(lab_to_srgb(centroids[ranked]) * 255).astype(int)
+
+    palette = []
+    for cluster, rgb in zip(ranked, channels):
+        members = np.flatnonzero(labels == cluster)
+        members = members[np.argsort(-weights[members], kind='stable')]
+        palette.append({
+            'color': '#' + ''.join(f"{channel:02x}" for channel in rgb),
+            'weight': int(totals[cluster]),
+            'share': float(totals[cluster] / weights.sum()),
+            'members': [tokens[member] for member in members],
+        })
+    return palette
+
+
+def selector_tokens(selector: str) -> Set[str]:
+    """Split a selector into its tag ('div'), class ('.card') and id ('#main') tokens"""
+    tokens = set()
+    for prefix, name in SELECTOR_TOKEN_PATTERN.findall(SELECTOR_NOISE_PATTERN.sub(' ', selector)):
+        tokens.add(prefix + name if prefix else name.lower())
+    return tokens
+
+
+class SelectorClassifier:
+    """Classify selectors into component categories by their simple-selector tokens
+
+    All vocabulary patterns (see DEFAULT_SELECTOR_VOCABULARY) compile into
+    one regex made of an optional anchored lookahead per category, so a
+    single match of a token reports every category it belongs to. Matching
+    whole tokens avoids substring false positives ('nav' in '.canvas'),
+    and matching is case-insensitive. Results are memoized per token and per selector; classify() returns
+    the matched categories in vocabulary order.
+    """
+
+    def __init__(self, vocabulary: Optional[Dict[str, Iterable[str]]] = None,
+                 cache_size: int = SELECTOR_CACHE_SIZE):
+        self.vocabulary = {}
+        self.cache_size = cache_size
+        self.extend(DEFAULT_SELECTOR_VOCABULARY if vocabulary is None else vocabulary)
+
+    def extend(self, vocabulary: Dict[str, Iterable[str]]):
+        """Add patterns to existing categories or define new ones"""
+        for category, patterns in vocabulary.items():
+            self.vocabulary.setdefault(category, []).extend(patterns)
+        self.categories = list(self.vocabulary)
+        self._regex = re.compile(''.join(
+            f"(?=((?:{'|'.join(self._pattern_regex(pattern) for pattern in patterns)})$))?"
+            for patterns in self.vocabulary.values()
+        ), re.IGNORECASE)
+        self._token_categories = lru_cache(maxsize=self.cache_size)(self._match_token)
+        self.classify = lru_cache(maxsize=self.cache_size)(self._classify)
+
+    @staticmethod
+    def _pattern_regex(pattern: str) -> str:
+        pattern = pattern.strip().lower()
+        attribute = SELECTOR_ATTRIBUTE_PATTERN.fullmatch(pattern)
+        if attribute:
+            name, value = attribute.groups()
+            pattern = f"[{name}={value}]" if value else f"[{name}]"
+        return r'[\w-]*'.join(re.escape(piece) for piece in pattern.split('*'))
+
+    @staticmethod
+    def tokens(selector: str) -> List[str]:
+        """Lowercased [attr=value] tokens of a selector followed by its selector_tokens
+
+        Like classes and ids, attributes inside :not(...) and other
+        functional pseudo-classes are not tokens of the selector.
+        """
+        attributes = SELECTOR_PSEUDO_ARGUMENTS_PATTERN.sub(lambda m: ' ' if m.group(1) else m.group(),
+                                                          selector.lower())
+        tokens = [f"[{name}={value}]" if value else f"[{name}]"
+                  for name, value in SELECTOR_ATTRIBUTE_PATTERN.findall(attributes)]
+        tokens.extend(sorted(selector_tokens(selector)))
+        return tokens
+
+    def _match_token(self, token: str) -> Tuple[str, ...]:
+        groups = self._regex.match(token).groups()
+        return tuple(category for category, group in zip(self.categories, groups) if group is not None)
+
+    def _classify(self, selector: str) -> Tuple[str, ...]:
+        found = set()
+        for token in self.tokens(selector):
+            found.update(self._token_categories(token))
+        return tuple(category for category in self.categories if category in found)
+
+    def matches(self, selector: str, category: str) -> bool:
+        return category in self.classify(selector)
+
+
+class BodyTooLarge(ValueError):
+    """A response body exceeded the configured byte limit"""
+
+
+_CSS_COMMENT_PATTERN = re.compile(r'/\*.*?\*/', re.DOTALL)
+
+
+class SpilledBody:
+    """A downloaded body spooled to an anonymous temp file and memory-mapped
+
+    Stands in for the text of a very large stylesheet: chunks() decodes
+    slices of the map incrementally, so backends with parse_chunks never see
+    a full-size string. len() is the size in bytes. text() builds the string
+    for the code paths that need one. close() (or leaving a with block)
+    releases the map and the file; it is safe to call more than once.
+    """
+
+    def __init__(self, file, encoding: str):
+        file.flush()
+        self.file = file
+        self.size = os.fstat(file.fileno()).st_size
+        self.encoding = encoding
+        self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __repr__(self) -> str:
+        return f"<SpilledBody {self.size} bytes {self.encoding}>"
+
+    def chunks(self, chunk_bytes: int = DOWNLOAD_CHUNK_BYTES) -> Iterator[str]:
+        """Decode the body slice by slice"""
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        for start in range(0, self.size, chunk_bytes):
+            text = decoder.decode(self.map[start:start + chunk_bytes])
+            if text:
+                yield text
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+
+    def text(self) -> str:
+        return ''.join(self.chunks())
+
+    def head(self) -> str:
+        """Decoded prefix up to the first block outside a comment, all stylesheet_imports reads"""
+        text = ''
+        for chunk in self.chunks():
+            text += chunk
+            # Closed comments are dropped, so any '/*' left is still open
+            prefix = _CSS_COMMENT_PATTERN.sub(' ', text)
+            brace = prefix.find('{')
+            opener = prefix.find('/*')
+            if brace >= 0 and (opener < 0 or brace < opener):
+                break
+        return text
+
+    def close(self):
+        if self.size:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self) -> 'SpilledBody':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class UnchangedBody:
+    """Stands in for a stylesheet body that revalidated to a hash the caller already knows
+
+    HTTPCache.get returns one instead of reading the body, so an incremental
+    run pays nothing for an unchanged sheet. imports holds the sheet's
+    (import URL, condition) pairs as recorded by the run that knew the hash,
+    which is all stylesheet_imports needs. text() still reads the cached
+    body for the code paths that need the text itself.
+    """
+
+    def __init__(self, sha256: str, read: Callable[[], str], imports: Iterable[Tuple[str, str]] = ()):
+        self.sha256 = sha256
+        self.imports = list(imports)
+        self._read = read
+
+    def __repr__(self) -> str:
+        return f"<UnchangedBody {self.sha256[:12]}>"
+
+    def text(self) -> str:
+        return self._read()
+
+
+def css_text_of(css) -> str:
+    """The text of a stylesheet that may have been spilled to disk or not read at all"""
+    return css.text() if isinstance(css, (SpilledBody, UnchangedBody)) else css
+
+
+def css_size(css) -> str:
+    """Size of a stylesheet for progress logs: characters, or bytes for a spilled one"""
+    if isinstance(css, UnchangedBody):
+        return "unchanged"
+    return f"{len(css)} bytes" if isinstance(css, SpilledBody) else f"{len(css)} chars"
+
+
+def close_css(css):
+    """Release a stylesheet that was spilled to disk once it has been parsed; strings need nothing"""
+    if isinstance(css, SpilledBody):
+        css.close()
+
+
+def response_encoding(response: requests.Response) -> str:
+    """Declared charset of response, falling back to UTF-8 for missing or unknown ones"""
+    encoding = response.encoding or 'utf-8'
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        return 'utf-8'
+    return encoding
+
+
+def open_stream(session: requests.Session, url: str, timeout: float = DEFAULT_REQUEST_TIMEOUT,
+                max_bytes: int = DEFAULT_MAX_BODY_BYTES, headers: Optional[Dict] = None) -> requests.Response:
+    """Start a streamed GET, refusing bodies whose Content-Length is over max_bytes"""
+    response = session.get(url, headers=headers, timeout=timeout, stream=True)
+    length = response.headers.get('Content-Length', '')
+    if length.isdigit() and int(length) > max_bytes:
+        response.close()
+        raise BodyTooLarge(f"{url} is {int(length)} bytes, over the {max_bytes} byte limit")
+    return response
+
+
+def read_body(chunks: Iterable[bytes], encoding: str, max_bytes: int = DEFAULT_MAX_BODY_BYTES,
+              spill_bytes: Optional[int] = None, sink: Optional[Callable[[bytes], None]] = None,
+              deadline: Optional[float] = None):
+    """Read a body delivered as byte chunks, enforcing max_bytes and the deadline
+
+    Returns the decoded text, or a SpilledBody once more than spill_bytes
+    have arrived (never, when spill_bytes is None). Bytes are counted as they
+    are read, so a missing or understated Content-Length cannot get past the
+    limit. sink, if given, sees every chunk as it arrives.
+    """
+    buffered = []
+    size = 0
+    spill = None
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise BodyTooLarge(f"body is over the {max_bytes} byte limit")
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError("deadline passed while reading the body")
+            if sink is not None:
+                sink(chunk)
+            if spill is not None:
+                spill.write(chunk)
+                continue
+            buffered.append(chunk)
+            if spill_bytes is not None and size > spill_bytes:
+                spill = tempfile.TemporaryFile()
+                spill.writelines(buffered)
+                buffered = []
+    except BaseException:
+        if spill is not None:
+            spill.close()
+        raise
+    if spill is not None:
+        return SpilledBody(spill, encoding)
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    parts = [decoder.decode(chunk) for chunk in buffered]
+    parts.append(decoder.decode(b'', final=True))
+    return ''.join(parts)
+
+
+def create_session(pool_size: int = DEFAULT_FETCH_WORKERS) -> requests.Session:
+    """Create a keep-alive session whose connection pool fits pool_size workers"""
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class HTTPCache:
+    """On-disk conditional HTTP cache shared by fetch_html and the stylesheet downloads
+
+    Each URL has a small JSON entry in <cache_dir>/entries holding its
+    ETag/Last-Modified validators and the SHA-256 of its body. Bodies are
+    content-addressed and gzip-compressed in <cache_dir>/bodies, so identical
+    responses from different URLs are stored once. Cached entries are
+    revalidated with conditional requests; in offline mode they are replayed
+    without touching the network. Once the bodies exceed max_bytes the least
+    recently used ones are evicted down to CACHE_EVICT_TARGET of it.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+                 offline: bool = False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.entries_dir = os.path.join(cache_dir, 'entries')
+        self.bodies_dir = os.path.join(cache_dir, 'bodies')
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.bodies_dir, exist_ok=True)
+        self.stats = Counter()
+        # url -> SHA-256 of the body last served for it, downloaded or from the cache
+        self.bodies = {}
+        # Total size of bodies_dir, listed on the first download and tracked from there
+        self._stored_bytes = None
+        self._lock = threading.Lock()
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _entry_path(self, url: str) -> str:
+        return os.path.join(self.entries_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _body_path(self, digest: str) -> str:
+        return os.path.join(self.bodies_dir, digest + '.gz')
+
+    def _load_entry(self, url: str) -> Optional[Dict]:
+        try:
+            with open(self._entry_path(url), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(self._body_path(entry['sha256'])):
+            return None
+        return entry
+
+    def _read_body(self, entry: Dict, max_bytes: int = DEFAULT_MAX_BODY_BYTES, spill_bytes: Optional[int] = None,
+                   sink: Optional[Callable[[bytes], None]] = None):
+        path = self._body_path(entry['sha256'])
+        # Mark as recently used for eviction; raises FileNotFoundError before sink sees
+        # anything when the body has been evicted
+        os.utime(path)
+        with gzip.open(path, 'rb') as f:
+            return read_body(iter(partial(f.read, DOWNLOAD_CHUNK_BYTES), b''), entry['encoding'],
+                             max_bytes=max_bytes, spill_bytes=spill_bytes, sink=sink)
+
+    def _serve_cached(self, url: str, entry: Dict, known_body: Optional[str], max_bytes: int,
+                      spill_bytes: Optional[int], sink: Optional[Callable[[bytes], None]]):
+        """Return entry's stored body, or None if it was evicted since the entry was loaded"""
+        try:
+            if entry['sha256'] == known_body:
+                os.utime(self._body_path(entry['sha256']))
+                body = UnchangedBody(entry['sha256'], partial(self._read_body, entry, max_bytes))
+            else:
+                body = self._read_body(entry, max_bytes, spill_bytes, sink)
+        except FileNotFoundError:
+            return None
+        self.bodies[url] = entry['sha256']
+        return body
+
+    def _download(self, url: str, response: requests.Response, max_bytes: int, spill_bytes: Optional[int],
+                  deadline: Optional[float], sink: Optional[Callable[[bytes], None]] = None):
+        """Stream response into the body store while decoding it; returns the body"""
+        encoding = response_encoding(response)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.bodies_dir)
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as compressed:
+                def store(chunk: bytes):
+                    digest.update(chunk)
+                    compressed.write(chunk)
+                    if sink is not None:
+                        sink(chunk)
+                body = read_body(response.iter_content(DOWNLOAD_CHUNK_BYTES), encoding, max_bytes=max_bytes,
+                                 spill_bytes=spill_bytes, sink=store, deadline=deadline)
+            path = self._body_path(digest.hexdigest())
+            stored = 0
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, path)
+                stored = os.path.getsize(path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        entry = {
+            'url': url,
+            'sha256': digest.hexdigest(),
+            'encoding': encoding,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        _atomic_write(self._entry_path(url), json.dumps(entry).encode('utf-8'))
+        self.bodies[url] = entry['sha256']
+        with self._lock:
+            if self._stored_bytes is not None:
+                self._stored_bytes += stored
+            full = self._stored_bytes is None or self._stored_bytes > self.max_bytes
+        if full:
+            self.evict()
+        return body
+
+    def get(self, session: requests.Session, url: str, timeout: float = DEFAULT_REQUEST_TIMEOUT,
+            max_bytes: int = DEFAULT_MAX_BODY_BYTES, spill_bytes: Optional[int] = None,
+            deadline: Optional[float] = None, sink: Optional[Callable[[bytes], None]] = None,
+            known_body: Optional[str] = None):
+        """Return the body of url, revalidating or replaying a cached copy when possible
+
+        Bodies are streamed under the same limits as uncached downloads (see
+        read_body), so the result is a SpilledBody when spill_bytes is passed.
+        sink sees the body's bytes whether they come from the network or the cache.
+        A cached body whose hash is known_body is not read at all: an
+        UnchangedBody is returned instead. A body evicted between loading its
+        entry and reading it counts as a cache miss.
+        """
+        entry = self._load_entry(url)
+
+        if self.offline:
+            body = None if entry is None else self._serve_cached(url, entry, known_body, max_bytes,
+                                                                   spill_bytes, sink)
+            if body is None:
+                raise LookupError(f"{url} is not in the HTTP cache (offline mode)")
+            self._count('replayed')
+            return body
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = open_stream(session, url, timeout=timeout, max_bytes=max_bytes, headers=headers)
+        with response:
+            if response.status_code == 304 and entry is not None:
+                body = self._serve_cached(url, entry, known_body, max_bytes, spill_bytes, sink)
+                if body is not None:
+                    self._count('revalidated')
+                    return body
+            else:
+                response.raise_for_status()
+                self._count('downloaded')
+                return self._download(url, response, max_bytes, spill_bytes, deadline, sink)
+
+        # Evicted after its entry was loaded: fetch it again unconditionally
+        with open_stream(session, url, timeout=timeout, max_bytes=max_bytes) as response:
+            response.raise_for_status()
+            self._count('downloaded')
+            return self._download(url, response, max_bytes, spill_bytes, deadline, sink)
+
+    def evict(self):
+        """Delete least recently used bodies once the cache exceeds max_bytes
+
+        Bodies are deleted until CACHE_EVICT_TARGET of max_bytes is left, so
+        the next listing is only needed after that much more has been stored.
+        """
+        with self._lock:
+            bodies = []
+            total = 0
+            for name in os.listdir(self.bodies_dir):
+                path = os.path.join(self.bodies_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                bodies.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+            if total > self.max_bytes:
+                for _, size, path in sorted(bodies):
+                    if total <= self.max_bytes * CACHE_EVICT_TARGET:
+                        break
+                    try:
+                        os.remove(path)
+                        total -= size
+                        self.stats['evicted'] += 1
+                    except OSError:
+                        pass
+            self._stored_bytes = total
+
+
+def _atomic_write(path: str, data: bytes):
+    """Write data to path via a temp file so concurrent readers never see partial files"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+_CSS_IMPORT_SCAN_PATTERN = re.compile(r'/\*.*?\*/|\{', re.DOTALL)
+_CSS_IMPORT_PATTERN = re.compile(
+    r'@import\s+(?:url\(\s*(["\']?)([^"\')]*)\1\s*\)|(["\'])(.*?)\3)\s*([^;]*);',
+    re.IGNORECASE | re.DOTALL
+)
+
+
+def stylesheet_imports(css_text: str) -> List[Tuple[str, str]]:
+    """(href, import condition) of every @import rule of a stylesheet
+
+    @import must precede all other rules, so only the text before the first
+    block (ignoring comments) is searched. An UnchangedBody answers with
+    the imports recorded for it.
+    """
+    if isinstance(css_text, UnchangedBody):
+        return list(css_text.imports)
+    if isinstance(css_text, SpilledBody):
+        css_text = css_text.head()
+    head_end = len(css_text)
+    comments = []
+    for match in _CSS_IMPORT_SCAN_PATTERN.finditer(css_text):
+        if match.group() == '{':
+            head_end = match.start()
+            break
+        comments.append(match.span())
+    head = css_text[:head_end]
+    for start, end in reversed(comments):
+        head = head[:start] + ' ' + head[end:]
+    return [(match.group(2) if match.group(2) is not None else match.group(4), match.group(5).strip())
+            for match in _CSS_IMPORT_PATTERN.finditer(head)]
+
+
+def _split_import_function(condition: str, name: str) -> Tuple[Optional[str], str]:
+    """(arguments, rest) if condition starts with the function name(...), else (None, condition)"""
+    match = re.match(re.escape(name) + r'\(', condition, re.IGNORECASE)
+    if match is None:
+        return None, condition
+    depth = 1
+    for i in range(match.end(), len(condition)):
+        if condition[i] == '(':
+            depth += 1
+        elif condition[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return condition[match.end():i].strip(), condition[i + 1:].strip()
+    return None, condition
+
+
+def import_condition_rules(condition: str) -> List[str]:
+    """Preludes of the group rules an imported sheet is wrapped in, outermost first
+
+    An @import condition is [layer | layer(name)] [supports(...)] [media query
+    list]: 'layer(base) supports(display: grid) screen' gives
+    ['@supports (display: grid)', '@media screen']. Cascade layers are not
+    modelled, so the layer is dropped, as is a media query list of 'all'.
+    """
+    rules = []
+    condition = condition.strip()
+    layer = re.match(r'layer(?:\s+|$)', condition, re.IGNORECASE)
+    if layer is not None:
+        condition = condition[layer.end():]
+    else:
+        _, condition = _split_import_function(condition, 'layer')
+
+    supports, condition = _split_import_function(condition, 'supports')
+    if supports:
+        # A bare declaration needs the parentheses @supports expects around it
+        if re.match(r'[-\w]+\s*:', supports):
+            supports = f'({supports})'
+        rules.append(f'@supports {supports}')
+
+    if re.match(r'[-\w]+\(', condition):
+        logger.debug(f"    Ignoring unknown @import condition: {condition}")
+    elif condition and condition.lower() != 'all':
+        rules.append(f'@media {condition}')
+    return rules
+
+
+# A flattened style rule as produced by every parser backend:
+# (selector, styles, media) where media is the chain of enclosing
+# conditional group rules, e.g. '@media (min-width: 600px) @supports (gap: 0)',
+# or '' for a top-level rule
+RuleRecord = Tuple[str, Dict[str, str], str]
+
+# Conditional group rules whose nested style rules are flattened into records
+GROUPING_AT_RULES = {'@media', '@supports', '@layer', '@container', '@document', '@-moz-document'}
+
+# Comments, strings, escapes and the structural characters split_group_rules tracks
+_CSS_BLOCK_SCAN_PATTERN = re.compile(r'/\*.*?(?:\*/|\Z)|"(?:[^"\\]|\\.)*"?|\'(?:[^\'\\]|\\.)*\'?|\\.|[{};]',
+                                     re.DOTALL)
+_AT_KEYWORD_PATTERN = re.compile(r'@[\w-]+')
+
+
+def split_group_rules(css_text: str) -> Iterator[Tuple[Optional[str], str]]:
+    """Top-level pieces of a stylesheet in document order
+
+    Yields (None, css) for the text between conditional group rules and
+    (prelude, contents) for every top-level rule in GROUPING_AT_RULES. An
+    unterminated group runs to the end of the text.
+    """
+    depth = 0
+    statement = plain = 0
+    group = None
+    for match in _CSS_BLOCK_SCAN_PATTERN.finditer(css_text):
+        token = match.group()
+        if token == '{':
+            if not depth:
+                prelude = _CSS_COMMENT_PATTERN.sub('', css_text[statement:match.start()]).strip()
+                keyword = _AT_KEYWORD_PATTERN.match(prelude)
+                if keyword and keyword.group().lower() in GROUPING_AT_RULES:
+                    group = (prelude, statement, match.end())
+            depth += 1
+        elif token == '}':
+            if depth:
+                depth -= 1
+            if not depth:
+                if group is not None:
+                    prelude, start, body = group
+                    if css_text[plain:start].strip():
+                        yield None, css_text[plain:start]
+                    yield prelude, css_text[body:match.start()]
+                    group = None
+                    plain = match.end()
+                statement = match.end()
+        elif token == ';' and not depth:
+            statement = match.end()
+
+    if group is not None:
+        prelude, start, body = group
+        if css_text[plain:start].strip():
+            yield None, css_text[plain:start]
+        yield prelude, css_text[body:]
+    elif css_text[plain:].strip():
+        yield None, css_text[plain:]
+
+
+class CSSParserBackend:
+    """Turns stylesheet text into flat (selector, styles, media) records
+
+    Only the selector text and the name/value pairs of style rules are kept;
+    rules nested in conditional group rules are flattened with their media
+    context. When a property is declared more than once, the winning value
+    (honouring !important) is kept at the position of its last declaration.
+    """
+
+    name = None
+
+    def parse(self, css_text: str) -> List[RuleRecord]:
+        raise NotImplementedError
+
+
+class CssutilsBackend(CSSParserBackend):
+    """Strict backend that builds and validates a full cssutils CSSOM
+
+    cssutils only understands @media; @supports, @layer and @container are
+    unknown rules to it whose contents it would drop. Group rules are
+    therefore split off with split_group_rules and their contents parsed
+    recursively, so only plain style rules reach cssutils.
+    """
+
+    name = 'cssutils'
+
+    def parse(self, css_text: str) -> List[RuleRecord]:
+        records = []
+        self._parse(css_text, '', records)
+        return records
+
+    def _parse(self, css_text: str, media: str, records: List[RuleRecord]):
+        for prelude, text in split_group_rules(css_text):
+            if prelude is None:
+                for rule in cssutils.parseString(text):
+                    if rule.type == rule.STYLE_RULE:
+                        records.append((rule.selectorText, {prop.name: prop.value for prop in rule.style}, media))
+            else:
+                context = self._context(prelude)
+                self._parse(text, f"{media} {context}" if media else context, records)
+
+    @staticmethod
+    def _context(prelude: str) -> str:
+        keyword = _AT_KEYWORD_PATTERN.match(prelude).group()
+        if keyword.lower() == '@media':
+            return f"@media {cssutils.stylesheets.MediaList(prelude[len(keyword):].strip()).mediaText}"
+        return _MEDIA_COLON_PATTERN.sub(': ', _WHITESPACE_PATTERN.sub(' ', prelude))
+
+
+# Scanner states of StreamingCSSParser
+_PRELUDE, _RULE, _SKIP = range(3)
+
+_CSS_SPECIAL_PATTERN = re.compile(r'[/"\'(){};\\]')
+_CSS_STRING_END_PATTERNS = {'"': re.compile(r'["\\]'), "'": re.compile(r"['\\]")}
+_CSS_STRING_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'', re.DOTALL)
+_CSS_URL_PATTERN = re.compile(r'url\(\s*("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|[^)]*?)\s*\)',
+                              re.IGNORECASE | re.DOTALL)
+_URL_NEEDS_QUOTES_PATTERN = re.compile(r'[\s,;()\'"]')
+_FUNCTION_NAME_PATTERN = re.compile(r'(?<![\w-])([a-zA-Z-]+)\(')
+_DOUBLED_HEX_PATTERN = re.compile(r'#([0-9a-fA-F])\1([0-9a-fA-F])\2([0-9a-fA-F])\3(?![0-9a-zA-Z_-])')
+_IMPORTANT_PATTERN = re.compile(r'\s*!\s*important\s*$', re.IGNORECASE)
+_PROPERTY_NAME_PATTERN = re.compile(r'^-{0,2}[_a-z][\w-]*$')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+_COMMA_PATTERN = re.compile(r'\s*,\s*')
+_SLASH_PATTERN = re.compile(r'\s*/\s*')
+_MEDIA_COLON_PATTERN = re.compile(r'\s*:\s*')
+_PAREN_SPACE_PATTERN = re.compile(r'\(\s+|\s+\)')
+_DECIMAL_PATTERN = re.compile(r'(?<![\w.#-])([+-]?)(\d*)\.(\d+)')
+_COMBINATOR_PATTERN = re.compile(r'\s*([>+~])\s*')
+_SELECTOR_GROUP_PATTERN = re.compile(r'\[[^\]]*\]|\([^)]*\)')
+
+
+def _normalize_decimal(match) -> str:
+    sign, whole, fraction = match.groups()
+    # cssutils keeps at most six decimal places
+    number = f"{float((whole or '0') + '.' + fraction):.6f}".rstrip('0').rstrip('.')
+    return sign + number
+
+
+def _normalize_string(token: str) -> str:
+    """Quote strings with double quotes where possible, as cssutils serializes them"""
+    if token.startswith("'") and '"' not in token:
+        return '"' + token[1:-1] + '"'
+    return token
+
+
+def _normalize_url(match) -> str:
+    target = match.group(1)
+    if target[:1] in '"\'':
+        target = target[1:-1]
+    return f'url("{target}")' if _URL_NEEDS_QUOTES_PATTERN.search(target) else f'url({target})'
+
+
+def _normalize_value_text(text: str) -> str:
+    text = _WHITESPACE_PATTERN.sub(' ', text)
+    text = _COMMA_PATTERN.sub(', ', text)
+    text = _SLASH_PATTERN.sub('/', text)
+    text = _PAREN_SPACE_PATTERN.sub(lambda m: m.group().strip(), text)
+    text = _FUNCTION_NAME_PATTERN.sub(lambda m: m.group().lower(), text)
+    text = _DOUBLED_HEX_PATTERN.sub(r'#\1\2\3', text)
+    return _DECIMAL_PATTERN.sub(_normalize_decimal, text)
+
+
+def _normalize_value(value: str) -> str:
+    """cssutils-style value serialization; strings and url() targets are kept verbatim"""
+    pieces = []
+    last = 0
+    for match in _CSS_URL_PATTERN.finditer(value):
+        pieces.append(_normalize_outside_strings(value[last:match.start()]))
+        pieces.append(_normalize_url(match))
+        last = match.end()
+    pieces.append(_normalize_outside_strings(value[last:]))
+    return ''.join(pieces).strip()
+
+
+def _normalize_outside_strings(text: str) -> str:
+    pieces = []
+    last = 0
+    for match in _CSS_STRING_PATTERN.finditer(text):
+        pieces.append(_normalize_value_text(text[last:match.start()]))
+        pieces.append(_normalize_string(match.group()))
+        last = match.end()
+    pieces.append(_normalize_value_text(text[last:]))
+    return ''.join(pieces)
+
+
+def _normalize_selector_text(text: str) -> str:
+    text = _WHITESPACE_PATTERN.sub(' ', text)
+    # Combinators and commas inside [attr] or :pseudo(...) groups are left alone
+    pieces = []
+    last = 0
+    for match in _SELECTOR_GROUP_PATTERN.finditer(text):
+        pieces.append(_COMMA_PATTERN.sub(', ', _COMBINATOR_PATTERN.sub(r' \1 ', text[last:match.start()])))
+        pieces.append(match.group())
+        last = match.end()
+    pieces.append(_COMMA_PATTERN.sub(', ', _COMBINATOR_PATTERN.sub(r' \1 ', text[last:])))
+    return ''.join(pieces)
+
+
+class StreamingCSSParser:
+    """Incremental pure-Python CSS tokenizer emitting (selector, styles) records
+
+    Text is fed in arbitrary chunks; only the statement currently being read
+    is buffered, so memory stays flat on multi-megabyte minified bundles.
+    Rules inside GROUPING_AT_RULES are flattened with their media context;
+    other at-rule blocks (@font-face, @keyframes, ...) and CSS-nesting
+    child rules are skipped. Values get cssutils-style whitespace, comma and
+    decimal normalization, but are otherwise not validated.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._buf = ''
+        self._pos = 0
+        self._start = 0
+        self._parts = []
+        self._state = _PRELUDE
+        self._depth = 0
+        self._parens = 0
+        self._quote = None
+        self._in_comment = False
+        self._selector = None
+        self._declarations = []
+        # Preludes of the conditional group rules currently open
+        self._context = []
+
+    def feed(self, chunk: str):
+        """Consume the next chunk of stylesheet text"""
+        self._buf += chunk
+        self._scan(final=False)
+
+        # Drop everything before the statement currently being read
+        cut = self._pos if self._in_comment or self._state == _SKIP else min(self._start, self._pos)
+        if self._state == _SKIP:
+            self._parts = []
+        if cut:
+            self._buf = self._buf[cut:]
+            self._pos -= cut
+            self._start = max(0, self._start - cut)
+
+    def close(self) -> List[RuleRecord]:
+        """Finish parsing; an unterminated final rule is kept like cssutils does"""
+        self._scan(final=True)
+        if self._state == _RULE and self._depth == 0:
+            self._declarations.append(self._take(len(self._buf)))
+            self._emit()
+        self._state = _PRELUDE
+        return self.records
+
+    def _take(self, end: int) -> str:
+        """Pending segment text up to end (comments removed); starts a new segment after it"""
+        self._parts.append(self._buf[self._start:end])
+        text = ''.join(self._parts)
+        self._parts = []
+        self._start = end + 1
+        return text
+
+    def _scan(self, final: bool):
+        buf = self._buf
+        n = len(buf)
+        pos = self._pos
+
+        while pos < n:
+            if self._in_comment:
+                end = buf.find('*/', pos)
+                if end < 0:
+                    pos = n if final else max(pos, n - 1)
+                    break
+                pos = self._start = end + 2
+                self._in_comment = False
+                continue
+
+            if self._quote:
+                match = _CSS_STRING_END_PATTERNS[self._quote].search(buf, pos)
+                if match is None:
+                    pos = n
+                    break
+                if match.group() == '\\':
+                    if match.end() >= n and not final:
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                pos = match.end()
+                self._quote = None
+                continue
+
+            match = _CSS_SPECIAL_PATTERN.search(buf, pos)
+            if match is None:
+                pos = n
+                break
+            char = match.group()
+            i = match.start()
+            pos = i + 1
+
+            if char in '/\\':
+                if i + 1 >= n and not final:
+                    # Need the next character to tell a comment or escape apart
+                    pos = i
+                    break
+                if char == '\\':
+                    pos = i + 2
+                elif buf[i + 1:i + 2] == '*':
+                    self._parts.append(buf[self._start:i])
+                    self._in_comment = True
+                    pos = i + 2
+            elif char in '"\'':
+                self._quote = char
+            elif char == '(':
+                self._parens += 1
+            elif char == ')':
+                self._parens = max(0, self._parens - 1)
+            elif char == ';' and self._parens:
+                # e.g. url(data:image/svg+xml;base64,...)
+                continue
+            else:
+                self._parens = 0
+                self._structural(char, i)
+
+        self._pos = min(pos, n)
+
+    def _structural(self, char: str, i: int):
+        text = self._take(i)
+
+        if self._state == _PRELUDE:
+            if char == '}' and self._context:
+                self._context.pop()
+            elif char == '{':
+                prelude = text.strip()
+                if prelude.startswith('@'):
+                    keyword = _AT_KEYWORD_PATTERN.match(prelude)
+                    if keyword and keyword.group().lower() in GROUPING_AT_RULES:
+                        self._context.append(_MEDIA_COLON_PATTERN.sub(': ', _WHITESPACE_PATTERN.sub(' ', prelude)))
+                    else:
+                        self._state = _SKIP
+                        self._depth = 1
+                else:
+                    self._state = _RULE
+                    self._selector = _normalize_selector_text(prelude).strip()
+                    self._declarations = []
+
+        elif self._state == _RULE:
+            if char == '{':
+                self._depth += 1
+            elif char == '}' and self._depth:
+                self._depth -= 1
+            elif not self._depth:
+                self._declarations.append(text)
+                if char == '}':
+                    self._emit()
+                    self._state = _PRELUDE
+
+        else:
+            if char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if not self._depth:
+                    self._state = _PRELUDE
+
+    def _emit(self):
+        styles = {}
+        important = set()
+        for declaration in self._declarations:
+            name, sep, value = declaration.partition(':')
+            name = name.strip().lower()
+            if not sep or not _PROPERTY_NAME_PATTERN.match(name):
+                continue
+            is_important = _IMPORTANT_PATTERN.search(value) is not None
+            if is_important:
+                value = _IMPORTANT_PATTERN.sub('', value)
+            value = _normalize_value(value)
+            if not value:
+                continue
+
+            # The winning value sits at the position of the last declaration
+            if name in important and not is_important:
+                value = styles[name]
+            elif is_important:
+                important.add(name)
+            styles.pop(name, None)
+            styles[name] = value
+
+        if self._selector:
+            self.records.append((self._selector, styles, ' '.join(self._context)))
+        self._selector = None
+        self._declarations = []
+
+
+class StreamingBackend(CSSParserBackend):
+    """Fast backend built on StreamingCSSParser"""
+
+    name = 'streaming'
+
+    # Size of the slices fed to the tokenizer
+    chunk_size = 64 * 1024
+
+    def parse(self, css_text: str) -> List[RuleRecord]:
+        return self.parse_chunks(css_text[i:i + self.chunk_size]
+                                 for i in range(0, len(css_text), self.chunk_size))
+
+    def parse_chunks(self, chunks: Iterable[str]) -> List[RuleRecord]:
+        """Parse a stylesheet delivered as an iterable of text chunks"""
+        parser = StreamingCSSParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+        return parser.close()
+
+
+PARSER_BACKENDS = {
+    CssutilsBackend.name: CssutilsBackend(),
+    StreamingBackend.name: StreamingBackend(),
+}
+DEFAULT_PARSER_BACKEND = CssutilsBackend.name
+
+
+def parse_stylesheet(css_text: str, backend: str = DEFAULT_PARSER_BACKEND) -> List[RuleRecord]:
+    """Parse one stylesheet into flat (selector, styles) records
+
+    If a non-strict backend fails on a sheet, cssutils is used as the fallback.
+    A SpilledBody goes straight from its memory map to backends that have
+    parse_chunks; the others get its decoded text.
+    """
+    parser = PARSER_BACKENDS[backend]
+    try:
+        if isinstance(css_text, SpilledBody) and hasattr(parser, 'parse_chunks'):
+            return parser.parse_chunks(css_text.chunks())
+        return parser.parse(css_text_of(css_text))
+    except Exception:
+        if backend == CssutilsBackend.name:
+            raise
+        return PARSER_BACKENDS[CssutilsBackend.name].parse(css_text_of(css_text))
+
+
+def css_digest(css_text: str) -> str:
+    """SHA-256 of a stylesheet's text, computed chunk by chunk for a SpilledBody"""
+    if isinstance(css_text, UnchangedBody):
+        css_text = css_text.text()
+    if not isinstance(css_text, SpilledBody):
+        return hashlib.sha256(css_text.encode('utf-8', errors='surrogatepass')).hexdigest()
+    digest = hashlib.sha256()
+    for chunk in css_text.chunks():
+        digest.update(chunk.encode('utf-8', errors='surrogatepass'))
+    return digest.hexdigest()
+
+
+class ParsedSheetCache:
+    """On-disk cache of parse_stylesheet results keyed by a hash of the stylesheet text
+
+    Records are stored as zlib-compressed JSON, one file per sheet under
+    <cache_dir>/sheets, so reading the cache never executes code. Every
+    file starts with a header line holding the RULE_EXTRACTION_VERSION it
+    was written with; entries from another version are treated as misses.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, version: int = RULE_EXTRACTION_VERSION):
+        self.sheets_dir = os.path.join(cache_dir, 'sheets')
+        self.version = version
+        os.makedirs(self.sheets_dir, exist_ok=True)
+        self.stats = Counter()
+
+    def _path(self, css_text: str, backend: str) -> str:
+        return os.path.join(self.sheets_dir, f"{css_digest(css_text)}.{backend}.json.z")
+
+    def load(self, css_text: str, backend: str = DEFAULT_PARSER_BACKEND) -> Optional[List[RuleRecord]]:
+        """Cached records for css_text, or None on a miss or version mismatch"""
+        try:
+            with open(self._path(css_text, backend), 'rb') as f:
+                header, _, body = zlib.decompress(f.read()).partition(b'\n')
+            version = int(header)
+            records = None if version != self.version else [
+                (selector, styles, media) for selector, styles, media in json.loads(body)]
+        except (OSError, ValueError, TypeError, zlib.error):
+            self.stats['misses'] += 1
+            return None
+        if records is None:
+            self.stats['stale'] += 1
+            return None
+        self.stats['hits'] += 1
+        return records
+
+    def store(self, css_text: str, records: List[RuleRecord], backend: str = DEFAULT_PARSER_BACKEND):
+        payload = b'%d\n' % self.version + json.dumps(records, separators=(',', ':')).encode('utf-8')
+        _atomic_write(self._path(css_text, backend), zlib.compress(payload))
+
+    def parse(self, css_text: str, backend: str = DEFAULT_PARSER_BACKEND) -> List[RuleRecord]:
+        """parse_stylesheet with a cache lookup in front of it"""
+        records = self.load(css_text, backend)
+        if records is None:
+            records = parse_stylesheet(css_text, backend)
+            self.store(css_text, records, backend)
+        return records
+
+
+# Elements without an end tag, which never become a parent
+HTML_VOID_ELEMENTS = frozenset({
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+    'track', 'wbr',
+})
+
+# Open elements implicitly closed by a start tag: start tag -> tags it closes
+HTML_IMPLIED_END_TAGS = {
+    'li': {'li'},
+    'p': {'p'},
+    'option': {'option'},
+    'dt': {'dt', 'dd'},
+    'dd': {'dt', 'dd'},
+    'tr': {'tr', 'td', 'th'},
+    'td': {'td', 'th'},
+    'th': {'td', 'th'},
+}
+
+
+class DOMElement:
+    """One element of a DOMTree
+
+    position is the element's index in document order and size the number of
+    elements in its subtree (itself included), so its descendants are
+    exactly the elements at positions [position + 1, position + size).
+    index is its position among its parent's children.
+    """
+
+    __slots__ = ('tag', 'id', 'classes', 'attrs', 'parent', 'children', 'index', 'position', 'size')
+
+    def __init__(self, tag: str, attrs: Dict[str, str], parent: Optional['DOMElement'], position: int):
+        self.tag = tag
+        self.attrs = attrs
+        self.id = attrs.get('id', '')
+        self.classes = frozenset(attrs.get('class', '').split())
+        self.parent = parent
+        self.children = []
+        self.index = 0
+        self.position = position
+        self.size = 1
+        if parent is not None:
+            self.index = len(parent.children)
+            parent.children.append(self)
+
+    def __repr__(self) -> str:
+        return f"<DOMElement {element_selector(self.tag, self.id, ' '.join(sorted(self.classes)))}>"
+
+
+class DOMTree:
+    """Minimal element tree of a page, enough to match selectors against
+
+    Built from start/end tag events; void elements and the usual implied end
+    tags (li, p, td, ...) are handled, other unclosed elements are closed by
+    their parent's end tag. Text is not kept.
+    """
+
+    __slots__ = ('elements', '_open')
+
+    def __init__(self):
+        self.elements = []
+        self._open = []
+
+    def start(self, tag: str, attrs: Dict[str, str]):
+        closes = HTML_IMPLIED_END_TAGS.get(tag)
+        while closes and self._open and self._open[-1].tag in closes:
+            self._open.pop()
+        parent = self._open[-1] if self._open else None
+        element = DOMElement(tag, attrs, parent, len(self.elements))
+        self.elements.append(element)
+        if tag not in HTML_VOID_ELEMENTS:
+            self._open.append(element)
+
+    def end(self, tag: str):
+        for depth in range(len(self._open) - 1, -1, -1):
+            if self._open[depth].tag == tag:
+                del self._open[depth:]
+                break
+
+    def close(self) -> 'DOMTree':
+        self._open = []
+        for element in reversed(self.elements):
+            if element.parent is not None:
+                element.parent.size += element.size
+        return self
+
+    def __len__(self) -> int:
+        return len(self.elements)
+
+
+class PageAssets:
+    """What the analyzer reads from an HTML page, in document order
+
+    stylesheets holds the href of every <link rel="stylesheet">, style_blocks
+    the text of every non-empty <style> element, style_attributes a
+    (selector, declarations) pair for every style="" attribute and links the
+    href of every <a>. dom is the page's DOMTree when it was asked for.
+    """
+
+    __slots__ = ('stylesheets', 'style_blocks', 'style_attributes', 'links', 'dom')
+
+    def __init__(self):
+        self.stylesheets = []
+        self.style_blocks = []
+        self.style_attributes = []
+        self.links = []
+        self.dom = None
+
+
+_CSS_IDENT_ESCAPE_PATTERN = re.compile(r'[^A-Za-z0-9_\-\u00a0-\U0010ffff]')
+
+
+def _css_ident(name: str) -> str:
+    escaped = _CSS_IDENT_ESCAPE_PATTERN.sub(lambda match: '\\' + match.group(), name)
+    if escaped[:1].isdigit():
+        escaped = f"\\{ord(escaped[0]):x} {escaped[1:]}"
+    return escaped
+
+
+def element_selector(tag: str, element_id: str = '', classes: str = '') -> str:
+    """Compound selector naming an element by its tag, id and classes, e.g. button#buy.btn.primary"""
+    selector = tag
+    if element_id.strip():
+        selector += '#' + _css_ident(element_id.strip())
+    for name in classes.split():
+        selector += '.' + _css_ident(name)
+    return selector
+
+
+def style_attribute_sheet(style_attributes: List[Tuple[str, str]]) -> str:
+    """A stylesheet with one rule per style="" attribute, selected by its element (see element_selector)
+
+    Attributes containing braces or comments are skipped, since they could
+    swallow the rules after them.
+    """
+    return '\n'.join(f"{selector} {{{style}}}" for selector, style in style_attributes
+                     if not ('{' in style or '}' in style or '/*' in style))
+
+
+class PageAssetCollector:
+    """Parser target that keeps only the PageAssets of a document
+
+    Works as an lxml parser target (start/end/data/close) and is driven by
+    _CollectingHTMLParser for the standard library parser, so no tree is built.
+    """
+
+    def __init__(self, dom: bool = False):
+        self.assets = PageAssets()
+        self._dom = DOMTree() if dom else None
+        # Text parts of the <style> element being read, if any
+        self._style = None
+
+    def start(self, tag: str, attrs: Dict[str, Optional[str]]):
+        if self._dom is not None:
+            self._dom.start(tag, attrs)
+        if tag == 'link':
+            if 'stylesheet' in (attrs.get('rel') or '').split() and attrs.get('href'):
+                self.assets.stylesheets.append(attrs['href'])
+        elif tag == 'a':
+            if 'href' in attrs:
+                self.assets.links.append(attrs['href'] or '')
+        elif tag == 'style':
+            self._style = []
+        style = attrs.get('style')
+        if style and style.strip():
+            self.assets.style_attributes.append(
+                (element_selector(tag, attrs.get('id') or '', attrs.get('class') or ''), style))
+
+    def end(self, tag: str):
+        if self._dom is not None:
+            self._dom.end(tag)
+        if tag == 'style' and self._style is not None:
+            text = ''.join(self._style)
+            if text:
+                self.assets.style_blocks.append(text)
+            self._style = None
+
+    def data(self, data: str):
+        if self._style is not None:
+            self._style.append(data)
+
+    def close(self) -> PageAssets:
+        self.end('style')
+        if self._dom is not None:
+            self.assets.dom = self._dom.close()
+        return self.assets
+
+
+class _CollectingHTMLParser(HTMLParser):
+    def __init__(self, collector: PageAssetCollector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, {name: value if value is not None else '' for name, value in attrs})
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+
+class HTMLParserBackend:
+    """Extracts PageAssets from an HTML document, with its DOMTree if dom is set"""
+
+    name = None
+
+    def extract(self, html: str, dom: bool = False) -> PageAssets:
+        raise NotImplementedError
+
+
+class SoupBackend(HTMLParserBackend):
+    """Builds a full BeautifulSoup tree with html.parser and searches it"""
+
+    name = 'html.parser'
+
+    def extract(self, html: str, dom: bool = False) -> PageAssets:
+        soup = BeautifulSoup(html, 'html.parser')
+        assets = PageAssets()
+        elements = soup.find_all(True)
+        if dom:
+            assets.dom = self._tree(elements)
+        for element in elements:
+            if element.name == 'link':
+                if 'stylesheet' in element.get('rel', []) and element.get('href'):
+                    assets.stylesheets.append(element['href'])
+            elif element.name == 'a':
+                if element.has_attr('href'):
+                    assets.links.append(element['href'])
+            elif element.name == 'style':
+                if element.string:
+                    assets.style_blocks.append(str(element.string))
+            style = element.get('style')
+            if style and style.strip():
+                assets.style_attributes.append(
+                    (element_selector(element.name, element.get('id') or '', ' '.join(element.get('class', []))),
+                     style))
+        return assets
+
+    @staticmethod
+    def _tree(elements: List) -> DOMTree:
+        tree = DOMTree()
+        nodes = {}
+        for element in elements:
+            parent = nodes.get(id(element.parent))
+            attrs = {name: ' '.join(value) if isinstance(value, list) else value
+                     for name, value in element.attrs.items()}
+            node = DOMElement(element.name, attrs, parent, len(tree.elements))
+            tree.elements.append(node)
+            nodes[id(element)] = node
+        return tree.close()
+
+
+class StreamingHTMLBackend(HTMLParserBackend):
+    """Feeds the standard library tokenizer straight into a PageAssetCollector"""
+
+    name = 'stream'
+
+    def extract(self, html: str, dom: bool = False) -> PageAssets:
+        collector = PageAssetCollector(dom)
+        parser = _CollectingHTMLParser(collector)
+        parser.feed(html)
+        parser.close()
+        return collector.close()
+
+
+class LxmlHTMLBackend(HTMLParserBackend):
+    """libxml2's HTML parser with a PageAssetCollector as its target"""
+
+    name = 'lxml'
+
+    def extract(self, html: str, dom: bool = False) -> PageAssets:
+        collector = PageAssetCollector(dom)
+        parser = etree.HTMLParser(target=collector)
+        parser.feed(html)
+        return parser.close()
+
+
+HTML_BACKENDS = {
+    SoupBackend.name: SoupBackend(),
+    StreamingHTMLBackend.name: StreamingHTMLBackend(),
+}
+if etree is not None:
+    HTML_BACKENDS[LxmlHTMLBackend.name] = LxmlHTMLBackend()
+DEFAULT_HTML_BACKEND = SoupBackend.name
+
+
+class _SelectorParser:
+    """Recursive-descent parser for selector lists (see parse_selector_list)"""
+
+    _SPACE = re.compile(r'(?:\s|/\*.*?\*/)+', re.DOTALL)
+    _IDENT = re.compile(r'-?(?:[\w-]|[^\x00-\x7f]|\\[0-9a-fA-F]{1,6}\s?|\\[^\n0-9a-fA-F])+')
+    _ESCAPE = re.compile(r'\\([0-9a-fA-F]{1,6})\s?|\\(.)', re.DOTALL)
+    _ATTRIBUTE = re.compile(
+        r'\[\s*(?:(?:[\w-]*|\*)\|)?([\w-]+)\s*(?:([~|^$*]?=)\s*(?:"((?:[^"\\]|\\.)*)"|\'((?:[^\'\\]|\\.)*)\'|'
+        r'([^\s\]]+))\s*([iIsS])?\s*)?\]', re.DOTALL)
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def fail(self):
+        raise ValueError(f"unsupported selector {self.text!r} at {self.pos}")
+
+    def space(self) -> bool:
+        match = self._SPACE.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+        return match is not None
+
+    def peek(self) -> str:
+        return self.text[self.pos:self.pos + 1]
+
+    def ident(self) -> str:
+        match = self._IDENT.match(self.text, self.pos)
+        if not match:
+            self.fail()
+        self.pos = match.end()
+        return self._ESCAPE.sub(_unescape_css, match.group())
+
+    def selector_list(self) -> List[Tuple]:
+        selectors = [self.complex()]
+        while self.peek() == ',':
+            self.pos += 1
+            selectors.append(self.complex())
+        return selectors
+
+    def complex(self) -> Tuple:
+        self.space()
+        compounds = [self.compound()]
+        combinators = []
+        while True:
+            spaced = self.space()
+            char = self.peek()
+            if char in ('', ',', ')'):
+                break
+            if char in '>+~':
+                self.pos += 1
+                self.space()
+                combinators.append(char)
+            elif spaced:
+                combinators.append(' ')
+            else:
+                self.fail()
+            compounds.append(self.compound())
+        # Matching runs right to left: (compound, combinator to the compound on its left)
+        return tuple(zip(reversed(compounds), reversed([None] + combinators)))
+
+    def compound(self) -> Tuple:
+        tag = element_id = None
+        classes = []
+        attributes = []
+        pseudos = []
+        start = self.pos
+        if self.peek() == '*':
+            self.pos += 1
+        elif self._IDENT.match(self.text, self.pos):
+            tag = self.ident().lower()
+        if self.peek() == '|':
+            # Namespace prefix: ns|tag matches like tag
+            self.pos += 1
+            if self.peek() == '*':
+                self.pos += 1
+                tag = None
+            else:
+                tag = self.ident().lower()
+        while True:
+            char = self.peek()
+            if char == '#':
+                self.pos += 1
+                element_id = self.ident()
+            elif char == '.':
+                self.pos += 1
+                classes.append(self.ident())
+            elif char == '[':
+                match = self._ATTRIBUTE.match(self.text, self.pos)
+                if not match:
+                    self.fail()
+                self.pos = match.end()
+                name, operator, double, single, bare, flag = match.groups()
+                value = next((v for v in (double, single, bare) if v is not None), None)
+                if value is not None:
+                    value = self._ESCAPE.sub(_unescape_css, value)
+                fold = flag is not None and flag.lower() == 'i'
+                attributes.append((name.lower(), operator, value.lower() if fold and value else value, fold))
+            elif char == ':':
+                pseudo = self.pseudo()
+                if pseudo is not None:
+                    pseudos.append(pseudo)
+            else:
+                break
+        if self.pos == start:
+            self.fail()
+        return tag, element_id, frozenset(classes), tuple(attributes), tuple(pseudos)
+
+    def argument(self) -> str:
+        """Raw text up to the ')' closing the argument of a functional pseudo-class"""
+        depth = 0
+        start = self.pos
+        while self.pos < len(self.text):
+            char = self.text[self.pos]
+            if char == '\\':
+                self.pos += 1
+            elif char in '"\'':
+                end = self.text.find(char, self.pos + 1)
+                if end < 0:
+                    self.fail()
+                self.pos = end
+            elif char == '(':
+                depth += 1
+            elif char == ')':
+                if depth == 0:
+                    self.pos += 1
+                    return self.text[start:self.pos - 1]
+                depth -= 1
+            self.pos += 1
+        self.fail()
+
+    def pseudo(self) -> Optional[Tuple]:
+        """(name, argument) of a pseudo-class, or None for pseudo-elements, which place no constraint"""
+        self.pos += 1
+        element = self.peek() == ':'
+        self.pos += element
+        name = self.ident().lower()
+        argument = None
+        if self.peek() == '(':
+            self.pos += 1
+            argument = self.argument()
+        if element or name in SELECTOR_PSEUDO_ELEMENTS:
+            # Pseudo-elements style a part of their element, so the element counts
+            return None
+        if name in SELECTOR_LOGICAL_PSEUDOS and argument is not None:
+            return name, tuple(parse_selector_list(argument))
+        if name in SELECTOR_NTH_PSEUDOS and argument is not None:
+            return name, _parse_nth(argument)
+        if name in SELECTOR_STRUCTURAL_PSEUDOS and argument is None:
+            return name, None
+        if name in SELECTOR_LOGICAL_PSEUDOS or name in SELECTOR_NTH_PSEUDOS or name in SELECTOR_STRUCTURAL_PSEUDOS:
+            self.fail()
+        # Dynamic (:hover), state (:focus-within) and unknown pseudo-classes: _match_pseudo cannot tell
+        return name, argument
+
+
+# Pseudo-classes the matcher evaluates; every other one may or may not hold (see _match_pseudo).
+# :empty is not evaluated because DOMTree records no text nodes
+SELECTOR_LOGICAL_PSEUDOS = frozenset({'not', 'is', 'where', 'matches', 'any', '-webkit-any', '-moz-any'})
+SELECTOR_NTH_PSEUDOS = frozenset({'nth-child', 'nth-last-child', 'nth-of-type', 'nth-last-of-type'})
+SELECTOR_STRUCTURAL_PSEUDOS = frozenset({
+    'root', 'first-child', 'last-child', 'only-child', 'first-of-type', 'last-of-type',
+    'only-of-type', 'checked', 'disabled', 'enabled', 'required', 'optional', 'link', 'any-link',
+})
+# Elements that :disabled and :enabled apply to, and those :required and :optional apply to
+SELECTOR_DISABLEABLE_TAGS = frozenset({'button', 'input', 'select', 'textarea', 'optgroup', 'option', 'fieldset'})
+SELECTOR_REQUIRABLE_TAGS = frozenset({'input', 'select', 'textarea'})
+# Legacy single-colon pseudo-elements
+SELECTOR_PSEUDO_ELEMENTS = frozenset({'before', 'after', 'first-line', 'first-letter'})
+
+_NTH_PATTERN = re.compile(r'\s*(?:(odd)|(even)|([+-]?\d*)n\s*(?:([+-])\s*(\d+))?|([+-]?\d+))\s*$', re.IGNORECASE)
+
+
+def _unescape_css(match) -> str:
+    if match.group(1) is not None:
+        code = int(match.group(1), 16)
+        return chr(code) if 0 < code <= 0x10ffff else '\ufffd'
+    return match.group(2)
+
+
+def _parse_nth(argument: str) -> Tuple[int, int]:
+    """(a, b) of an an+b argument; 'of S' filters are not supported"""
+    match = _NTH_PATTERN.match(argument)
+    if not match:
+        raise ValueError(f"unsupported an+b argument {argument!r}")
+    odd, even, a, sign, b, constant = match.groups()
+    if odd:
+        return 2, 1
+    if even:
+        return 2, 0
+    if constant is not None:
+        return 0, int(constant)
+    a = {'': 1, '+': 1, '-': -1}[a] if a in ('', '+', '-') else int(a)
+    b = int(b) * (-1 if sign == '-' else 1) if b else 0
+    return a, b
+
+
+@lru_cache(maxsize=SELECTOR_CACHE_SIZE)
+def parse_selector_list(text: str) -> Tuple[Tuple, ...]:
+    """Parse a selector list into complex selectors for match_selector
+
+    A complex selector is a tuple of (compound, combinator) pairs from right
+    to left; a compound is (tag, id, classes, attributes, pseudo-classes).
+    Raises ValueError for syntax the matcher does not understand.
+    """
+    parser = _SelectorParser(text)
+    selectors = parser.selector_list()
+    if parser.pos != len(text):
+        parser.fail()
+    return tuple(selectors)
+
+
+def _nth_matches(a: int, b: int, index: int) -> bool:
+    if a == 0:
+        return index == b
+    return (index - b) % a == 0 and (index - b) // a >= 0
+
+
+def _match_any(selectors: Tuple[Tuple, ...], element: DOMElement) -> Optional[bool]:
+    """Three-valued any(): True if a selector matches, None if one might, else False"""
+    result = False
+    for selector in selectors:
+        matched = match_selector(selector, element)
+        if matched:
+            return True
+        if matched is None:
+            result = None
+    return result
+
+
+def _match_pseudo(name: str, argument, element: DOMElement) -> Optional[bool]:
+    """Whether element has a pseudo-class; None when that depends on state the DOM does not record"""
+    if name == 'not':
+        matched = _match_any(argument, element)
+        return None if matched is None else not matched
+    if name in SELECTOR_LOGICAL_PSEUDOS:
+        return _match_any(argument, element)
+    parent = element.parent
+    siblings = parent.children if parent is not None else [element]
+    if name.endswith('of-type'):
+        siblings = [sibling for sibling in siblings if sibling.tag == element.tag]
+    if name.startswith('nth'):
+        index = siblings.index(element) + 1 if name.endswith('of-type') else element.index + 1
+        if '-last-' in name:
+            index = len(siblings) - index + 1
+        return _nth_matches(*argument, index)
+    if name in ('first-child', 'first-of-type'):
+        return siblings[0] is element
+    if name in ('last-child', 'last-of-type'):
+        return siblings[-1] is element
+    if name in ('only-child', 'only-of-type'):
+        return len(siblings) == 1
+    if name == 'root':
+        return parent is None
+    if name == 'checked':
+        return 'checked' in element.attrs or 'selected' in element.attrs
+    if name in ('disabled', 'enabled'):
+        if element.tag not in SELECTOR_DISABLEABLE_TAGS:
+            return False
+        return _is_disabled(element) == (name == 'disabled')
+    if name in ('required', 'optional'):
+        if element.tag not in SELECTOR_REQUIRABLE_TAGS:
+            return False
+        return ('required' in element.attrs) == (name == 'required')
+    if name in ('link', 'any-link'):
+        return element.tag in ('a', 'area') and 'href' in element.attrs
+    return None
+
+
+def _is_disabled(element: DOMElement) -> bool:
+    """Whether a form element is disabled itself or through a disabled fieldset or optgroup"""
+    if 'disabled' in element.attrs:
+        return True
+    if element.tag == 'option':
+        parent = element.parent
+        return parent is not None and parent.tag == 'optgroup' and 'disabled' in parent.attrs
+    child, ancestor = element, element.parent
+    while ancestor is not None:
+        if ancestor.tag == 'fieldset' and 'disabled' in ancestor.attrs:
+            # The contents of a disabled fieldset's first legend stay enabled
+            legend = next((c for c in ancestor.children if c.tag == 'legend'), None)
+            return child is not legend
+        child, ancestor = ancestor, ancestor.parent
+    return False
+
+
+def _match_attribute(name: str, operator: Optional[str], expected: Optional[str], fold: bool,
+                     element: DOMElement) -> bool:
+    actual = element.attrs.get(name)
+    if actual is None:
+        return False
+    if operator is None:
+        return True
+    if fold:
+        actual = actual.lower()
+    if operator == '=':
+        return actual == expected
+    if operator == '~=':
+        return expected in actual.split()
+    if operator == '|=':
+        return actual == expected or actual.startswith(expected + '-')
+    if not expected:
+        return False
+    if operator == '^=':
+        return actual.startswith(expected)
+    if operator == '$=':
+        return actual.endswith(expected)
+    return expected in actual
+
+
+def _match_compound(compound: Tuple, element: DOMElement) -> Optional[bool]:
+    tag, element_id, classes, attributes, pseudos = compound
+    if tag is not None and tag != element.tag:
+        return False
+    if element_id is not None and element_id != element.id:
+        return False
+    if classes and not classes <= element.classes:
+        return False
+    for attribute in attributes:
+        if not _match_attribute(*attribute, element):
+            return False
+    result = True
+    for name, argument in pseudos:
+        matched = _match_pseudo(name, argument, element)
+        if matched is False:
+            return False
+        if matched is None:
+            result = None
+    return result
+
+
+def match_selector(selector: Tuple, element: DOMElement, index: int = 0) -> Optional[bool]:
+    """Whether element matches a complex selector from parse_selector_list
+
+    Three-valued: None means the match depends on a pseudo-class the DOM
+    cannot answer (:hover, :focus-visible, ...), and so is only possible.
+    This is what keeps .btn:not(:hover) matching buttons. Callers treat a
+    possible match as a match.
+    """
+    compound, combinator = selector[index]
+    matched = _match_compound(compound, element)
+    if matched is False or combinator is None:
+        return matched
+    if combinator == '>':
+        if element.parent is None:
+            return False
+        relative = match_selector(selector, element.parent, index + 1)
+    elif combinator == ' ':
+        relative = False
+        ancestor = element.parent
+        while ancestor is not None:
+            found = match_selector(selector, ancestor, index + 1)
+            if found:
+                relative = True
+                break
+            if found is None:
+                relative = None
+            ancestor = ancestor.parent
+    elif element.parent is None:
+        return False
+    elif combinator == '+':
+        if element.index == 0:
+            return False
+        relative = match_selector(selector, element.parent.children[element.index - 1], index + 1)
+    else:
+        relative = False
+        for sibling in element.parent.children[:element.index]:
+            found = match_selector(selector, sibling, index + 1)
+            if found:
+                relative = True
+                break
+            if found is None:
+                relative = None
+    if relative is False:
+        return False
+    return relative and matched
+
+
+class RuleHash:
+    """Browser-style rule hash for matching many rules against a DOMTree
+
+    Each complex selector is filed under one key of its rightmost compound:
+    its id, else its first class, else its tag, else the universal bucket.
+    An element then only tests the selectors filed under its own id,
+    classes and tag (plus the universal ones), so matching costs about
+    elements x candidates instead of elements x rules.
+
+    As with browsers' ancestor filters, a selector whose ancestor compounds
+    name an id, class or tag is further filed under one of those keys
+    inside its bucket, and only looked at when an ancestor of the element
+    has that key.
+    """
+
+    def __init__(self):
+        # bucket key -> ancestor key (None if none is required) -> [(key, selector, required)]
+        self.by_id = defaultdict(dict)
+        self.by_class = defaultdict(dict)
+        self.by_tag = defaultdict(dict)
+        self.universal = {}
+        # Keys whose selector text could not be parsed
+        self.unsupported = []
+
+    def add(self, key, selector_text: str) -> bool:
+        """File every selector of selector_text under key; False if it could not be parsed"""
+        try:
+            selectors = parse_selector_list(selector_text)
+        except (ValueError, RecursionError):
+            self.unsupported.append(key)
+            return False
+        for selector in selectors:
+            tag, element_id, classes, _, _ = selector[0][0]
+            if element_id is not None:
+                bucket = self.by_id[element_id]
+            elif classes:
+                bucket = self.by_class[min(classes)]
+            elif tag is not None:
+                bucket = self.by_tag[tag]
+            else:
+                bucket = self.universal
+            required = self._ancestor_keys(selector)
+            bucket.setdefault(required[0] if required else None, []).append((key, selector, required[1:]))
+        return True
+
+    @staticmethod
+    def _ancestor_keys(selector: Tuple) -> Tuple[str, ...]:
+        """Element keys (see _element_keys) that some ancestor of every match must have"""
+        keys = []
+        ancestor = False
+        for (tag, element_id, classes, _, _), combinator in selector:
+            if ancestor:
+                if element_id is not None:
+                    keys.append('#' + element_id)
+                keys.extend('.' + name for name in sorted(classes))
+                if tag is not None:
+                    keys.append(tag)
+            # Only compounds reached through descendant and child combinators alone are ancestors;
+            # past a sibling combinator they may be siblings of an ancestor instead
+            if combinator not in (' ', '>'):
+                break
+            ancestor = True
+        return tuple(dict.fromkeys(keys))
+
+    @staticmethod
+    def _element_keys(element: DOMElement) -> List[str]:
+        keys = [element.tag]
+        if element.id:
+            keys.append('#' + element.id)
+        keys.extend('.' + name for name in element.classes)
+        return keys
+
+    def candidates(self, element: DOMElement, ancestor_keys: Dict[str, int]) -> Iterator[Tuple]:
+        """Entries that may match element, given the keys of its ancestors"""
+        buckets = []
+        if element.id in self.by_id:
+            buckets.append(self.by_id[element.id])
+        for name in element.classes:
+            if name in self.by_class:
+                buckets.append(self.by_class[name])
+        if element.tag in self.by_tag:
+            buckets.append(self.by_tag[element.tag])
+        if self.universal:
+            buckets.append(self.universal)
+        for bucket in buckets:
+            if None in bucket:
+                yield from bucket[None]
+            if len(bucket) <= len(ancestor_keys):
+                for name, entries in bucket.items():
+                    if name is not None and name in ancestor_keys:
+                        yield from entries
+            else:
+                for name in ancestor_keys:
+                    if name in bucket:
+                        yield from bucket[name]
+
+    def match(self, dom: DOMTree, uncertain: Optional[Set] = None) -> Dict:
+        """key -> the elements of dom matched by any of its selectors, in document order
+
+        Possible matches (see match_selector) are included; keys that only
+        match possibly are also added to uncertain, if given.
+        """
+        matched = {}
+        definite = set()
+        # Keys of the current element's ancestors, with multiplicity
+        ancestor_keys = {}
+        chain = []
+        for element in dom.elements:
+            while chain and chain[-1][0] is not element.parent:
+                for name in chain.pop()[1]:
+                    if ancestor_keys[name] == 1:
+                        del ancestor_keys[name]
+                    else:
+                        ancestor_keys[name] -= 1
+            for key, selector, required in self.candidates(element, ancestor_keys):
+                elements = matched.get(key)
+                seen = elements is not None and elements[-1] is element
+                # A possible match may still be made definite by another selector of the key
+                if seen and (uncertain is None or key in definite):
+                    continue
+                if required and not all(name in ancestor_keys for name in required):
+                    continue
+                found = match_selector(selector, element)
+                if found is False:
+                    continue
+                if found:
+                    definite.add(key)
+                if elements is None:
+                    matched[key] = [element]
+                elif not seen:
+                    elements.append(element)
+            keys = self._element_keys(element)
+            for name in keys:
+                ancestor_keys[name] = ancestor_keys.get(name, 0) + 1
+            chain.append((element, keys))
+        if uncertain is not None:
+            uncertain.update(key for key in matched if key not in definite)
+        return matched
+
+
+def covered_elements(elements: List[DOMElement]) -> int:
+    """Number of elements in the union of the subtrees of elements (given in document order)"""
+    covered = 0
+    reach = -1
+    for element in elements:
+        if element.position >= reach:
+            covered += element.size
+            reach = element.position + element.size
+    return covered
+
+
+class StringTable:
+    """Interns strings as dense integer ids"""
+
+    __slots__ = ('ids', 'strings')
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, text: str) -> int:
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = self.ids[text] = len(self.strings)
+            self.strings.append(text)
+        return string_id
+
+
+class CompactRuleStore(Sequence):
+    """Columnar css_rules storage with every string interned once
+
+    Selectors, media contexts, property names and values all go through one
+    StringTable, and rules are kept as parallel arrays of integer ids:
+    one selector/media id per rule, plus each rule's slice of the
+    declaration name/value id arrays. Indexing returns a RuleView, which
+    reads like the {'selector', 'styles', 'media'} dicts of the plain list
+    layout, so the analyses and the report work unchanged.
+    """
+
+    def __init__(self):
+        self.strings = StringTable()
+        self._selectors = array('I')
+        self._media = array('I')
+        self._offsets = array('I', [0])
+        self._names = array('I')
+        self._values = array('I')
+
+    def append(self, rule: Dict):
+        """Store a {'selector', 'styles', 'media'} rule; the dict itself is not kept"""
+        intern = self.strings.intern
+        self._selectors.append(intern(rule['selector']))
+        self._media.append(intern(rule.get('media', '')))
+        for name, value in rule['styles'].items():
+            self._names.append(intern(name))
+            self._values.append(intern(value))
+        self._offsets.append(len(self._names))
+
+    def __len__(self) -> int:
+        return len(self._selectors)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('rule index out of range')
+        return RuleView(self, index)
+
+    def memory_bytes(self) -> int:
+        """Approximate footprint of the id arrays, the interned strings and their lookup table"""
+        arrays = (self._selectors, self._media, self._offsets, self._names, self._values)
+        return (sum(a.itemsize * len(a) for a in arrays) +
+                sum(sys.getsizeof(text) for text in self.strings.strings) +
+                sys.getsizeof(self.strings.strings) + sys.getsizeof(self.strings.ids))
+
+
+class RuleView:
+    """Read-only dict-like view of one rule in a CompactRuleStore"""
+
+    __slots__ = ('_store', '_index')
+
+    _KEYS = ('selector', 'styles', 'media')
+
+    def __init__(self, store: CompactRuleStore, index: int):
+        self._store = store
+        self._index = index
+
+    def __getitem__(self, key: str):
+        store = self._store
+        if key == 'selector':
+            return store.strings.strings[store._selectors[self._index]]
+        if key == 'styles':
+            return StylesView(store, store._offsets[self._index], store._offsets[self._index + 1])
+        if key == 'media':
+            return store.strings.strings[store._media[self._index]]
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        return self[key] if key in self._KEYS else default
+
+    def keys(self):
+        return self._KEYS
+
+    def __contains__(self, key) -> bool:
+        return key in self._KEYS
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (RuleView, dict)):
+            return all(self[key] == other.get(key, '' if key == 'media' else None) for key in self._KEYS)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr({key: self[key] if key != 'styles' else dict(self[key]) for key in self._KEYS})
+
+
+class StylesView(Mapping):
+    """Read-only mapping over one rule's declarations in a CompactRuleStore
+
+    The name id -> position lookup is built on the first key access, so
+    repeated membership tests (one per dispatch handler) are dict lookups.
+    """
+
+    __slots__ = ('_store', '_start', '_end', '_positions')
+
+    def __init__(self, store: CompactRuleStore, start: int, end: int):
+        self._store = store
+        self._start = start
+        self._end = end
+        self._positions = None
+
+    def _position(self, name: str) -> int:
+        name_id = self._store.strings.ids.get(name)
+        if name_id is None:
+            return -1
+        if self._positions is None:
+            names = self._store._names
+            self._positions = {names[position]: position for position in range(self._start, self._end)}
+        return self._positions.get(name_id, -1)
+
+    def __getitem__(self, name: str) -> str:
+        position = self._position(name)
+        if position < 0:
+            raise KeyError(name)
+        return self._store.strings.strings[self._store._values[position]]
+
+    def __contains__(self, name) -> bool:
+        return self._position(name) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        strings = self._store.strings.strings
+        names = self._store._names
+        return (strings[names[position]] for position in range(self._start, self._end))
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+# Version stamp of the serialized StyleGuideAggregate layout; bump on schema changes
+STYLE_GUIDE_SCHEMA_VERSION = 2
+
+# Shape of style_guide: section -> field -> kind. Counters tally values, dicts
+# keep the latest styles per selector and lists collect {'selector', 'styles'} examples.
+STYLE_GUIDE_SCHEMA = {
+    'typography': {
+        'font_families': Counter,
+        'font_sizes': Counter,
+        'font_weights': Counter,
+        'line_heights': Counter,
+        'letter_spacing': Counter,
+        'heading_styles': dict,
+        'body_styles': dict,
+    },
+    'colors': {
+        'all_colors': Counter,
+        'background_colors': Counter,
+        'text_colors': Counter,
+        'border_colors': Counter,
+    },
+    'layout': {
+        'display_types': Counter,
+        'grid_usage': list,
+        'flexbox_usage': list,
+        'spacing': {
+            'margins': Counter,
+            'paddings': Counter,
+        },
+        'border_radius': Counter,
+        'max_widths': Counter,
+    },
+    'visual_effects': {
+        'box_shadows': Counter,
+        'text_shadows': Counter,
+        'transitions': Counter,
+        'transforms': Counter,
+    },
+    'ui_patterns': {
+        'button_styles': list,
+        'card_styles': list,
+        'navigation_styles': list,
+        'component_counts': Counter,
+    },
+}
+
+# What each derived analysis reads: other analyses or style_guide sections.
+# style_guide sections are the leaves, filled by the fused pass over the rules.
+ANALYSIS_DEPENDENCIES = {
+    'visual_tone': ('colors', 'visual_effects', 'layout'),
+    'palette': ('colors',),
+    'design_summary': ('typography', 'colors', 'layout', 'visual_effects'),
+}
+
+# Report sections in rendering order -> the analyses they render
+REPORT_SECTIONS = {
+    'tone': ('visual_tone',),
+    'typography': ('typography',),
+    'colors': ('colors', 'palette'),
+    'layout': ('layout',),
+    'effects': ('visual_effects',),
+    'components': ('ui_patterns',),
+    'summary': ('design_summary',),
+}
+
+
+def required_analyses(report_sections: Iterable[str]) -> Set[str]:
+    """Every analysis the given report sections depend on, directly or through ANALYSIS_DEPENDENCIES"""
+    required = set()
+    pending = []
+    for section in report_sections:
+        if section not in REPORT_SECTIONS:
+            raise ValueError(f"Unknown report section {section!r}; expected one of {', '.join(REPORT_SECTIONS)}")
+        pending.extend(REPORT_SECTIONS[section])
+    while pending:
+        analysis = pending.pop()
+        if analysis not in required:
+            required.add(analysis)
+            pending.extend(ANALYSIS_DEPENDENCIES.get(analysis, ()))
+    return required
+
+
+class StyleGuideAggregate(Mapping):
+    """Mergeable, serializable style_guide results
+
+    Reads like the nested style_guide dict. merge() is associative: counters
+    add, keyed styles keep the later value and example lists concatenate, so
+    folding stylesheets one after another and merging per-sheet aggregates
+    in the same order give identical results. sources lists the analyzed
+    URLs that went into the aggregate.
+    """
+
+    def __init__(self, sections: Optional[Dict] = None, sources: Optional[List[str]] = None):
+        self.sections = sections if sections is not None else self._empty(STYLE_GUIDE_SCHEMA)
+        self.sources = sources if sources is not None else []
+
+    @classmethod
+    def _empty(cls, schema: Dict) -> Dict:
+        return {name: cls._empty(kind) if isinstance(kind, dict) else kind() for name, kind in schema.items()}
+
+    def __getitem__(self, section: str) -> Dict:
+        return self.sections[section]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.sections)
+
+    def __len__(self) -> int:
+        return len(self.sections)
+
+    def iter_fields(self) -> Iterator[Tuple[str, type, object]]:
+        """Yield (dotted path, kind, container) for every field, e.g. ('layout.spacing.margins', Counter, ...)"""
+        def walk(sections, schema, prefix):
+            for name, kind in schema.items():
+                if isinstance(kind, dict):
+                    yield from walk(sections[name], kind, f"{prefix}{name}.")
+                else:
+                    yield f"{prefix}{name}", kind, sections[name]
+        return walk(self.sections, STYLE_GUIDE_SCHEMA, '')
+
+    def update(self, other: 'StyleGuideAggregate') -> 'StyleGuideAggregate':
+        """Fold other into this aggregate in place"""
+        self._merge_into(self.sections, other.sections, STYLE_GUIDE_SCHEMA)
+        self.sources.extend(source for source in other.sources if source not in self.sources)
+        return self
+
+    @classmethod
+    def _merge_into(cls, target: Dict, source: Dict, schema: Dict):
+        for name, kind in schema.items():
+            if isinstance(kind, dict):
+                cls._merge_into(target[name], source[name], kind)
+            elif kind is list:
+                target[name].extend(source[name])
+            else:
+                target[name].update(source[name])
+
+    def merge(self, other: 'StyleGuideAggregate') -> 'StyleGuideAggregate':
+        """Return a new aggregate combining this one followed by other"""
+        return StyleGuideAggregate().update(self).update(other)
+
+    @classmethod
+    def merged(cls, aggregates: Iterable['StyleGuideAggregate']) -> 'StyleGuideAggregate':
+        """Reduce aggregates, in order, into a new aggregate"""
+        result = cls()
+        for aggregate in aggregates:
+            result.update(aggregate)
+        return result
+
+    def to_dict(self) -> Dict:
+        """JSON-compatible form, stamped with STYLE_GUIDE_SCHEMA_VERSION"""
+        return {
+            'schema_version': STYLE_GUIDE_SCHEMA_VERSION,
+            'sources': list(self.sources),
+            'sections': self._encode(self.sections, STYLE_GUIDE_SCHEMA),
+        }
+
+    @classmethod
+    def _encode(cls, sections: Dict, schema: Dict) -> Dict:
+        encoded = {}
+        for name, kind in schema.items():
+            value = sections[name]
+            if isinstance(kind, dict):
+                encoded[name] = cls._encode(value, kind)
+            elif kind is list:
+                encoded[name] = [{'selector': item['selector'], 'styles': dict(item['styles'])} for item in value]
+            elif kind is dict:
+                encoded[name] = {selector: dict(styles) for selector, styles in value.items()}
+            else:
+                encoded[name] = dict(value)
+        return encoded
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'StyleGuideAggregate':
+        """Rebuild an aggregate from to_dict() output"""
+        version = data.get('schema_version')
+        if version != STYLE_GUIDE_SCHEMA_VERSION:
+            raise ValueError(f"unsupported style guide schema version {version!r} "
+                             f"(expected {STYLE_GUIDE_SCHEMA_VERSION})")
+        return cls(cls._decode(data['sections'], STYLE_GUIDE_SCHEMA), list(data.get('sources', [])))
+
+    @classmethod
+    def _decode(cls, encoded: Dict, schema: Dict) -> Dict:
+        sections = cls._empty(schema)
+        for name, kind in schema.items():
+            if isinstance(kind, dict):
+                sections[name] = cls._decode(encoded.get(name, {}), kind)
+            else:
+                sections[name] = kind(encoded.get(name, kind()))
+        return sections
+
+    def save(self, path: str):
+        """Write the aggregate as gzipped JSON"""
+        data = json.dumps(self.to_dict(), separators=(',', ':')).encode('utf-8')
+        _atomic_write(os.path.abspath(path), gzip.compress(data))
+
+    @classmethod
+    def load(cls, path: str) -> 'StyleGuideAggregate':
+        """Read an aggregate written by save()"""
+        with open(path, 'rb') as f:
+            return cls.from_dict(json.loads(gzip.decompress(f.read()).decode('utf-8')))
+
+
+# Version stamp of the AnalysisSnapshot file layout
+SNAPSHOT_VERSION = 1
+
+
+class AnalysisSnapshot:
+    """Per-stylesheet contributions of one run, for incremental re-analysis
+
+    sheets lists (url, sha256 of the CSS text, StyleGuideAggregate) in
+    document order. A later run reuses the aggregate of every sheet whose
+    text hash it already knows and parses only the others. bodies maps the
+    URL of a sheet fetched through the HTTPCache to the hash of its body,
+    and imports maps it to its (import URL, condition) pairs, which lets
+    the next run recognise it after a 304 without reading it at all.
+    Snapshots are only reusable by runs with the same parser backend,
+    rule extraction version and style guide schema.
+    """
+
+    def __init__(self, url: str, parser_backend: str,
+                 sheets: Optional[List[Tuple[str, str, StyleGuideAggregate]]] = None,
+                 bodies: Optional[Dict[str, str]] = None,
+                 imports: Optional[Dict[str, List[Tuple[str, str]]]] = None):
+        self.url = url
+        self.parser_backend = parser_backend
+        self.sheets = sheets if sheets is not None else []
+        self.bodies = bodies if bodies is not None else {}
+        self.imports = imports if imports is not None else {}
+
+    @staticmethod
+    def digest(css_text: str) -> str:
+        return css_digest(css_text)
+
+    def _stamp(self) -> Dict:
+        return {
+            'snapshot_version': SNAPSHOT_VERSION,
+            'schema_version': STYLE_GUIDE_SCHEMA_VERSION,
+            'rule_extraction_version': RULE_EXTRACTION_VERSION,
+            'parser_backend': self.parser_backend,
+        }
+
+    def compatible(self, parser_backend: str) -> bool:
+        """Whether a run with parser_backend can reuse these contributions"""
+        return self.parser_backend is not None and self.parser_backend == parser_backend
+
+    def contributions(self) -> Dict[str, StyleGuideAggregate]:
+        """Sheet hash -> aggregate"""
+        return {digest: aggregate for _, digest, aggregate in self.sheets}
+
+    def aggregate(self) -> StyleGuideAggregate:
+        """The whole run's style guide, reduced from the per-sheet contributions"""
+        merged = StyleGuideAggregate.merged(aggregate for _, _, aggregate in self.sheets)
+        merged.sources = [self.url]
+        return merged
+
+    def save(self, path: str):
+        """Write the snapshot as gzipped JSON"""
+        data = dict(self._stamp(), url=self.url, sheets=[
+            {'url': url, 'sha256': digest, 'body': self.bodies.get(url), 'imports': self.imports.get(url),
+             'aggregate': aggregate.to_dict()}
+            for url, digest, aggregate in self.sheets
+        ])
+        _atomic_write(os.path.abspath(path), gzip.compress(json.dumps(data, separators=(',', ':')).encode('utf-8')))
+
+    @classmethod
+    def load(cls, path: str) -> 'AnalysisSnapshot':
+        """Read a snapshot written by save(); raises ValueError for another snapshot version"""
+        with open(path, 'rb') as f:
+            data = json.loads(gzip.decompress(f.read()).decode('utf-8'))
+        if data.get('snapshot_version') != SNAPSHOT_VERSION:
+            raise ValueError(f"unsupported snapshot version {data.get('snapshot_version')!r}")
+        snapshot = cls(data['url'], data['parser_backend'], [
+            (sheet['url'], sheet['sha256'], StyleGuideAggregate.from_dict(sheet['aggregate']))
+            for sheet in data['sheets']
+        ], {sheet['url']: sheet['body'] for sheet in data['sheets'] if sheet.get('body')},
+            {sheet['url']: [tuple(pair) for pair in sheet['imports']]
+             for sheet in data['sheets'] if sheet.get('imports') is not None})
+        if (data.get('schema_version'), data.get('rule_extraction_version')) != (
+                STYLE_GUIDE_SCHEMA_VERSION, RULE_EXTRACTION_VERSION):
+            snapshot.parser_backend = None  # contributions from another analyzer version are never reused
+        return snapshot
+
+
+def summarize_changes(previous: AnalysisSnapshot, current: AnalysisSnapshot, reused: int = 0) -> Dict:
+    """Describe what changed between two snapshots of the same site
+
+    Stylesheets are matched by URL: a known URL with a new hash is
+    'changed'. Every counted style_guide field reports the values that
+    appeared or disappeared and the counts that moved; example collections
+    report their size change.
+    """
+    old_urls = {url: digest for url, digest, _ in previous.sheets}
+    new_urls = {url: digest for url, digest, _ in current.sheets}
+    changes = {
+        'sheets': {
+            'added': [url for url in new_urls if url not in old_urls],
+            'removed': [url for url in old_urls if url not in new_urls],
+            'changed': [url for url, digest in new_urls.items()
+                        if url in old_urls and old_urls[url] != digest],
+            'total': len(current.sheets),
+            'reused': reused,
+        },
+        'fields': {},
+    }
+
+    old_fields = dict((path, (kind, value)) for path, kind, value in previous.aggregate().iter_fields())
+    for path, kind, new in current.aggregate().iter_fields():
+        old = old_fields[path][1]
+        if kind is Counter:
+            field = {
+                'added': [(value, count) for value, count in new.most_common() if value not in old],
+                'removed': [(value, count) for value, count in old.most_common() if value not in new],
+                'changed': [(value, old[value], count) for value, count in new.most_common()
+                            if value in old and old[value] != count],
+            }
+            if any(field.values()):
+                changes['fields'][path] = field
+        elif len(old) != len(new):
+            changes['fields'][path] = {'size': (len(old), len(new))}
+    return changes
+
+
+# Rules whose declarations go into one executemany() call when loading a DeclarationStore
+DECLARATION_BATCH_RULES = 10000
+
+DECLARATION_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sites (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    analyzed_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    site_id INTEGER NOT NULL REFERENCES sites(id) ON DELETE CASCADE,
+    url TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sheets (
+    id INTEGER PRIMARY KEY,
+    site_id INTEGER NOT NULL REFERENCES sites(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    url TEXT NOT NULL,
+    page_url TEXT
+);
+CREATE TABLE IF NOT EXISTS page_sheets (
+    page_id INTEGER NOT NULL REFERENCES pages(id) ON DELETE CASCADE,
+    sheet_id INTEGER NOT NULL REFERENCES sheets(id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS strings (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS declarations (
+    site_id INTEGER NOT NULL REFERENCES sites(id) ON DELETE CASCADE,
+    sheet_id INTEGER NOT NULL REFERENCES sheets(id) ON DELETE CASCADE,
+    rule INTEGER NOT NULL,
+    selector_id INTEGER NOT NULL REFERENCES strings(id),
+    media_id INTEGER NOT NULL REFERENCES strings(id),
+    property_id INTEGER NOT NULL REFERENCES strings(id),
+    value_id INTEGER NOT NULL REFERENCES strings(id)
+);
+CREATE TABLE IF NOT EXISTS facts (
+    site_id INTEGER NOT NULL REFERENCES sites(id) ON DELETE CASCADE,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS declarations_property ON declarations (property_id, value_id);
+CREATE INDEX IF NOT EXISTS declarations_selector ON declarations (selector_id);
+CREATE INDEX IF NOT EXISTS declarations_site ON declarations (site_id);
+CREATE INDEX IF NOT EXISTS facts_field ON facts (field, value);
+CREATE INDEX IF NOT EXISTS facts_site ON facts (site_id);
+CREATE INDEX IF NOT EXISTS sheets_site ON sheets (site_id);
+CREATE INDEX IF NOT EXISTS pages_site ON pages (site_id);
+"""
+
+
+class DeclarationStore:
+    """SQLite database of analyzed sites for cross-site queries
+
+    Every declaration of every rule is stored with its site, sheet,
+    selector and media query; selector, media, property and value texts
+    are interned in the strings table. The counted style_guide fields go
+    to facts as (field, value, count) rows, e.g. ('colors.all_colors',
+    '#ffffff', 12). Re-adding a site replaces its previous rows. Each
+    add_analysis() is one transaction of batched executemany() inserts.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.executescript(DECLARATION_STORE_SCHEMA)
+        self._string_ids = {}
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self) -> 'DeclarationStore':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _intern(self, texts: Iterable[str]) -> Dict[str, int]:
+        """Ids of texts, inserting the missing ones; the mapping is cached for the connection"""
+        missing = {text for text in texts if text not in self._string_ids}
+        if missing:
+            self.connection.executemany('INSERT OR IGNORE INTO strings (text) VALUES (?)',
+                                        ((text,) for text in missing))
+            missing = list(missing)
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                self._string_ids.update(self.connection.execute(
+                    f'SELECT text, id FROM strings WHERE text IN ({placeholders})', chunk))
+        return self._string_ids
+
+    def add_analysis(self, analyzer: 'DesignStyleAnalyzer') -> int:
+        """Store the sources, rules and style_guide counts of a finished analysis; returns the site id"""
+        with self.connection:
+            self.connection.execute('DELETE FROM sites WHERE url = ?', (analyzer.url,))
+            site_id = self.connection.execute(
+                'INSERT INTO sites (url, analyzed_at) VALUES (?, ?)',
+                (analyzer.url, time.strftime('%Y-%m-%dT%H:%M:%S'))).lastrowid
+
+            sheet_ids = []
+            for source in analyzer.sources:
+                sheet_ids.append(self.connection.execute(
+                    'INSERT INTO sheets (site_id, kind, url, page_url) VALUES (?, ?, ?, ?)',
+                    (site_id, source['kind'], source['url'], source['page'])).lastrowid)
+                self._add_declarations(site_id, sheet_ids[-1], analyzer.css_rules, *source['rules'])
+
+            for page_url, source_indexes in (analyzer.pages or {analyzer.url: range(len(sheet_ids))}).items():
+                page_id = self.connection.execute('INSERT INTO pages (site_id, url) VALUES (?, ?)',
+                                                  (site_id, page_url)).lastrowid
+                self.connection.executemany('INSERT INTO page_sheets (page_id, sheet_id) VALUES (?, ?)',
+                                            ((page_id, sheet_ids[index]) for index in source_indexes))
+
+            self.connection.executemany(
+                'INSERT INTO facts (site_id, field, value, count) VALUES (?, ?, ?, ?)',
+                ((site_id, path, value, count) for path, kind, counter in analyzer.style_guide.iter_fields()
+                 if kind is Counter for value, count in counter.items()))
+        return site_id
+
+    def _add_declarations(self, site_id: int, sheet_id: int, rules: Sequence, start: int, end: int):
+        for batch_start in range(start, end, DECLARATION_BATCH_RULES):
+            batch = rules[batch_start:min(end, batch_start + DECLARATION_BATCH_RULES)]
+            ids = self._intern(text for rule in batch
+                               for text in (rule['selector'], rule.get('media', ''), *rule['styles'].keys(),
+                                            *rule['styles'].values()))
+            self.connection.executemany(
+                'INSERT INTO declarations (site_id, sheet_id, rule, selector_id, media_id, property_id, value_id) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((site_id, sheet_id, position, ids[rule['selector']], ids[rule.get('media', '')], ids[name],
+                  ids[value])
+                 for position, rule in enumerate(batch, batch_start) for name, value in rule['styles'].items()))
+
+    def sites(self) -> List[Tuple[str, str]]:
+        """(url, analyzed_at) of every stored site"""
+        return self.connection.execute('SELECT url, analyzed_at FROM sites ORDER BY url').fetchall()
+
+    def top_values(self, field: str, limit: int = 10) -> List[Tuple[str, int, int]]:
+        """(value, total count, number of sites) of a style_guide field across all sites, most used first"""
+        return self.connection.execute(
+            'SELECT value, SUM(count) AS total, COUNT(DISTINCT site_id) FROM facts WHERE field = ? '
+            'GROUP BY value ORDER BY total DESC, value LIMIT ?', (field, limit)).fetchall()
+
+    def top_colors(self, limit: int = 10) -> List[Tuple[str, int, int]]:
+        """Most used colors across all sites"""
+        return self.top_values('colors.all_colors', limit)
+
+    def sites_using(self, field: str, value: str) -> List[Tuple[str, int]]:
+        """(site url, count) of the sites whose style_guide field contains value"""
+        return self.connection.execute(
+            'SELECT sites.url, facts.count FROM facts JOIN sites ON sites.id = facts.site_id '
+            'WHERE facts.field = ? AND facts.value = ? ORDER BY facts.count DESC, sites.url',
+            (field, value)).fetchall()
+
+    def sites_with_font(self, family: str) -> List[Tuple[str, str, int]]:
+        """(site url, font stack, count) of the sites whose font-family stacks mention family"""
+        pattern = re.sub(r'([\\%_])', r'\\\1', family)
+        return self.connection.execute(
+            "SELECT sites.url, facts.value, facts.count FROM facts JOIN sites ON sites.id = facts.site_id "
+            "WHERE facts.field = 'typography.font_families' AND facts.value LIKE ? ESCAPE '\\' "
+            "ORDER BY facts.count DESC, sites.url", (f'%{pattern}%',)).fetchall()
+
+    def declarations(self, prop: str, value: Optional[str] = None,
+                     site: Optional[str] = None) -> List[Tuple[str, str, str, str, str]]:
+        """(site url, sheet url, selector, media, value) of the stored declarations of prop"""
+        query = ('SELECT sites.url, sheets.url, selector.text, media.text, value.text FROM declarations '
+                 'JOIN sites ON sites.id = declarations.site_id '
+                 'JOIN sheets ON sheets.id = declarations.sheet_id '
+                 'JOIN strings AS selector ON selector.id = declarations.selector_id '
+                 'JOIN strings AS media ON media.id = declarations.media_id '
+                 'JOIN strings AS value ON value.id = declarations.value_id '
+                 'WHERE declarations.property_id = (SELECT id FROM strings WHERE text = ?)')
+        params = [prop]
+        if value is not None:
+            query += ' AND declarations.value_id = (SELECT id FROM strings WHERE text = ?)'
+            params.append(value)
+        if site is not None:
+            query += ' AND sites.url = ?'
+            params.append(site)
+        return self.connection.execute(query + ' ORDER BY declarations.rowid', params).fetchall()
+
+
+class HostRateLimiter:
+    """Spaces requests to the same host at least min_interval seconds apart, across threads
+
+    Slots are reserved under a lock, so concurrent callers for one host
+    queue up in arrival order while other hosts proceed independently.
+    """
+
+    def __init__(self, min_interval: float = DEFAULT_HOST_INTERVAL):
+        self.min_interval = min_interval
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url: str, deadline: Optional[float] = None):
+        """Block until url's host may be requested; raises TimeoutError if that is past deadline"""
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            if deadline is not None and slot > deadline:
+                raise TimeoutError(f"deadline passed before {url} could be requested")
+            self._next_slot[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def timed_phase(name: str) -> Callable:
+    """Method decorator adding the call's wall time to self.metrics under name"""
+    def decorate(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.phase(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class RunMetrics:
+    """Per-phase wall-clock timers and counters of one analyzer run
+
+    phase() timers accumulate, so a phase entered many times (e.g. parse
+    and analyze inside the pipeline) reports its total. Counters may be
+    bumped from fetch threads.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = Counter()
+        self.extra = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def to_dict(self) -> Dict:
+        """JSON-compatible metrics, with derived throughput rates"""
+        rates = {}
+        if self.phases.get('parse') and self.counters['rules']:
+            rates['rules_per_second'] = self.counters['rules'] / self.phases['parse']
+        if self.phases.get('analyze') and self.counters['rules']:
+            rates['rules_analyzed_per_second'] = self.counters['rules'] / self.phases['analyze']
+        return dict(self.extra, phases=dict(self.phases), counters=dict(self.counters), rates=rates)
+
+    def log_summary(self):
+        for name, seconds in self.phases.items():
+            logger.info(f"   {name:<12} {seconds:8.3f}s")
+        for name, value in sorted(self.counters.items()):
+            logger.info(f"   {name:<20} {value}")
+
+    def write(self, path: str):
+        """JSON metrics sink"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
 
 class DesignStyleAnalyzer:
-    def __init__(self, url: str):
+    # Categories reported in their own report sections rather than under Detected Components
+    REPORTED_CATEGORIES = {'heading', 'body', 'button', 'card', 'navigation'}
+
+    def __init__(self, url: str, fetch_workers: int = DEFAULT_FETCH_WORKERS,
+                 http_cache: Optional[HTTPCache] = None,
+                 sheet_cache: Optional[ParsedSheetCache] = None,
+                 parser_backend: str = DEFAULT_PARSER_BACKEND,
+                 parse_workers: int = 0,
+                 pipeline: bool = False,
+                 compact_rules: bool = False,
+                 selector_classifier: Optional[SelectorClassifier] = None,
+                 palette_threshold: float = DEFAULT_PALETTE_DELTA_E,
+                 session: Optional[requests.Session] = None,
+                 rate_limiter: Optional[HostRateLimiter] = None,
+                 deadline: Optional[float] = None,
+                 request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+                 max_body_bytes: int = DEFAULT_MAX_BODY_BYTES,
+                 spill_bytes: Optional[int] = DEFAULT_SPILL_BYTES,
+                 html_backend: str = DEFAULT_HTML_BACKEND,
+                 style_attributes: bool = True,
+                 dom_weighting: bool = False,
+                 coverage: bool = False,
+                 report_sections: Optional[Iterable[str]] = None,
+                 full_aggregate: bool = False):
         self.url = url
         self.domain = urlparse(url).netloc
+        self.fetch_workers = max(1, fetch_workers)
+        # A batch passes one session (connection pool) for all its analyzers
+        self.session = session if session is not None else create_session(self.fetch_workers)
+        self.rate_limiter = rate_limiter
+        # time.monotonic() value after which no further requests are made
+        self.deadline = deadline
+        self.request_timeout = request_timeout
+        # Larger bodies are refused; stylesheets over spill_bytes are memory-mapped from a temp file
+        self.max_body_bytes = max_body_bytes
+        self.spill_bytes = spill_bytes
+        self.http_cache = http_cache
+        self.sheet_cache = sheet_cache
+        self.parser_backend = parser_backend
+        self.html_backend = html_backend
+        # Analyze style="" attributes as one extra inline source per page
+        self.style_attributes = style_attributes
+        # Weight statistics by the DOM elements each rule matches instead of counting declarations
+        self.dom_weighting = dom_weighting
+        # Record which pages each rule matches anything on (see coverage_report)
+        self.coverage = coverage
+        # REPORT_SECTIONS to render, in rendering order; None renders (and analyzes) everything
+        self.report_sections = None
+        if report_sections is not None:
+            required_analyses(report_sections)
+            self.report_sections = [section for section in REPORT_SECTIONS if section in report_sections]
+        # Analyze every section whatever is rendered, because style_guide is stored or saved afterwards
+        self.full_aggregate = full_aggregate
+        # Worker processes for parse_css; 0 or 1 parses in-process
+        self.parse_workers = parse_workers
+        # Stream fetch -> parse -> analyze instead of running them as stages
+        self.pipeline = pipeline
         self.html = None
-        self.soup = None
-        self.css_rules = []
-        self.style_guide = {
-            'typography': {
-                'font_families': Counter(),
-                'font_sizes': Counter(),
-                'font_weights': Counter(),
-                'line_heights': Counter(),
-                'letter_spacing': Counter(),
-                'heading_styles': {},
-                'body_styles': {}
-            },
-            'colors': {
-                'all_colors': Counter(),
-                'background_colors': Counter(),
-                'text_colors': Counter(),
-                'border_colors': Counter()
-            },
-            'layout': {
-                'display_types': Counter(),
-                'grid_usage': [],
-                'flexbox_usage': [],
-                'spacing': {
-                    'margins': Counter(),
-                    'paddings': Counter()
-                },
-                'border_radius': Counter(),
-                'max_widths': Counter()
-            },
-            'visual_effects': {
-                'box_shadows': Counter(),
-                'text_shadows': Counter(),
-                'transitions': Counter(),
-                'transforms': Counter()
-            },
-            'ui_patterns': {
-                'button_styles': [],
-                'card_styles': [],
-                'navigation_styles': []
-            }
-        }
+        self.page_assets = None
+        self.dom = None
+        self.selector_classifier = selector_classifier or SelectorClassifier()
+        self.palette_threshold = palette_threshold
+        # Plain list of rule dicts, or interned columnar storage for huge sheets
+        self.css_rules = CompactRuleStore() if compact_rules else []
+        # CSS sources added through add_source, and crawled page -> source indexes
+        self.sources = []
+        self.css_source_urls = []
+        self.pages = {}
+        # (matched elements, elements in the matched subtrees) per css_rules position, see record_matches
+        self.rule_weights = []
+        # Bitset over page indexes (order of self.pages) of the pages each css_rules position matches on
+        self.rule_coverage = []
+        # css_rules positions whose selectors the matcher cannot evaluate
+        self.unmatchable_rules = set()
+        # css_rules positions that have so far only matched depending on state such as :hover
+        self.state_dependent_rules = set()
+        self._rule_hashes = {}
+        # @import resolution: shared fetches, stylesheet -> direct (import URL, condition) pairs,
+        # URLs already expanded
+        self._import_pool = None
+        self._import_fetches = {}
+        self._imports_lock = threading.Lock()
+        self.import_graph = {}
+        # Sheet URL -> (body hash, imports) an incremental run may skip reading (see UnchangedBody)
+        self._known_bodies = {}
+        self._expanded_sheets = set()
+        # Imported sheets whose text was wrapped in @media/@supports blocks, so it differs from the fetched body
+        self._media_wrapped = set()
+        # Inverted indexes: property name / selector token -> positions in css_rules,
+        # as compact unsigned int arrays alongside a CompactRuleStore
+        postings = partial(array, 'I') if compact_rules else list
+        self.property_index = defaultdict(postings)
+        self.selector_index = defaultdict(postings)
+        self.style_guide = StyleGuideAggregate(sources=[url])
+        self.rule_handlers = self._build_rule_handlers()
+        self.metrics = RunMetrics()
+        # Why a run_* method returned no report, e.g. the fetch error; only meaningful after a failure
+        self.failure = None
 
+    @timed_phase('fetch_html')
     def fetch_html(self):
         """Fetch the HTML content of the target URL"""
-        print(f"Fetching HTML from {self.url}...")
+        logger.info(f"Fetching HTML from {self.url}...")
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            response = requests.get(self.url, headers=headers, timeout=10)
-            response.raise_for_status()
-            self.html = response.text
-            self.soup = BeautifulSoup(self.html, 'html.parser')
-            print("HTML fetched successfully")
+            self.html = self.http_get(self.url)
+            self.page_assets = self.extract_page_assets(self.html)
+            self.dom = self.page_assets.dom
+            logger.info("HTML fetched successfully")
             return True
         except Exception as e:
-            print(f"Error fetching HTML: {e}")
+            logger.error(f"Error fetching HTML: {e}")
+            self.failure = f"{type(e).__name__}: {e}"
             return False
 
-    def extract_css_files(self):
-        """Extract and fetch external CSS files"""
-        print("\nExtracting CSS files...")
-        css_contents = []
+    @property
+    def needs_dom(self) -> bool:
+        return self.dom_weighting or self.coverage
+
+    @property
+    def analysis_sections(self) -> List[str]:
+        """The rule_handlers sections the requested report sections depend on, in dispatch order"""
+        if self.report_sections is None or self.full_aggregate:
+            return list(self.rule_handlers)
+        required = required_analyses(self.report_sections)
+        return [section for section in self.rule_handlers if section in required]
+
+    def extract_page_assets(self, html: str, dom: Optional[bool] = None) -> PageAssets:
+        """Run the configured HTML backend over one page, building its DOMTree if needs_dom (or dom)"""
+        assets = HTML_BACKENDS[self.html_backend].extract(html, dom=self.needs_dom if dom is None else dom)
+        self.metrics.count('style_attributes', len(assets.style_attributes))
+        if assets.dom is not None:
+            self.metrics.count('dom_elements', len(assets.dom))
+        return assets
+
+    def page_dom(self, html: str) -> DOMTree:
+        """DOMTree of a page whose assets were already extracted"""
+        dom = HTML_BACKENDS[self.html_backend].extract(html, dom=True).dom
+        self.metrics.count('dom_elements', len(dom))
+        return dom
+
+    def page_style_blocks(self, assets: PageAssets) -> List[str]:
+        """The inline CSS of a page: its <style> blocks, then its style="" attributes if enabled"""
+        blocks = list(assets.style_blocks)
+        if self.style_attributes:
+            attribute_sheet = style_attribute_sheet(assets.style_attributes)
+            if attribute_sheet:
+                blocks.append(attribute_sheet)
+        return blocks
+
+    def http_get(self, url: str, spill: bool = False):
+        """GET url over the shared session, through the HTTP cache when one is configured
+
+        The body is streamed and refused past max_body_bytes. With spill, a
+        body over spill_bytes comes back as a SpilledBody instead of a str.
+        Honours the rate limiter and deadline of a batch run, if any.
+        """
+        timeout = self.request_timeout
+        if self.deadline is not None:
+            timeout = min(timeout, self.deadline - time.monotonic())
+            if timeout <= 0:
+                raise TimeoutError(f"deadline passed before {url} could be requested")
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait(url, self.deadline)
+        spill_bytes = self.spill_bytes if spill else None
+
+        # Bytes, not characters: a spilled body is never decoded as a whole
+        def count_bytes(chunk: bytes):
+            self.metrics.count('bytes_fetched', len(chunk))
+
+        if self.http_cache is not None:
+            known_body, imports = self._known_bodies.get(url, (None, ()))
+            text = self.http_cache.get(self.session, url, timeout=timeout, max_bytes=self.max_body_bytes,
+                                       spill_bytes=spill_bytes, deadline=self.deadline, sink=count_bytes,
+                                       known_body=known_body)
+            if isinstance(text, UnchangedBody):
+                text.imports = list(imports)
+                self.metrics.count('unchanged_bodies')
+        else:
+            with open_stream(self.session, url, timeout=timeout, max_bytes=self.max_body_bytes) as response:
+                response.raise_for_status()
+                text = read_body(response.iter_content(DOWNLOAD_CHUNK_BYTES), response_encoding(response),
+                                 max_bytes=self.max_body_bytes, spill_bytes=spill_bytes, sink=count_bytes,
+                                 deadline=self.deadline)
+        self.metrics.count('requests')
+        if isinstance(text, SpilledBody):
+            self.metrics.count('spilled_bodies')
+        return text
+
+    def _fetch_page(self, page_url: str) -> Tuple[Optional[str], Optional[str]]:
+        """Fetch one crawled page; returns (html, error)"""
+        try:
+            return self.http_get(page_url), None
+        except Exception as e:
+            return None, f"{type(e).__name__}: {e}"
+
+    def _page_links(self, page_url: str, assets: PageAssets) -> List[str]:
+        """Same-domain page links of a crawled page, in document order and without fragments"""
+        links = []
+        for href in assets.links:
+            link, _ = urldefrag(urljoin(page_url, href))
+            parsed = urlparse(link)
+            if parsed.scheme not in ('http', 'https') or parsed.netloc != self.domain:
+                continue
+            if os.path.splitext(parsed.path)[1].lower() in NON_PAGE_EXTENSIONS:
+                continue
+            links.append(link)
+        return links
+
+    def add_source(self, kind: str, url: str, records: List[RuleRecord], page: Optional[str] = None) -> int:
+        """Add the rules of one CSS source and remember which css_rules range it produced"""
+        start = len(self.css_rules)
+        for selector, styles, media in records:
+            self.add_rule(selector, styles, media)
+        self.sources.append({
+            'kind': kind,
+            'url': url,
+            'page': page,
+            'rules': (start, len(self.css_rules))
+        })
+        return len(self.sources) - 1
+
+    def add_page_source(self, css_url: str, records: List[RuleRecord]) -> int:
+        """add_source for a CSS source of the analyzed page; inline blocks carry the page URL"""
+        if css_url == self.url:
+            index = self.add_source('inline', css_url, records, page=self.url)
+        else:
+            index = self.add_source('stylesheet', css_url, records)
+        if self.dom is not None:
+            self.record_matches([self.sources[index]['rules']], self.dom)
+        return index
+
+    def match_rules(self, ranges: List[Tuple[int, int]], dom: DOMTree,
+                    uncertain: Optional[Set[int]] = None) -> Dict[int, List[DOMElement]]:
+        """css_rules position -> elements of dom it matches, for the rules in the given ranges
+
+        The RuleHash of each range is built once and reused, so a stylesheet
+        shared by many crawled pages is indexed only once. Positions that
+        only possibly match are added to uncertain (see RuleHash.match).
+        """
+        matched = {}
+        for start, end in ranges:
+            rule_hash = self._rule_hashes.get((start, end))
+            if rule_hash is None:
+                rule_hash = RuleHash()
+                for position in range(start, end):
+                    rule_hash.add(position, self.css_rules[position]['selector'])
+                self.metrics.count('unsupported_selectors', len(rule_hash.unsupported))
+                self.unmatchable_rules.update(rule_hash.unsupported)
+                self._rule_hashes[(start, end)] = rule_hash
+            matched.update(rule_hash.match(dom, uncertain))
+        return matched
+
+    @timed_phase('match')
+    def record_matches(self, ranges: List[Tuple[int, int]], dom: DOMTree, page: int = 0):
+        """Match the rules in ranges against dom, the page-th page, and record the result
+
+        With dom_weighting, what each rule styles is added to rule_weights:
+        the number of elements it matches, plus the size of the subtrees
+        under them for inherited properties. Overrides are not resolved, so
+        both are upper bounds, and weights of a rule used by several pages
+        add up. With coverage, the page's bit is set in the rule_coverage
+        of every rule that matches at least one element. A possible match
+        (see match_selector) counts as a match for both; with coverage, rules
+        that never match definitely are kept in state_dependent_rules.
+        """
+        uncertain = set() if self.coverage else None
+        matched = self.match_rules(ranges, dom, uncertain)
+        if self.dom_weighting:
+            self.rule_weights.extend([(0, 0)] * (len(self.css_rules) - len(self.rule_weights)))
+            for position, elements in matched.items():
+                weight, covered = self.rule_weights[position]
+                self.rule_weights[position] = (weight + len(elements), covered + covered_elements(elements))
+        if self.coverage:
+            self.rule_coverage.extend([0] * (len(self.css_rules) - len(self.rule_coverage)))
+            bit = 1 << page
+            for position in matched:
+                if position not in uncertain:
+                    self.state_dependent_rules.discard(position)
+                elif not self.rule_coverage[position]:
+                    self.state_dependent_rules.add(position)
+                self.rule_coverage[position] |= bit
+
+    @timed_phase('crawl')
+    def crawl(self, max_depth: int = DEFAULT_CRAWL_DEPTH, max_pages: int = DEFAULT_CRAWL_PAGES,
+              concurrency: int = DEFAULT_CRAWL_CONCURRENCY) -> int:
+        """Breadth-first crawl of same-domain pages, collecting their CSS into css_rules
+
+        Pages are fetched a BFS level at a time with up to concurrency
+        requests in flight, and the crawl stops after max_depth link hops or
+        max_pages pages. Every distinct stylesheet URL is fetched and parsed
+        once for the whole site, as soon as a page first links it; inline
+        <style> blocks are kept per page. self.pages maps each crawled page
+        to the indexes of the sources (see add_source) it uses. Returns the
+        number of pages crawled.
+        """
+        logger.info(f"Crawling {self.url} (depth {max_depth}, up to {max_pages} pages)...")
+        seen = {urldefrag(self.url)[0]}
+        frontier = [urldefrag(self.url)[0]]
+        crawled = []
+        sheet_futures = {}
+        # Pages are matched one at a time after parsing, so only their (compressed) HTML is kept
+        page_html = {}
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as page_pool, \
+                    ThreadPoolExecutor(max_workers=self.fetch_workers) as sheet_pool:
+                for depth in range(max_depth + 1):
+                    if not frontier or len(crawled) >= max_pages:
+                        break
+                    level = frontier[:max_pages - len(crawled)]
+                    frontier = []
+
+                    for page_url, (html, error) in zip(level, page_pool.map(self._fetch_page, level)):
+                        if error is not None:
+                            self.metrics.count('fetch_errors')
+                            logger.warning(f"    Could not fetch page {page_url}: {error}")
+                            self.failure = self.failure or f"{page_url}: {error}"
+                            continue
+                        logger.info(f"   Page: {page_url}")
+                        assets = self.extract_page_assets(html, dom=False)
+                        if not crawled:
+                            self.html, self.page_assets = html, assets
+                        if self.needs_dom:
+                            page_html[page_url] = zlib.compress(html.encode('utf-8', errors='surrogatepass'))
+
+                        sheet_urls = [urljoin(page_url, href) for href in assets.stylesheets]
+                        for sheet_url in sheet_urls:
+                            if sheet_url not in sheet_futures:
+                                sheet_futures[sheet_url] = sheet_pool.submit(self.fetch_css, sheet_url)
+                        inline = self.page_style_blocks(assets)
+                        crawled.append((page_url, sheet_urls, inline))
+
+                        if depth < max_depth:
+                            for link in self._page_links(page_url, assets):
+                                if link not in seen:
+                                    seen.add(link)
+                                    frontier.append(link)
+
+                # Collect each distinct stylesheet once, in first-seen order, behind its imports
+                sheet_texts = {}
+                for sheet_url, future in sheet_futures.items():
+                    css_text, error, elapsed = future.result()
+                    if error is None:
+                        logger.info(f"   Stylesheet: {sheet_url} ({css_size(css_text)} in {elapsed:.2f}s)")
+                        sheet_texts.update(self.expand_imports(sheet_url, css_text))
+                    else:
+                        self.metrics.count('fetch_errors')
+                        logger.warning(f"    Could not fetch {sheet_url}: {error}")
+
+            # Parse every distinct sheet and every page's inline blocks in one batch
+            sheet_urls = list(sheet_texts)
+            inline_blocks = [(page_url, expanded_url, css_text)
+                             for page_url, _, inline in crawled for block in inline
+                             for expanded_url, css_text in self.expand_inline_imports(page_url, block)]
+            parsed = self.parse_stylesheets([sheet_texts[url] for url in sheet_urls] +
+                                            [css_text for _, _, css_text in inline_blocks])
+        finally:
+            self.release_imports()
+            # Already closed once parsed; this covers a crawl that failed before parsing
+            for future in sheet_futures.values():
+                if future.done() and not future.cancelled():
+                    close_css(future.result()[0])
+
+        sheet_sources = {url: self.add_source('stylesheet', url, records)
+                         for url, records in zip(sheet_urls, parsed)}
+        inline_sources = defaultdict(list)
+        for (page_url, expanded_url, _), records in zip(inline_blocks, parsed[len(sheet_urls):]):
+            kind = 'inline' if expanded_url == page_url else 'stylesheet'
+            inline_sources[page_url].append(self.add_source(kind, expanded_url, records, page=page_url))
+
+        for page_url, page_sheets, _ in crawled:
+            used = [sheet_sources[url] for url in self._import_closure(page_sheets) if url in sheet_sources]
+            self.pages[page_url] = used + inline_sources[page_url]
+            if page_url in page_html:
+                html = zlib.decompress(page_html.pop(page_url)).decode('utf-8', errors='surrogatepass')
+                self.record_matches([self.sources[index]['rules'] for index in self.pages[page_url]],
+                                    self.page_dom(html), page=len(self.pages) - 1)
+
+        logger.info(f" Crawled {len(self.pages)} pages, {len(sheet_sources)} unique stylesheets, "
+                    f"{len(self.css_rules)} CSS rules")
+        return len(self.pages)
+
+    def _import_closure(self, sheet_urls: List[str]) -> List[str]:
+        """sheet_urls plus everything they transitively @import, imports first"""
+        closure = {}
+
+        def visit(url, path):
+            for import_url, _ in self.import_graph.get(url, []):
+                if import_url not in closure and import_url not in path:
+                    visit(import_url, path | {import_url})
+            closure.setdefault(url, None)
+
+        for url in sheet_urls:
+            visit(url, {url})
+        return list(closure)
+
+    def fetch_css(self, css_url: str) -> Tuple[Optional[str], Optional[str], float]:
+        """Fetch one stylesheet over the shared session
+
+        Returns (css_text, error, seconds); exactly one of css_text/error is set.
+        css_text is a SpilledBody for sheets over spill_bytes.
+        """
+        start = time.perf_counter()
+        try:
+            return self.http_get(css_url, spill=True), None, time.perf_counter() - start
+        except Exception as e:
+            return None, str(e), time.perf_counter() - start
+
+    def _fetch_import(self, css_url: str) -> Tuple[Optional[str], Optional[str], float]:
+        """fetch_css for an imported sheet that also starts fetching the sheets it imports"""
+        result = self.fetch_css(css_url)
+        if result[0] is not None:
+            for href, _ in stylesheet_imports(result[0]):
+                self._prefetch_import(urljoin(css_url, href))
+        return result
+
+    def _prefetch_import(self, css_url: str) -> Future:
+        """Fetch future for css_url, submitted at most once per analyzer"""
+        with self._imports_lock:
+            future = self._import_fetches.get(css_url)
+            if future is None:
+                if self._import_pool is None:
+                    self._import_pool = ThreadPoolExecutor(max_workers=self.fetch_workers,
+                                                           thread_name_prefix='css-import')
+                future = self._import_pool.submit(self._fetch_import, css_url)
+                self._import_fetches[css_url] = future
+            return future
+
+    def release_imports(self):
+        """Shut down the @import fetch pool and drop the fetched import texts
+
+        Called once a run has expanded all its sources; a later expansion
+        starts a new pool. Imports still being fetched are waited for,
+        queued ones are cancelled.
+        """
+        with self._imports_lock:
+            pool = self._import_pool
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        with self._imports_lock:
+            if self._import_pool is pool:
+                self._import_pool = None
+            # Expanded imports belong to their consumer now; the rest were fetched for nothing
+            for css_url, future in self._import_fetches.items():
+                if css_url not in self._expanded_sheets and future.done() and not future.cancelled():
+                    close_css(future.result()[0])
+            self._import_fetches.clear()
 
-        # Find all link tags with rel="stylesheet"
-        link_tags = self.soup.find_all('link', rel='stylesheet')
+    def expand_imports(self, css_url: str, css_text: str) -> List[Tuple[str, str]]:
+        """A stylesheet preceded by everything it @imports, as (url, text) in cascade order
 
-        for link in link_tags:
-            href = link.get('href')
-            if not href:
+        Imports are fetched concurrently: all imports of a sheet are requested
+        at once, and each imported sheet requests its own imports as soon as
+        it arrives, so only genuinely chained imports wait on each other.
+        Every URL is expanded once per analyzer (later references are
+        dropped) and import cycles are cut. Sheets imported with a condition
+        are wrapped in the @supports/@media blocks it stands for (see
+        import_condition_rules) so the parsers attach the context.
+        """
+        expanded = []
+        if css_url not in self._expanded_sheets:
+            self._expanded_sheets.add(css_url)
+            self._expand_imports(css_url, css_text, (), (css_url,), expanded)
+        else:
+            close_css(css_text)
+        return expanded
+
+    def expand_inline_imports(self, page_url: str, css_text: str) -> List[Tuple[str, str]]:
+        """expand_imports for an inline <style> block, resolving imports against page_url"""
+        expanded = []
+        self._expand_imports(page_url, css_text, (), (page_url,), expanded, record_graph=False)
+        return expanded
+
+    def _expand_imports(self, css_url: str, css_text: str, wrappers: Tuple[str, ...], path: Tuple[str, ...],
+                        expanded: List[Tuple[str, str]], record_graph: bool = True):
+        imports = [(urljoin(css_url, href), query) for href, query in stylesheet_imports(css_text)]
+        if record_graph:
+            self.import_graph[css_url] = imports
+        for import_url, _ in imports:
+            self._prefetch_import(import_url)
+
+        for import_url, condition in imports:
+            if import_url in path:
+                logger.warning(f"    Skipping import cycle: {' -> '.join(path + (import_url,))}")
                 continue
+            if import_url in self._expanded_sheets:
+                continue
+            self._expanded_sheets.add(import_url)
+
+            import_text, error, elapsed = self._prefetch_import(import_url).result()
+            if error is not None:
+                self.metrics.count('fetch_errors')
+                logger.warning(f"    Could not fetch import {import_url}: {error}")
+                continue
+            logger.info(f"   Imported: {import_url} ({css_size(import_text)} in {elapsed:.2f}s)")
+            child_wrappers = wrappers + tuple(import_condition_rules(condition))
+            self._expand_imports(import_url, import_text, child_wrappers, path + (import_url,), expanded)
+
+        if wrappers:
+            # Wrapping needs the text itself, so a spilled sheet is materialised here
+            spilled, css_text = css_text, css_text_of(css_text)
+            close_css(spilled)
+            self._media_wrapped.add(css_url)
+        for prelude in reversed(wrappers):
+            css_text = f"{prelude} {{\n{css_text}\n}}"
+        expanded.append((css_url, css_text))
 
-            # Convert relative URLs to absolute
-            css_url = urljoin(self.url, href)
+    def iter_css_sources(self) -> Iterator[str]:
+        """Yield the page's CSS sources in document order (see iter_css_sources_with_urls)"""
+        for _, css_text in self.iter_css_sources_with_urls():
+            yield css_text
 
+    def iter_css_sources_with_urls(self) -> Iterator[Tuple[str, str]]:
+        """Yield (url, text) for the page's CSS sources in document order as soon as each is available
+
+        Linked stylesheets are downloaded concurrently, with at most
+        2 * fetch_workers downloads in flight so a slow consumer bounds the
+        number of fetched-but-unconsumed bodies. Inline <style> blocks follow,
+        then the page's style="" attributes as one sheet (see style_attribute_sheet).
+        Each source is preceded by the sheets it @imports (see expand_imports).
+        Inline blocks are labelled with the page URL. The import fetch pool
+        is released once the sources are exhausted or the iteration stops.
+        """
+        logger.info("\nExtracting CSS files...")
+        try:
+            yield from self._iter_css_sources_with_urls()
+        finally:
+            self.release_imports()
+
+    def _iter_css_sources_with_urls(self) -> Iterator[Tuple[str, str]]:
+        count = 0
+
+        # Convert relative URLs of the <link rel="stylesheet"> tags to absolute, keeping document order
+        css_urls = iter([urljoin(self.url, href) for href in self.page_assets.stylesheets])
+
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+            in_flight = deque((css_url, executor.submit(self.fetch_css, css_url))
+                              for css_url in islice(css_urls, 2 * self.fetch_workers))
             try:
-                print(f"   Fetching: {css_url}")
-                response = requests.get(css_url, timeout=10)
-                response.raise_for_status()
-                css_contents.append(response.text)
-                print(f"   Fetched ({len(response.text)} chars)")
-            except Exception as e:
-                print(f"    Could not fetch {css_url}: {e}")
+                while in_flight:
+                    css_url, future = in_flight.popleft()
+                    next_url = next(css_urls, None)
+                    if next_url is not None:
+                        in_flight.append((next_url, executor.submit(self.fetch_css, next_url)))
+
+                    css_text, error, elapsed = future.result()
+                    logger.info(f"   Fetching: {css_url}")
+                    if error is None:
+                        logger.info(f"   Fetched ({css_size(css_text)} in {elapsed:.2f}s)")
+                        for expanded in self.expand_imports(css_url, css_text):
+                            count += 1
+                            self.metrics.count('sources')
+                            yield expanded
+                    else:
+                        self.metrics.count('fetch_errors')
+                        logger.warning(f"    Could not fetch {css_url}: {error}")
+            finally:
+                # The iteration stopped early: nobody will parse the sheets still being fetched
+                for _, future in in_flight:
+                    if not future.cancel():
+                        close_css(future.result()[0])
 
         # Extract inline styles
-        style_tags = self.soup.find_all('style')
-        for style in style_tags:
-            if style.string:
-                css_contents.append(style.string)
+        for block in self.page_style_blocks(self.page_assets):
+            for expanded in self.expand_inline_imports(self.url, block):
+                count += 1
+                self.metrics.count('sources')
+                yield expanded
 
-        print(f" Extracted {len(css_contents)} CSS sources")
-        return css_contents
+        logger.info(f" Extracted {count} CSS sources")
 
-    def parse_css(self, css_contents: List[str]):
-        """Parse CSS and extract style rules"""
-        print("\n Parsing CSS rules...")
+    @timed_phase('extract')
+    def extract_css_files(self):
+        """Extract and fetch external CSS files; their URLs are kept in css_source_urls"""
+        sources = list(self.iter_css_sources_with_urls())
+        self.css_source_urls = [css_url for css_url, _ in sources]
+        return [css_text for _, css_text in sources]
+
+    @timed_phase('pipeline')
+    def run_pipeline(self, sections: Optional[List[str]] = None) -> int:
+        """Fetch, parse and analyze stylesheets as a streaming pipeline
 
-        for css_text in css_contents:
+        A producer thread pushes each CSS source into a bounded queue as soon
+        as it arrives; this thread parses it and folds its rules into
+        style_guide straight away, so parsing overlaps the remaining
+        downloads. Sources are consumed in document order, which keeps the
+        results identical to the staged run. Returns the number of sources.
+        If this side fails, the producer is stopped and joined before the
+        error propagates.
+        """
+        sections = list(self.rule_handlers) if sections is None else sections
+        sources = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        stopped = threading.Event()
+        done = object()
+
+        def put(item) -> bool:
+            while not stopped.is_set():
+                try:
+                    sources.put(item, timeout=PIPELINE_STOP_POLL)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
             try:
-                sheet = cssutils.parseString(css_text)
-                for rule in sheet:
-                    if rule.type == rule.STYLE_RULE:
-                        self.css_rules.append({
-                            'selector': rule.selectorText,
-                            'styles': {prop.name: prop.value for prop in rule.style}
-                        })
+                for source in self.iter_css_sources_with_urls():
+                    if not put(source):
+                        return
             except Exception as e:
-                print(f"    Error parsing CSS: {e}")
+                put(e)
+            finally:
+                put(done)
 
-        print(f" Parsed {len(self.css_rules)} CSS rules")
+        producer = threading.Thread(target=produce, name='css-producer', daemon=True)
+        producer.start()
 
-    def extract_colors(self, value: str) -> List[str]:
-        """Extract color values from CSS property values"""
-        colors = []
+        count = 0
+        try:
+            while True:
+                item = sources.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                count += 1
+                css_url, css_text = item
+                try:
+                    with self.metrics.phase('parse'):
+                        records = self.parse_stylesheet(css_text)
+                except Exception as e:
+                    self.metrics.count('parse_errors')
+                    logger.warning(f"    Error parsing CSS: {e}")
+                    continue
+                finally:
+                    close_css(css_text)
+                start = len(self.css_rules)
+                self.add_page_source(css_url, records)
+                self.fold_rules(sections, start)
+        finally:
+            stopped.set()
+            producer.join()
+            while not sources.empty():
+                item = sources.get()
+                if isinstance(item, tuple):
+                    close_css(item[1])
+        return count
+
+    @timed_phase('incremental')
+    def analyze_incremental(self, previous: Optional[AnalysisSnapshot] = None,
+                            keep_rules: bool = False) -> Tuple[AnalysisSnapshot, int]:
+        """Analyze the page's CSS, reusing previous per-sheet contributions where the text is unchanged
+
+        Only sheets whose hash is not in the (compatible) previous snapshot
+        are parsed; removed sheets simply drop out of the reduction. The
+        results are merged into style_guide; css_rules only receives the
+        rules of the re-parsed sheets, unless keep_rules also adds reused
+        sheets as sources (their records come from the parse cache when
+        one is configured), e.g. for a DeclarationStore. Returns the new
+        snapshot and the number of reused sheets.
+
+        With an HTTPCache, a sheet whose body hash (known from the cache
+        after a 304) matches the previous snapshot is recognised without
+        reading its body: its imports come from the snapshot too (see
+        UnchangedBody). Contributions are folded without DOM weights, and
+        reused sheets never take part in DOM weighting or coverage.
+        """
+        compatible = previous is not None and previous.compatible(self.parser_backend)
+        known = previous.contributions() if compatible else {}
+        known_bodies = {url: (previous.bodies[url], digest) for url, digest, _ in previous.sheets
+                        if url in previous.bodies} if compatible else {}
+        self._known_bodies = {url: (body, previous.imports[url]) for url, (body, _) in known_bodies.items()
+                              if url in previous.imports}
+        snapshot = AnalysisSnapshot(self.url, self.parser_backend)
+        reused = 0
+
+        try:
+            for css_url, css_text in self.iter_css_sources_with_urls():
+                try:
+                    body = self._served_body(css_url)
+                    if body is not None and known_bodies.get(css_url, (None,))[0] == body:
+                        digest = known_bodies[css_url][1]
+                    else:
+                        digest = AnalysisSnapshot.digest(css_text)
+                    if body is not None:
+                        snapshot.bodies[css_url] = body
+                    aggregate = known.get(digest)
+                    if aggregate is not None:
+                        reused += 1
+                        if keep_rules:
+                            try:
+                                with self.metrics.phase('parse'):
+                                    self.add_page_source(css_url, self.parse_stylesheet(css_text))
+                            except Exception as e:
+                                self.metrics.count('parse_errors')
+                                logger.warning(f"    Error parsing CSS: {e}")
+                    else:
+                        try:
+                            with self.metrics.phase('parse'):
+                                records = self.parse_stylesheet(css_text)
+                        except Exception as e:
+                            self.metrics.count('parse_errors')
+                            logger.warning(f"    Error parsing CSS: {e}")
+                            continue
+                        self.add_page_source(css_url, records)
+                        # Snapshots keep every section so later runs can reuse them whatever they render
+                        aggregate = self.fold_records(records)
+                    snapshot.sheets.append((css_url, digest, aggregate))
+                    if body is not None and css_url in self.import_graph:
+                        snapshot.imports[css_url] = self.import_graph[css_url]
+                finally:
+                    close_css(css_text)
+        finally:
+            self._known_bodies = {}
 
-        # Hex colors
-        hex_pattern = r'#[0-9a-fA-F]{3,8}'
-        colors.extend(re.findall(hex_pattern, value))
+        for _, _, aggregate in snapshot.sheets:
+            self.style_guide.update(aggregate)
+        logger.info(f" Reused {reused} of {len(snapshot.sheets)} CSS sources from the snapshot")
+        return snapshot, reused
 
-        # RGB/RGBA
-        rgb_pattern = r'rgba?\([^)]+\)'
-        colors.extend(re.findall(rgb_pattern, value))
+    def _served_body(self, css_url: str) -> Optional[str]:
+        """HTTPCache body hash of a linked or imported sheet, if its CSS source text is exactly that body"""
+        if self.http_cache is None or css_url == self.url or css_url in self._media_wrapped:
+            return None
+        return self.http_cache.bodies.get(css_url)
+
+    @timed_phase('parse')
+    def parse_css(self, css_contents: List[str]):
+        """Parse CSS and extract style rules"""
+        logger.info("\n Parsing CSS rules...")
+
+        # Sources come from extract_css_files unless the caller passed its own texts
+        urls = self.css_source_urls
+        if len(urls) != len(css_contents):
+            urls = [self.url] * len(css_contents)
+        for css_url, records in zip(urls, self.parse_stylesheets(css_contents)):
+            self.add_page_source(css_url, records)
+
+        logger.info(f" Parsed {len(self.css_rules)} CSS rules")
+        if self.sheet_cache is not None:
+            logger.info(f"   Parse cache: {self.sheet_cache.stats['hits']} hits")
+
+    def parse_stylesheet(self, css_text: str) -> List[RuleRecord]:
+        """Parse one stylesheet with the configured backend, skipping it on a parse-cache hit"""
+        if self.sheet_cache is not None:
+            return self.sheet_cache.parse(css_text, self.parser_backend)
+        return parse_stylesheet(css_text, self.parser_backend)
+
+    def parse_stylesheets(self, css_contents: List[str]) -> List[List[RuleRecord]]:
+        """Parse several stylesheets, returning their records in input order
 
-        # HSL/HSLA
-        hsl_pattern = r'hsla?\([^)]+\)'
-        colors.extend(re.findall(hsl_pattern, value))
+        With parse_workers > 1, large sheets that miss the parse cache are
+        parsed in a process pool while the small ones are parsed in-process.
+        A sheet that fails to parse contributes no records. Spilled sheets
+        are closed once parsed.
+        """
+        results = [None] * len(css_contents)
+        pending = []
+        for i, css_text in enumerate(css_contents):
+            cached = None
+            if self.sheet_cache is not None:
+                cached = self.sheet_cache.load(css_text, self.parser_backend)
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append(i)
 
-        # Named colors (common ones)
-        named_colors = ['white', 'black', 'red', 'blue', 'green', 'yellow', 'gray', 'grey']
-        for color in named_colors:
-            if color in value.lower():
-                colors.append(color)
+        large = []
+        if self.parse_workers > 1:
+            # Spilled sheets stay in-process: shipping one to a worker would pickle the whole text
+            large = [i for i in pending if len(css_contents[i]) >= PARALLEL_PARSE_MIN_SHEET_CHARS
+                     and not isinstance(css_contents[i], SpilledBody)]
+            if sum(len(css_contents[i]) for i in large) < PARALLEL_PARSE_MIN_CHARS:
+                large = []
 
-        return colors
+        executor = None
+        futures = {}
+        if large:
+            executor = ProcessPoolExecutor(max_workers=min(self.parse_workers, len(large)))
+            futures = {i: executor.submit(parse_stylesheet, css_contents[i], self.parser_backend) for i in large}
+
+        try:
+            for i in pending:
+                try:
+                    if i in futures:
+                        results[i] = futures[i].result()
+                    else:
+                        results[i] = parse_stylesheet(css_contents[i], self.parser_backend)
+                except Exception as e:
+                    logger.warning(f"    Error parsing CSS: {e}")
+                    results[i] = []
+                    continue
+                if self.sheet_cache is not None:
+                    self.sheet_cache.store(css_contents[i], results[i], self.parser_backend)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            for css_text in css_contents:
+                close_css(css_text)
+
+        return results
+
+    def add_rule(self, selector: str, styles: Dict[str, str], media: str = ''):
+        """Append a parsed rule to css_rules and register it in the inverted indexes"""
+        position = len(self.css_rules)
+        self.css_rules.append({
+            'selector': selector,
+            'styles': styles,
+            'media': media
+        })
+        for prop in styles:
+            self.property_index[prop].append(position)
+        for token in selector_tokens(selector):
+            self.selector_index[token].append(position)
+
+    def rules_with_property(self, prop: str) -> List[Dict]:
+        """All rules declaring prop, e.g. rules_with_property('box-shadow')"""
+        return [self.css_rules[i] for i in self.property_index.get(prop, [])]
+
+    def rules_with_selector_token(self, token: str) -> List[Dict]:
+        """All rules whose selector contains a tag ('nav'), class ('.card') or id ('#main') token"""
+        if not token.startswith(('.', '#')):
+            token = token.lower()
+        return [self.css_rules[i] for i in self.selector_index.get(token, [])]
+
+    def extract_colors(self, value: str) -> List[str]:
+        """Extract color values from CSS property values"""
+        return tokenize_colors(value)
 
     def normalize_color(self, color: str) -> str:
         """Normalize color format for better grouping"""
-        color = color.lower().strip()
+        return normalize_color(color)
 
-        # Convert 3-digit hex to 6-digit
-        if re.match(r'^#[0-9a-f]{3}$', color):
-            color = '#' + ''.join([c*2 for c in color[1:]])
+    def _build_rule_handlers(self, guide: Optional[StyleGuideAggregate] = None
+                             ) -> Dict[str, List[Tuple[Optional[str], Callable]]]:
+        """Build the property-to-handler dispatch table for the fused analysis pass
 
-        return color
+        Each section maps to an ordered list of (property, handler) entries.
+        A handler is called as handler(rule, value) for every rule declaring
+        the property; a property of None means "call for every rule".
+        Handlers fill guide, which defaults to self.style_guide.
+        """
+        guide = self.style_guide if guide is None else guide
+        typography = guide['typography']
+        colors = guide['colors']
+        layout = guide['layout']
+        effects = guide['visual_effects']
 
-    def analyze_typography(self):
-        """Analyze typography styles"""
-        print("\n Analyzing typography...")
+        def count(counter: Counter) -> Callable:
+            def handler(rule, value):
+                counter[value] += rule.get('weight', 1)
+            return handler
 
-        heading_selectors = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', '.heading', '.title']
-        body_selectors = ['body', 'p', '.text', '.content', 'main']
+        def count_colors(counter: Counter) -> Callable:
+            all_colors = colors['all_colors']
 
-        for rule in self.css_rules:
-            selector = rule['selector'].lower()
-            styles = rule['styles']
+            def handler(rule, value):
+                weight = rule.get('weight', 1)
+                for normalized in normalized_colors(value):
+                    counter[normalized] += weight
+                    all_colors[normalized] += weight
+            return handler
 
-            # Font families
-            if 'font-family' in styles:
-                font_family = styles['font-family'].replace('"', '').replace("'", '')
-                self.style_guide['typography']['font_families'][font_family] += 1
+        border_colors = count_colors(colors['border_colors'])
+        margins = count(layout['spacing']['margins'])
+        paddings = count(layout['spacing']['paddings'])
 
-                # Categorize by context
-                if any(h in selector for h in heading_selectors):
-                    self.style_guide['typography']['heading_styles'][selector] = styles
-                elif any(b in selector for b in body_selectors):
-                    self.style_guide['typography']['body_styles'][selector] = styles
+        return {
+            'typography': [
+                ('font-family', partial(self._handle_font_family, guide)),
+                ('font-size', count(typography['font_sizes'])),
+                ('font-weight', count(typography['font_weights'])),
+                ('line-height', count(typography['line_heights'])),
+                ('letter-spacing', count(typography['letter_spacing'])),
+            ],
+            'colors': [
+                ('background-color', count_colors(colors['background_colors'])),
+                ('background', count_colors(colors['background_colors'])),
+                ('color', count_colors(colors['text_colors'])),
+                *[(prop, border_colors) for prop in
+                  ['border-color', 'border', 'border-top', 'border-right', 'border-bottom', 'border-left']],
+            ],
+            'layout': [
+                ('display', partial(self._handle_display, guide)),
+                *[(prop, margins) for prop in
+                  ['margin', 'margin-top', 'margin-right', 'margin-bottom', 'margin-left']],
+                *[(prop, paddings) for prop in
+                  ['padding', 'padding-top', 'padding-right', 'padding-bottom', 'padding-left']],
+                ('border-radius', count(layout['border_radius'])),
+                ('max-width', count(layout['max_widths'])),
+            ],
+            'visual_effects': [
+                ('box-shadow', count(effects['box_shadows'])),
+                ('text-shadow', count(effects['text_shadows'])),
+                ('transition', count(effects['transitions'])),
+                ('transform', count(effects['transforms'])),
+            ],
+            'ui_patterns': [
+                (None, partial(self._handle_ui_patterns, guide)),
+            ],
+        }
 
-            # Font sizes
-            if 'font-size' in styles:
-                self.style_guide['typography']['font_sizes'][styles['font-size']] += 1
+    def add_rule_handler(self, section: str, prop: Optional[str], handler: Callable):
+        """Plug an extra (property, handler) entry into the fused analysis pass"""
+        self.rule_handlers.setdefault(section, []).append((prop, handler))
 
-            # Font weights
-            if 'font-weight' in styles:
-                self.style_guide['typography']['font_weights'][styles['font-weight']] += 1
+    def _handle_font_family(self, guide: StyleGuideAggregate, rule: Dict, value: str):
+        """Count a font family and categorize the rule by context"""
+        font_family = value.replace('"', '').replace("'", '')
+        guide['typography']['font_families'][font_family] += rule.get('weight', 1)
 
-            # Line heights
-            if 'line-height' in styles:
-                self.style_guide['typography']['line_heights'][styles['line-height']] += 1
+        categories = self.selector_classifier.classify(rule['selector'])
+        if 'heading' in categories:
+            guide['typography']['heading_styles'][rule['selector'].lower()] = rule['styles']
+        elif 'body' in categories:
+            guide['typography']['body_styles'][rule['selector'].lower()] = rule['styles']
 
-            # Letter spacing
-            if 'letter-spacing' in styles:
-                self.style_guide['typography']['letter_spacing'][styles['letter-spacing']] += 1
+    def _handle_display(self, guide: StyleGuideAggregate, rule: Dict, value: str):
+        """Count a display type and record grid/flexbox containers"""
+        guide['layout']['display_types'][value] += rule.get('weight', 1)
 
-        print(f"   Found {len(self.style_guide['typography']['font_families'])} font families")
+        if 'grid' in value:
+            guide['layout']['grid_usage'].append({
+                'selector': rule['selector'],
+                'styles': rule['styles']
+            })
+        elif 'flex' in value:
+            guide['layout']['flexbox_usage'].append({
+                'selector': rule['selector'],
+                'styles': rule['styles']
+            })
 
-    def analyze_colors(self):
-        """Analyze color usage"""
-        print("\n Analyzing colors...")
+    def _handle_ui_patterns(self, guide: StyleGuideAggregate, rule: Dict, value: None):
+        """Collect button, card and navigation rules and count rules per component category"""
+        categories = self.selector_classifier.classify(rule['selector'])
+        if not categories:
+            return
+        patterns = guide['ui_patterns']
+        weight = rule.get('weight', 1)
+        for category in categories:
+            patterns['component_counts'][category] += weight
 
-        for rule in self.css_rules:
-            styles = rule['styles']
+        if 'button' in categories:
+            patterns['button_styles'].append({'selector': rule['selector'], 'styles': rule['styles']})
 
-            # Background colors
-            if 'background-color' in styles:
-                colors = self.extract_colors(styles['background-color'])
-                for color in colors:
-                    normalized = self.normalize_color(color)
-                    self.style_guide['colors']['background_colors'][normalized] += 1
-                    self.style_guide['colors']['all_colors'][normalized] += 1
-
-            # Background (might contain colors)
-            if 'background' in styles:
-                colors = self.extract_colors(styles['background'])
-                for color in colors:
-                    normalized = self.normalize_color(color)
-                    self.style_guide['colors']['background_colors'][normalized] += 1
-                    self.style_guide['colors']['all_colors'][normalized] += 1
-
-            # Text colors
-            if 'color' in styles:
-                colors = self.extract_colors(styles['color'])
-                for color in colors:
-                    normalized = self.normalize_color(color)
-                    self.style_guide['colors']['text_colors'][normalized] += 1
-                    self.style_guide['colors']['all_colors'][normalized] += 1
-
-            # Border colors
-            for prop in ['border-color', 'border', 'border-top', 'border-right', 'border-bottom', 'border-left']:
-                if prop in styles:
-                    colors = self.extract_colors(styles[prop])
-                    for color in colors:
-                        normalized = self.normalize_color(color)
-                        self.style_guide['colors']['border_colors'][normalized] += 1
-                        self.style_guide['colors']['all_colors'][normalized] += 1
-
-        print(f"   Found {len(self.style_guide['colors']['all_colors'])} unique colors")
+        if 'card' in categories:
+            patterns['card_styles'].append({'selector': rule['selector'], 'styles': rule['styles']})
 
-    def analyze_layout(self):
-        """Analyze layout properties"""
-        print("\n Analyzing layout...")
+        if 'navigation' in categories:
+            patterns['navigation_styles'].append({'selector': rule['selector'], 'styles': rule['styles']})
 
-        for rule in self.css_rules:
-            styles = rule['styles']
+    def analyze_rules(self, sections: Optional[List[str]] = None):
+        """Fill the requested style_guide sections in a single pass over the rules"""
+        sections = list(self.rule_handlers) if sections is None else sections
+        logger.info(f"\n Analyzing {', '.join(sections)}...")
 
-            # Display types
-            if 'display' in styles:
-                display = styles['display']
-                self.style_guide['layout']['display_types'][display] += 1
-
-                if 'grid' in display:
-                    self.style_guide['layout']['grid_usage'].append({
-                        'selector': rule['selector'],
-                        'styles': styles
-                    })
-                elif 'flex' in display:
-                    self.style_guide['layout']['flexbox_usage'].append({
-                        'selector': rule['selector'],
-                        'styles': styles
-                    })
-
-            # Margins
-            for prop in ['margin', 'margin-top', 'margin-right', 'margin-bottom', 'margin-left']:
-                if prop in styles:
-                    self.style_guide['layout']['spacing']['margins'][styles[prop]] += 1
-
-            # Paddings
-            for prop in ['padding', 'padding-top', 'padding-right', 'padding-bottom', 'padding-left']:
-                if prop in styles:
-                    self.style_guide['layout']['spacing']['paddings'][styles[prop]] += 1
-
-            # Border radius
-            if 'border-radius' in styles:
-                self.style_guide['layout']['border_radius'][styles['border-radius']] += 1
-
-            # Max widths (container patterns)
-            if 'max-width' in styles:
-                self.style_guide['layout']['max_widths'][styles['max-width']] += 1
-
-        print(f"   Found {len(self.style_guide['layout']['grid_usage'])} grid usages")
-        print(f"   Found {len(self.style_guide['layout']['flexbox_usage'])} flexbox usages")
+        self.fold_rules(sections)
 
-    def analyze_visual_effects(self):
-        """Analyze visual effects like shadows and transitions"""
-        print("\n Analyzing visual effects...")
+        for section in sections:
+            self._print_section_summary(section)
+
+    @timed_phase('analyze')
+    def fold_rules(self, sections: List[str], start: int = 0):
+        """Feed css_rules[start:] through the dispatch handlers of the given sections"""
+        handlers = [entry for section in sections for entry in self.rule_handlers[section]]
+
+        # Property-only handlers need just the rules the index lists for their properties
+        if any(prop is None for prop, _ in handlers):
+            positions = range(start, len(self.css_rules))
+        else:
+            positions = set()
+            for prop, _ in handlers:
+                indexed = self.property_index.get(prop, [])
+                positions.update(indexed[bisect_left(indexed, start):])
+            positions = sorted(positions)
 
-        for rule in self.css_rules:
+        if self.dom_weighting:
+            self._fold_weighted(handlers, positions)
+            return
+
+        for position in positions:
+            rule = self.css_rules[position]
+            styles = rule['styles']
+            for prop, handler in handlers:
+                if prop is None:
+                    handler(rule, None)
+                elif prop in styles:
+                    handler(rule, styles[prop])
+
+    def _fold_weighted(self, handlers: List[Tuple[Optional[str], Callable]], positions: Iterable[int]):
+        """fold_rules loop that hands each handler the rule's weight as rule['weight']
+
+        Rules that match nothing on the page are skipped entirely.
+        """
+        weights = self.rule_weights
+        for position in positions:
+            matched, covered = weights[position] if position < len(weights) else (0, 0)
+            if not matched:
+                continue
+            rule = self.css_rules[position]
             styles = rule['styles']
+            rule = {'selector': rule['selector'], 'styles': styles, 'media': rule['media'], 'weight': matched}
+            for prop, handler in handlers:
+                if prop is None:
+                    rule['weight'] = matched
+                    handler(rule, None)
+                elif prop in styles:
+                    rule['weight'] = covered if prop in INHERITED_PROPERTIES else matched
+                    handler(rule, styles[prop])
+
+    @timed_phase('analyze')
+    def fold_records(self, records: Iterable[RuleRecord],
+                     sections: Optional[List[str]] = None) -> StyleGuideAggregate:
+        """Analyze parsed records into a new partial aggregate
+
+        Neither css_rules nor style_guide is touched, so per-stylesheet or
+        per-page partials can be built independently (in any worker) and
+        reduced with StyleGuideAggregate.merged(). Only the built-in
+        handlers run; ones added through add_rule_handler write to
+        style_guide and are skipped.
+        """
+        aggregate = StyleGuideAggregate(sources=[self.url])
+        handlers = self._build_rule_handlers(aggregate)
+        sections = list(handlers) if sections is None else sections
+        handlers = [entry for section in sections for entry in handlers[section]]
+
+        for selector, styles, media in records:
+            rule = {'selector': selector, 'styles': styles, 'media': media}
+            for prop, handler in handlers:
+                if prop is None:
+                    handler(rule, None)
+                elif prop in styles:
+                    handler(rule, styles[prop])
+        return aggregate
 
-            # Box shadows
-            if 'box-shadow' in styles:
-                self.style_guide['visual_effects']['box_shadows'][styles['box-shadow']] += 1
+    def _print_section_summary(self, section: str):
+        """Print the headline numbers of an analyzed section"""
+        guide = self.style_guide
+        if section == 'typography':
+            logger.info(f"   Found {len(guide['typography']['font_families'])} font families")
+        elif section == 'colors':
+            logger.info(f"   Found {len(guide['colors']['all_colors'])} unique colors")
+        elif section == 'layout':
+            logger.info(f"   Found {len(guide['layout']['grid_usage'])} grid usages")
+            logger.info(f"   Found {len(guide['layout']['flexbox_usage'])} flexbox usages")
+        elif section == 'visual_effects':
+            logger.info(f"   Found {len(guide['visual_effects']['box_shadows'])} shadow styles")
+        elif section == 'ui_patterns':
+            logger.info(f"   Found {len(guide['ui_patterns']['button_styles'])} button patterns")
+            logger.info(f"   Found {len(guide['ui_patterns']['card_styles'])} card patterns")
 
-            # Text shadows
-            if 'text-shadow' in styles:
-                self.style_guide['visual_effects']['text_shadows'][styles['text-shadow']] += 1
+    def analyze_typography(self):
+        """Analyze typography styles"""
+        self.analyze_rules(['typography'])
 
-            # Transitions
-            if 'transition' in styles:
-                self.style_guide['visual_effects']['transitions'][styles['transition']] += 1
+    def analyze_colors(self):
+        """Analyze color usage"""
+        self.analyze_rules(['colors'])
 
-            # Transforms
-            if 'transform' in styles:
-                self.style_guide['visual_effects']['transforms'][styles['transform']] += 1
+    def analyze_layout(self):
+        """Analyze layout properties"""
+        self.analyze_rules(['layout'])
 
-        print(f"   Found {len(self.style_guide['visual_effects']['box_shadows'])} shadow styles")
+    def analyze_visual_effects(self):
+        """Analyze visual effects like shadows and transitions"""
+        self.analyze_rules(['visual_effects'])
 
     def analyze_ui_patterns(self):
         """Analyze common UI patterns"""
-        print("\n Analyzing UI patterns...")
-
-        button_selectors = ['button', '.btn', '.button', '[type="submit"]', 'a.button']
-        card_selectors = ['.card', '.box', '.panel', '.tile']
-        nav_selectors = ['nav', '.navigation', '.menu', 'header']
-
-        for rule in self.css_rules:
-            selector = rule['selector'].lower()
-
-            if any(btn in selector for btn in button_selectors):
-                self.style_guide['ui_patterns']['button_styles'].append({
-                    'selector': rule['selector'],
-                    'styles': rule['styles']
-                })
-
-            if any(card in selector for card in card_selectors):
-                self.style_guide['ui_patterns']['card_styles'].append({
-                    'selector': rule['selector'],
-                    'styles': rule['styles']
-                })
-
-            if any(nav in selector for nav in nav_selectors):
-                self.style_guide['ui_patterns']['navigation_styles'].append({
-                    'selector': rule['selector'],
-                    'styles': rule['styles']
-                })
-
-        print(f"   Found {len(self.style_guide['ui_patterns']['button_styles'])} button patterns")
-        print(f"   Found {len(self.style_guide['ui_patterns']['card_styles'])} card patterns")
-
-    def determine_visual_tone(self) -> str:
-        """Determine the overall visual tone of the site"""
+        self.analyze_rules(['ui_patterns'])
+
+    def palette(self, style_guide: Optional[StyleGuideAggregate] = None) -> List[Dict]:
+        """Perceptual palette of all colors used (see cluster_palette); needs numpy"""
+        guide = self.style_guide if style_guide is None else style_guide
+        return cluster_palette(guide['colors']['all_colors'], self.palette_threshold)
+
+    def determine_visual_tone(self, style_guide: Optional[StyleGuideAggregate] = None) -> str:
+        """Determine the overall visual tone of the site (or of a merged style_guide)"""
+        guide = self.style_guide if style_guide is None else style_guide
         # Analyze characteristics
-        has_bold_colors = len([c for c, count in self.style_guide['colors']['all_colors'].most_common(10)
+        has_bold_colors = len([c for c, count in guide['colors']['all_colors'].most_common(10)
                                if count > 5]) > 3
-        has_shadows = len(self.style_guide['visual_effects']['box_shadows']) > 0
-        has_rounded = any('px' in br for br in self.style_guide['layout']['border_radius'])
-        uses_transitions = len(self.style_guide['visual_effects']['transitions']) > 0
+        has_shadows = len(guide['visual_effects']['box_shadows']) > 0
+        has_rounded = any('px' in br for br in guide['layout']['border_radius'])
+        uses_transitions = len(guide['visual_effects']['transitions']) > 0
 
         tones = []
         if has_shadows and has_rounded:
@@ -372,194 +4082,758 @@ class DesignStyleAnalyzer:
 
         return ", ".join(tones) if tones else "clean and professional"
 
-    def generate_markdown_report(self) -> str:
-        """Generate a comprehensive Markdown style guide"""
+    def generate_markdown_report(self, style_guide: Optional[StyleGuideAggregate] = None,
+                                 sections: Optional[Iterable[str]] = None) -> str:
+        """Generate a comprehensive Markdown style guide
+
+        Renders self.style_guide unless another (e.g. merged) aggregate is
+        given. sections picks REPORT_SECTIONS to render and defaults to the
+        analyzer's report_sections (all of them when unset).
+        """
+        guide = self.style_guide if style_guide is None else style_guide
+        if sections is None:
+            sections = self.report_sections if self.report_sections is not None else REPORT_SECTIONS
         report = []
 
         report.append("# Website Design Style Guide")
         report.append(f"\n**Source:** {self.url}")
+        if self.pages:
+            stylesheets = sum(1 for source in self.sources if source['kind'] == 'stylesheet')
+            report.append(f"\n**Pages Crawled:** {len(self.pages)} ({stylesheets} unique stylesheets)")
         report.append(f"\n**Analysis Date:** {__import__('datetime').datetime.now().strftime('%Y-%m-%d')}")
-        report.append(f"\n**Visual Tone:** {self.determine_visual_tone()}")
+        if self.dom_weighting and style_guide is None:
+            report.append("\n**Counts:** weighted by matched page elements")
+        if 'tone' in sections:
+            report.append(f"\n**Visual Tone:** {self.determine_visual_tone(guide)}")
 
         # Typography Section
-        report.append("\n\n##  Typography\n")
+        if 'typography' in sections:
+            report.append("\n\n##  Typography\n")
 
-        report.append("### Font Families")
-        for font, count in self.style_guide['typography']['font_families'].most_common(5):
-            report.append(f"- **{font}** (used {count} times)")
+            report.append("### Font Families")
+            for font, count in guide['typography']['font_families'].most_common(5):
+                report.append(f"- **{font}** (used {count} times)")
 
-        report.append("\n### Font Sizes (Most Common)")
-        for size, count in self.style_guide['typography']['font_sizes'].most_common(10):
-            report.append(f"- `{size}` (used {count} times)")
+            report.append("\n### Font Sizes (Most Common)")
+            for size, count in guide['typography']['font_sizes'].most_common(10):
+                report.append(f"- `{size}` (used {count} times)")
 
-        report.append("\n### Font Weights")
-        for weight, count in self.style_guide['typography']['font_weights'].most_common(5):
-            report.append(f"- **{weight}** (used {count} times)")
+            report.append("\n### Font Weights")
+            for weight, count in guide['typography']['font_weights'].most_common(5):
+                report.append(f"- **{weight}** (used {count} times)")
 
-        report.append("\n### Line Heights")
-        for lh, count in self.style_guide['typography']['line_heights'].most_common(5):
-            report.append(f"- `{lh}` (used {count} times)")
+            report.append("\n### Line Heights")
+            for lh, count in guide['typography']['line_heights'].most_common(5):
+                report.append(f"- `{lh}` (used {count} times)")
 
         # Colors Section
-        report.append("\n\n##  Color Palette\n")
+        if 'colors' in sections:
+            report.append("\n\n##  Color Palette\n")
+
+            report.append("### Primary Colors (Most Used)")
+            for color, count in guide['colors']['all_colors'].most_common(10):
+                report.append(f"- `{color}` (used {count} times)")
 
-        report.append("### Primary Colors (Most Used)")
-        for color, count in self.style_guide['colors']['all_colors'].most_common(10):
-            report.append(f"- `{color}` (used {count} times)")
+            report.append("\n### Background Colors")
+            for color, count in guide['colors']['background_colors'].most_common(5):
+                report.append(f"- `{color}` (used {count} times)")
 
-        report.append("\n### Background Colors")
-        for color, count in self.style_guide['colors']['background_colors'].most_common(5):
-            report.append(f"- `{color}` (used {count} times)")
+            report.append("\n### Text Colors")
+            for color, count in guide['colors']['text_colors'].most_common(5):
+                report.append(f"- `{color}` (used {count} times)")
 
-        report.append("\n### Text Colors")
-        for color, count in self.style_guide['colors']['text_colors'].most_common(5):
-            report.append(f"- `{color}` (used {count} times)")
+            if np is not None:
+                palette = self.palette(guide)
+                if palette:
+                    report.append(f"\n### Perceptual Palette (delta E < {self.palette_threshold:g})")
+                    for entry in palette:
+                        variants = ', '.join(f'`{member}`' for member in entry['members'][:4])
+                        more = f" and {len(entry['members']) - 4} more" if len(entry['members']) > 4 else ''
+                        report.append(f"- `{entry['color']}` ({entry['share']:.0%} of color uses; {variants}{more})")
 
         # Layout Section
-        report.append("\n\n##  Layout System\n")
+        if 'layout' in sections:
+            report.append("\n\n##  Layout System\n")
 
-        report.append("### Display Types")
-        for display, count in self.style_guide['layout']['display_types'].most_common(5):
-            report.append(f"- `{display}` (used {count} times)")
+            report.append("### Display Types")
+            for display, count in guide['layout']['display_types'].most_common(5):
+                report.append(f"- `{display}` (used {count} times)")
 
-        report.append(f"\n### Grid Usage: {len(self.style_guide['layout']['grid_usage'])} instances")
-        report.append(f"### Flexbox Usage: {len(self.style_guide['layout']['flexbox_usage'])} instances")
+            report.append(f"\n### Grid Usage: {len(guide['layout']['grid_usage'])} instances")
+            report.append(f"### Flexbox Usage: {len(guide['layout']['flexbox_usage'])} instances")
 
-        report.append("\n### Spacing Conventions")
-        report.append("\n**Margins (Most Common):**")
-        for margin, count in self.style_guide['layout']['spacing']['margins'].most_common(8):
-            report.append(f"- `{margin}` (used {count} times)")
+            report.append("\n### Spacing Conventions")
+            report.append("\n**Margins (Most Common):**")
+            for margin, count in guide['layout']['spacing']['margins'].most_common(8):
+                report.append(f"- `{margin}` (used {count} times)")
 
-        report.append("\n**Paddings (Most Common):**")
-        for padding, count in self.style_guide['layout']['spacing']['paddings'].most_common(8):
-            report.append(f"- `{padding}` (used {count} times)")
+            report.append("\n**Paddings (Most Common):**")
+            for padding, count in guide['layout']['spacing']['paddings'].most_common(8):
+                report.append(f"- `{padding}` (used {count} times)")
 
-        report.append("\n### Border Radius Styles")
-        for br, count in self.style_guide['layout']['border_radius'].most_common(5):
-            report.append(f"- `{br}` (used {count} times)")
+            report.append("\n### Border Radius Styles")
+            for br, count in guide['layout']['border_radius'].most_common(5):
+                report.append(f"- `{br}` (used {count} times)")
 
-        report.append("\n### Container Max Widths")
-        for mw, count in self.style_guide['layout']['max_widths'].most_common(5):
-            report.append(f"- `{mw}` (used {count} times)")
+            report.append("\n### Container Max Widths")
+            for mw, count in guide['layout']['max_widths'].most_common(5):
+                report.append(f"- `{mw}` (used {count} times)")
 
         # Visual Effects Section
-        report.append("\n\n##  Visual Effects\n")
+        if 'effects' in sections:
+            report.append("\n\n##  Visual Effects\n")
 
-        report.append("### Box Shadows (Most Common)")
-        for shadow, count in self.style_guide['visual_effects']['box_shadows'].most_common(5):
-            report.append(f"- `{shadow}` (used {count} times)")
-
-        if self.style_guide['visual_effects']['text_shadows']:
-            report.append("\n### Text Shadows")
-            for shadow, count in self.style_guide['visual_effects']['text_shadows'].most_common(3):
+            report.append("### Box Shadows (Most Common)")
+            for shadow, count in guide['visual_effects']['box_shadows'].most_common(5):
                 report.append(f"- `{shadow}` (used {count} times)")
 
-        if self.style_guide['visual_effects']['transitions']:
-            report.append("\n### Transitions (Most Common)")
-            for trans, count in self.style_guide['visual_effects']['transitions'].most_common(5):
-                report.append(f"- `{trans}` (used {count} times)")
+            if guide['visual_effects']['text_shadows']:
+                report.append("\n### Text Shadows")
+                for shadow, count in guide['visual_effects']['text_shadows'].most_common(3):
+                    report.append(f"- `{shadow}` (used {count} times)")
+
+            if guide['visual_effects']['transitions']:
+                report.append("\n### Transitions (Most Common)")
+                for trans, count in guide['visual_effects']['transitions'].most_common(5):
+                    report.append(f"- `{trans}` (used {count} times)")
 
         # UI Patterns Section
-        report.append("\n\n##  UI Component Patterns\n")
+        if 'components' in sections:
+            report.append("\n\n##  UI Component Patterns\n")
 
-        report.append(f"### Button Styles")
-        report.append(f"**Found {len(self.style_guide['ui_patterns']['button_styles'])} button style rules**")
-        if self.style_guide['ui_patterns']['button_styles']:
-            report.append("\n**Example button styles:**")
-            for btn in self.style_guide['ui_patterns']['button_styles'][:3]:
-                report.append(f"\n`{btn['selector']}`:")
-                for prop, value in list(btn['styles'].items())[:5]:
-                    report.append(f"  - {prop}: `{value}`")
+            report.append(f"### Button Styles")
+            report.append(f"**Found {len(guide['ui_patterns']['button_styles'])} button style rules**")
+            if guide['ui_patterns']['button_styles']:
+                report.append("\n**Example button styles:**")
+                for btn in guide['ui_patterns']['button_styles'][:3]:
+                    report.append(f"\n`{btn['selector']}`:")
+                    for prop, value in list(btn['styles'].items())[:5]:
+                        report.append(f"  - {prop}: `{value}`")
 
-        report.append(f"\n### Card Styles")
-        report.append(f"**Found {len(self.style_guide['ui_patterns']['card_styles'])} card style rules**")
+            report.append(f"\n### Card Styles")
+            report.append(f"**Found {len(guide['ui_patterns']['card_styles'])} card style rules**")
 
-        report.append(f"\n### Navigation Styles")
-        report.append(f"**Found {len(self.style_guide['ui_patterns']['navigation_styles'])} navigation style rules**")
+            report.append(f"\n### Navigation Styles")
+            report.append(f"**Found {len(guide['ui_patterns']['navigation_styles'])} navigation style rules**")
+
+            components = [(category, count) for category, count in guide['ui_patterns']['component_counts'].most_common()
+                          if category not in self.REPORTED_CATEGORIES]
+            if components:
+                report.append("\n### Detected Components")
+                for category, count in components[:10]:
+                    report.append(f"- **{category}** ({count} rules)")
 
         # Design Recommendations
-        report.append("\n\n##  Design System Summary\n")
+        if 'summary' in sections:
+            report.append("\n\n##  Design System Summary\n")
+
+            # Get primary font
+            primary_font = guide['typography']['font_families'].most_common(1)
+            primary_font_name = primary_font[0][0] if primary_font else "Not detected"
+
+            # Get primary colors
+            primary_colors = [color for color, _ in guide['colors']['all_colors'].most_common(3)]
+
+            # Layout preference
+            layout_pref = "Grid-based" if len(guide['layout']['grid_usage']) > len(guide['layout']['flexbox_usage']) else "Flexbox-based"
+
+            report.append(f"**Primary Typography:** {primary_font_name}")
+            report.append(f"\n**Key Colors:** {', '.join([f'`{c}`' for c in primary_colors[:3]])}")
+            report.append(f"\n**Layout Approach:** {layout_pref} layout system")
+            report.append(f"\n**Shadow Usage:** {'Extensive' if len(guide['visual_effects']['box_shadows']) > 10 else 'Minimal'} use of box shadows")
+            report.append(f"\n**Animation Style:** {'Dynamic with transitions' if len(guide['visual_effects']['transitions']) > 5 else 'Minimal animations'}")
+
+            # Spacing scale
+            common_paddings = [p for p, _ in guide['layout']['spacing']['paddings'].most_common(5)]
+            report.append(f"\n**Spacing Scale:** {', '.join([f'`{p}`' for p in common_paddings[:5]])}")
+
+        return "\n".join(report)
+
+    def generate_change_summary(self, changes: Dict) -> str:
+        """Render summarize_changes() output as Markdown"""
+        sheets = changes['sheets']
+        report = ["# Style Guide Changes"]
+        report.append(f"\n**Source:** {self.url}")
+        report.append(f"\n**Analysis Date:** {__import__('datetime').datetime.now().strftime('%Y-%m-%d')}")
+        report.append(f"\n**CSS Sources:** {sheets['total']} ({sheets['reused']} unchanged, "
+                      f"{len(sheets['changed'])} changed, {len(sheets['added'])} added, "
+                      f"{len(sheets['removed'])} removed)")
+
+        for label in ('changed', 'added', 'removed'):
+            if sheets[label]:
+                report.append(f"\n### {label.capitalize()} Stylesheets")
+                for url in sheets[label]:
+                    report.append(f"- {url}")
+
+        if not changes['fields']:
+            report.append("\nNo style changes detected.")
+            return "\n".join(report)
+
+        report.append("\n\n##  Style Changes")
+        for path, field in changes['fields'].items():
+            report.append(f"\n### {path}")
+            if 'size' in field:
+                report.append(f"- {field['size'][0]} -> {field['size'][1]} entries")
+                continue
+            for value, count in field['added'][:10]:
+                report.append(f"- added `{value}` (used {count} times)")
+            for value, count in field['removed'][:10]:
+                report.append(f"- removed `{value}` (was used {count} times)")
+            for value, old, new in field['changed'][:10]:
+                report.append(f"- `{value}`: {old} -> {new} uses")
+
+        return "\n".join(report)
+
+    def coverage_report(self) -> Dict:
+        """Which rules of each CSS source match at least one element, from rule_coverage
 
-        # Get primary font
-        primary_font = self.style_guide['typography']['font_families'].most_common(1)
-        primary_font_name = primary_font[0][0] if primary_font else "Not detected"
+        Returns {'pages', 'rules', 'used', 'dead', 'page_specific',
+        'state_dependent', 'unsupported', 'sources'}, where each source
+        entry carries its kind, url and page, how many pages use it, its rule
+        and used counts, its dead selectors, its page-specific (selector,
+        page) pairs and its state-dependent selectors. A rule is dead when it
+        matches nothing on any page using its source, and page-specific when
+        it matches on exactly one of several such pages. Rules that only
+        match depending on state the page does not show (:hover, :focus, ...)
+        are state-dependent rather than used or dead, and rules the matcher
+        cannot evaluate at all only count as unsupported.
+        """
+        if not self.coverage:
+            raise ValueError("coverage_report needs an analyzer created with coverage=True")
+        pages = list(self.pages) or [self.url]
+        if self.pages:
+            users = [0] * len(self.sources)
+            for page, indexes in enumerate(self.pages.values()):
+                for index in indexes:
+                    users[index] |= 1 << page
+        else:
+            users = [1] * len(self.sources)
+        coverage = self.rule_coverage + [0] * (len(self.css_rules) - len(self.rule_coverage))
+
+        report = {'pages': pages, 'rules': len(self.css_rules), 'used': 0, 'dead': 0, 'page_specific': 0,
+                  'state_dependent': 0, 'unsupported': 0, 'sources': []}
+        for source, used_by in zip(self.sources, users):
+            start, end = source['rules']
+            entry = {'kind': source['kind'], 'url': source['url'], 'page': source['page'],
+                     'pages': bin(used_by).count('1'), 'rules': end - start, 'used': 0, 'unsupported': 0,
+                     'dead': [], 'page_specific': [], 'state_dependent': []}
+            for position in range(start, end):
+                if position in self.unmatchable_rules:
+                    entry['unsupported'] += 1
+                    continue
+                bits = coverage[position]
+                if not bits:
+                    entry['dead'].append(self.css_rules[position]['selector'])
+                    continue
+                if position in self.state_dependent_rules:
+                    entry['state_dependent'].append(self.css_rules[position]['selector'])
+                    continue
+                entry['used'] += 1
+                if entry['pages'] > 1 and not bits & (bits - 1):
+                    entry['page_specific'].append((self.css_rules[position]['selector'],
+                                                   pages[bits.bit_length() - 1]))
+            report['used'] += entry['used']
+            report['dead'] += len(entry['dead'])
+            report['page_specific'] += len(entry['page_specific'])
+            report['state_dependent'] += len(entry['state_dependent'])
+            report['unsupported'] += entry['unsupported']
+            report['sources'].append(entry)
+        return report
+
+    def generate_coverage_report(self, coverage: Optional[Dict] = None) -> str:
+        """Render coverage_report() as Markdown: dead, page-specific and state-dependent rules per stylesheet"""
+        coverage = self.coverage_report() if coverage is None else coverage
 
-        # Get primary colors
-        primary_colors = [color for color, _ in self.style_guide['colors']['all_colors'].most_common(3)]
+        def share(count: int, total: int) -> str:
+            return f"{count * 100 // total}%" if total else "0%"
 
-        # Layout preference
-        layout_pref = "Grid-based" if len(self.style_guide['layout']['grid_usage']) > len(self.style_guide['layout']['flexbox_usage']) else "Flexbox-based"
+        def listing(title: str, items: List[str]):
+            if items:
+                report.append(f"\n**{title}**")
+                report.extend(f"- {item}" for item in items[:COVERAGE_REPORT_LIMIT])
+                if len(items) > COVERAGE_REPORT_LIMIT:
+                    report.append(f"- ... and {len(items) - COVERAGE_REPORT_LIMIT} more")
 
-        report.append(f"**Primary Typography:** {primary_font_name}")
-        report.append(f"\n**Key Colors:** {', '.join([f'`{c}`' for c in primary_colors[:3]])}")
-        report.append(f"\n**Layout Approach:** {layout_pref} layout system")
-        report.append(f"\n**Shadow Usage:** {'Extensive' if len(self.style_guide['visual_effects']['box_shadows']) > 10 else 'Minimal'} use of box shadows")
-        report.append(f"\n**Animation Style:** {'Dynamic with transitions' if len(self.style_guide['visual_effects']['transitions']) > 5 else 'Minimal animations'}")
+        report = ["# CSS Coverage Report"]
+        report.append(f"\n**Source:** {self.url}")
+        report.append(f"\n**Analysis Date:** {__import__('datetime').datetime.now().strftime('%Y-%m-%d')}")
+        report.append(f"\n**Pages:** {len(coverage['pages'])}")
+        report.append(f"\n**Rules:** {coverage['rules']} ({coverage['used']} used, {coverage['dead']} dead "
+                      f"({share(coverage['dead'], coverage['rules'])}), {coverage['page_specific']} page-specific, "
+                      f"{coverage['state_dependent']} state-dependent, {coverage['unsupported']} not evaluated)")
+
+        report.append("\n\n##  Stylesheets")
+        for entry in coverage['sources']:
+            if entry['kind'] != 'stylesheet':
+                continue
+            report.append(f"\n### {entry['url']}")
+            report.append(f"Used on {entry['pages']} of {len(coverage['pages'])} pages: {entry['rules']} rules, "
+                          f"{entry['used']} used, {len(entry['dead'])} dead "
+                          f"({share(len(entry['dead']), entry['rules'])}), "
+                          f"{len(entry['page_specific'])} page-specific, "
+                          f"{len(entry['state_dependent'])} state-dependent")
+            listing("Dead rules", [f"`{selector}`" for selector in entry['dead']])
+            listing("Page-specific rules", [f"`{selector}` (only on {page})"
+                                            for selector, page in entry['page_specific']])
+            listing("State-dependent rules (match only in states such as :hover)",
+                    [f"`{selector}`" for selector in entry['state_dependent']])
 
-        # Spacing scale
-        common_paddings = [p for p, _ in self.style_guide['layout']['spacing']['paddings'].most_common(5)]
-        report.append(f"\n**Spacing Scale:** {', '.join([f'`{p}`' for p in common_paddings[:5]])}")
+        inline = [entry for entry in coverage['sources'] if entry['kind'] == 'inline']
+        if inline:
+            report.append("\n\n##  Inline Styles")
+            for entry in inline:
+                report.append(f"- {entry['page']}: {entry['rules']} rules, {len(entry['dead'])} dead")
 
         return "\n".join(report)
 
-    def run_analysis(self):
+    def run_analysis(self, output_file: str = "style_guide_analysis.md"):
         """Run the complete analysis pipeline"""
-        print("\n" + "="*60)
-        print("WEBSITE DESIGN STYLE ANALYZER")
-        print("="*60)
+        logger.info("\n" + "="*60)
+        logger.info("WEBSITE DESIGN STYLE ANALYZER")
+        logger.info("="*60)
 
         # Step 1: Fetch HTML
         if not self.fetch_html():
             return None
 
-        # Step 2: Extract CSS
-        css_contents = self.extract_css_files()
-        if not css_contents:
-            print("  No CSS found to analyze")
-            return None
+        if self.pipeline:
+            # Steps 2-4 overlapped: each source is parsed and analyzed on arrival
+            if not self.run_pipeline(self.analysis_sections):
+                logger.info("  No CSS found to analyze")
+                self.failure = 'no CSS found to analyze'
+                return None
+            logger.info(f"\n Parsed and analyzed {len(self.css_rules)} CSS rules")
+            for section in self.analysis_sections:
+                self._print_section_summary(section)
+        else:
+            # Step 2: Extract CSS
+            css_contents = self.extract_css_files()
+            if not css_contents:
+                logger.info("  No CSS found to analyze")
+                self.failure = 'no CSS found to analyze'
+                return None
 
-        # Step 3: Parse CSS
-        self.parse_css(css_contents)
+            # Step 3: Parse CSS
+            self.parse_css(css_contents)
 
-        # Step 4: Run analyses
-        self.analyze_typography()
-        self.analyze_colors()
-        self.analyze_layout()
-        self.analyze_visual_effects()
-        self.analyze_ui_patterns()
+            # Step 4: Run the analyses the report needs in one pass over the rules
+            self.analyze_rules(self.analysis_sections)
 
         # Step 5: Generate report
-        print("\n" + "="*60)
-        print(" GENERATING STYLE GUIDE REPORT")
-        print("="*60)
+        return self.write_report(output_file)
+
+    def run_crawl(self, max_depth: int = DEFAULT_CRAWL_DEPTH, max_pages: int = DEFAULT_CRAWL_PAGES,
+                  concurrency: int = DEFAULT_CRAWL_CONCURRENCY, output_file: str = "style_guide_analysis.md"):
+        """Run the analysis over a same-domain crawl instead of a single page"""
+        logger.info("\n" + "="*60)
+        logger.info("WEBSITE DESIGN STYLE ANALYZER (CRAWL)")
+        logger.info("="*60)
+
+        if not self.crawl(max_depth, max_pages, concurrency):
+            logger.error("Error fetching HTML: no pages could be crawled")
+            self.failure = self.failure or 'no pages could be crawled'
+            return None
+        if not self.css_rules:
+            logger.info("  No CSS found to analyze")
+            self.failure = 'no CSS found to analyze'
+            return None
+
+        self.analyze_rules(self.analysis_sections)
+        return self.write_report(output_file)
+
+    def run_incremental(self, snapshot_path: str, changes_file: str = "style_guide_changes.md",
+                        keep_rules: bool = False):
+        """Run the analysis against the snapshot of a previous run and update it
+
+        Writes the report as usual plus a change summary to changes_file.
+        A missing or incompatible snapshot makes this a full run that
+        creates one. keep_rules is passed on to analyze_incremental.
+        """
+        logger.info("\n" + "="*60)
+        logger.info("WEBSITE DESIGN STYLE ANALYZER (INCREMENTAL)")
+        logger.info("="*60)
+
+        previous = None
+        if os.path.exists(snapshot_path):
+            try:
+                previous = AnalysisSnapshot.load(snapshot_path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"  Ignoring unreadable snapshot {snapshot_path}: {e}")
+
+        if not self.fetch_html():
+            return None
+
+        snapshot, reused = self.analyze_incremental(previous, keep_rules)
+        if not snapshot.sheets:
+            logger.info("  No CSS found to analyze")
+            self.failure = 'no CSS found to analyze'
+            return None
+        for section in self.rule_handlers:
+            self._print_section_summary(section)
 
-        report = self.generate_markdown_report()
+        report = self.write_report()
+        if previous is not None:
+            changes = summarize_changes(previous, snapshot, reused)
+            with open(changes_file, 'w', encoding='utf-8') as f:
+                f.write(self.generate_change_summary(changes))
+            logger.info(f" Change summary saved to: {changes_file}")
+        snapshot.save(snapshot_path)
+        return report
+
+    def collect_metrics(self) -> RunMetrics:
+        """Fill in rule totals and cache statistics; returns self.metrics"""
+        self.metrics.counters['rules'] = len(self.css_rules)
+        self.metrics.extra['url'] = self.url
+        if self.http_cache is not None:
+            self.metrics.extra['http_cache'] = dict(self.http_cache.stats)
+        if self.sheet_cache is not None:
+            self.metrics.extra['parse_cache'] = dict(self.sheet_cache.stats)
+        return self.metrics
+
+    @timed_phase('report')
+    def write_report(self, output_file: str = "style_guide_analysis.md",
+                     style_guide: Optional[StyleGuideAggregate] = None) -> str:
+        """Generate the Markdown report and save it to output_file"""
+        logger.info("\n" + "="*60)
+        logger.info(" GENERATING STYLE GUIDE REPORT")
+        logger.info("="*60)
+
+        report = self.generate_markdown_report(style_guide)
 
         # Save to file
-        output_file = "style_guide_analysis.md"
         with open(output_file, 'w', encoding='utf-8') as f:
             f.write(report)
 
-        print(f"\n Analysis complete! Report saved to: {output_file}")
-        print("\n" + "="*60 + "\n")
+        logger.info(f"\n Analysis complete! Report saved to: {output_file}")
+        logger.info("\n" + "="*60 + "\n")
 
         return report
 
 
+def site_slug(url: str) -> str:
+    """File-name-safe name for a site URL, e.g. 'www.ncad.ie_courses'"""
+    parsed = urlparse(url)
+    return re.sub(r'[^\w.-]+', '_', f"{parsed.netloc}{parsed.path}").strip('_.') or 'site'
+
+
+def read_url_list(path: str) -> List[str]:
+    """URLs of a batch file: one per line, blank lines and '#' comments ignored, duplicates dropped"""
+    urls = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            url = line.split('#', 1)[0].strip()
+            if url and url not in urls:
+                urls.append(url)
+    return urls
+
+
+def run_batch(urls: List[str], output_dir: str = DEFAULT_BATCH_OUTPUT_DIR,
+              concurrency: int = DEFAULT_BATCH_CONCURRENCY, host_interval: float = DEFAULT_HOST_INTERVAL,
+              deadline: Optional[float] = None, crawl: Optional[Tuple[int, int, int]] = None,
+              store_path: Optional[str] = None, coverage: bool = False, metrics_path: Optional[str] = None,
+              **analyzer_options) -> List[Dict]:
+    """Analyze many sites concurrently, writing <slug>.md and <slug>.json.gz per site
+
+    At most concurrency sites run at once over one shared connection pool,
+    and requests to the same host are spaced host_interval seconds apart.
+    deadline (seconds) is a soft bound on the whole batch: once it passes,
+    pending sites are cancelled and running ones fail their next request;
+    the summary is written once every started site has stopped. A failing
+    site never affects the others. crawl=(max_depth, max_pages,
+    concurrency) crawls each site instead of analyzing one page.
+    store_path loads every site into one DeclarationStore, coverage also
+    writes <slug>.coverage.md and metrics_path collects each site's run
+    metrics as {url: metrics} JSON. Returns a summary entry per URL, also
+    saved as batch_summary.json.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    # The per-site aggregates (and the store) must not be limited to the rendered report sections
+    analyzer_options = dict(analyzer_options, full_aggregate=True)
+    session = create_session(concurrency * DEFAULT_FETCH_WORKERS)
+    limiter = HostRateLimiter(host_interval)
+    stop_at = time.monotonic() + deadline if deadline is not None else None
+    # SQLite connections belong to one thread, so each site opens the store in turn
+    store_lock = threading.Lock()
+    site_metrics = {}
+
+    def analyze(url: str) -> Dict:
+        start = time.perf_counter()
+        slug = site_slug(url)
+        entry = {'url': url, 'status': 'failed', 'report': None, 'aggregate': None, 'error': None}
+        try:
+            analyzer = DesignStyleAnalyzer(url, session=session, rate_limiter=limiter, deadline=stop_at,
+                                           coverage=coverage, **analyzer_options)
+            report_path = os.path.join(output_dir, f"{slug}.md")
+            try:
+                if crawl is not None:
+                    report = analyzer.run_crawl(*crawl, output_file=report_path)
+                else:
+                    report = analyzer.run_analysis(output_file=report_path)
+            finally:
+                if metrics_path:
+                    site_metrics[url] = analyzer.collect_metrics().to_dict()
+            if report:
+                aggregate_path = os.path.join(output_dir, f"{slug}.json.gz")
+                analyzer.style_guide.save(aggregate_path)
+                entry.update(status='ok', report=report_path, aggregate=aggregate_path,
+                             rules=len(analyzer.css_rules))
+                if coverage:
+                    entry['coverage'] = os.path.join(output_dir, f"{slug}.coverage.md")
+                    with open(entry['coverage'], 'w', encoding='utf-8') as f:
+                        f.write(analyzer.generate_coverage_report())
+                if store_path:
+                    with store_lock, DeclarationStore(store_path) as store:
+                        store.add_analysis(analyzer)
+            else:
+                entry['error'] = analyzer.failure or 'no report'
+        except Exception as e:
+            logger.exception(f" Batch site {url} failed")
+            entry['error'] = f"{type(e).__name__}: {e}"
+        entry['seconds'] = round(time.perf_counter() - start, 3)
+        return entry
+
+    results = {url: {'url': url, 'status': 'timeout', 'error': 'batch deadline passed'} for url in urls}
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='batch')
+    futures = {executor.submit(analyze, url): url for url in urls}
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            entry = future.result()
+            results[entry['url']] = entry
+            logger.info(f" [{entry['status']}] {entry['url']} ({entry['seconds']:.1f}s)"
+                        + (f": {entry['error']}" if entry['error'] else ''))
+    except FuturesTimeoutError:
+        logger.warning(f" Batch deadline of {deadline:g}s passed; {sum(not f.done() for f in futures)} "
+                       f"sites unfinished")
+    finally:
+        # Sites already running fail their next request after the deadline; wait for them to stop
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    for future, url in futures.items():
+        if future.done() and not future.cancelled() and results[url]['status'] == 'timeout':
+            entry = future.result()
+            if entry['status'] != 'ok':
+                entry['error'] = f"batch deadline passed ({entry['error']})"
+            results[url] = entry
+            logger.info(f" [{entry['status']}] {url} after the deadline ({entry['seconds']:.1f}s)")
+
+    if metrics_path:
+        with open(metrics_path, 'w', encoding='utf-8') as f:
+            json.dump({url: site_metrics[url] for url in urls if url in site_metrics}, f, indent=2)
+    summary = [results[url] for url in urls]
+    with open(os.path.join(output_dir, 'batch_summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def run_instrumented(run: Callable, metrics: RunMetrics, profile_path: Optional[str] = None,
+                     trace_memory: bool = False):
+    """Call run() under the opt-in cProfile and tracemalloc hooks, recording their results in metrics
+
+    The profile (main thread only) is dumped to profile_path for pstats or
+    snakeviz; tracemalloc adds the peak and the top allocation sites.
+    """
+    profiler = cProfile.Profile() if profile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        return run()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if trace_memory:
+            metrics.extra['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+            metrics.extra['top_allocations'] = [
+                {'site': str(stat.traceback), 'bytes': stat.size, 'blocks': stat.count}
+                for stat in tracemalloc.take_snapshot().statistics('lineno')[:10]
+            ]
+            tracemalloc.stop()
+        if profiler is not None:
+            profiler.dump_stats(profile_path)
+            metrics.extra['profile'] = profile_path
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(15)
+            logger.info(summary.getvalue())
+
+
 def main():
-    # Target URL
-    url = "https://www.ncad.ie/"
+    parser = argparse.ArgumentParser(description="Extract a design style guide from a website")
+    parser.add_argument('url', nargs='?', default="https://www.ncad.ie/", help='page to analyze')
+    parser.add_argument('--cache-dir',
+                        help='cache HTTP responses and parsed stylesheets in this directory')
+    parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_CACHE_MAX_BYTES // (1024 * 1024),
+                        help='evict least recently used cached bodies beyond this size')
+    parser.add_argument('--offline', action='store_true',
+                        help='replay responses from --cache-dir without network access')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_REQUEST_TIMEOUT,
+                        help='seconds to wait for a server to connect or send data')
+    parser.add_argument('--max-body-mb', type=float, default=DEFAULT_MAX_BODY_BYTES / (1024 * 1024),
+                        help='refuse HTML pages and stylesheets larger than this')
+    parser.add_argument('--spill-mb', type=float, default=DEFAULT_SPILL_BYTES / (1024 * 1024),
+                        help='spool stylesheets larger than this to a memory-mapped temp file (only '
+                             '--parser streaming parses it without building the whole text in memory)')
+    parser.add_argument('--parser', choices=sorted(PARSER_BACKENDS), default=DEFAULT_PARSER_BACKEND,
+                        help='CSS parser backend (cssutils is strict, streaming is fast)')
+    parser.add_argument('--html-parser', choices=sorted(HTML_BACKENDS), default=DEFAULT_HTML_BACKEND,
+                        help='HTML backend (html.parser builds a full tree, stream and lxml only collect '
+                             'what is analyzed)')
+    parser.add_argument('--dom-weighted', action='store_true',
+                        help='weight statistics by how many page elements each rule matches')
+    parser.add_argument('--coverage', metavar='PATH',
+                        help='write a Markdown report of dead and page-specific rules per stylesheet to PATH '
+                             '(with --batch, to <site>.coverage.md in --output-dir instead)')
+    parser.add_argument('--sections', metavar='LIST',
+                        help='comma-separated report sections to render and analyze '
+                             f"(any of {', '.join(REPORT_SECTIONS)}; default all); --store, --save-aggregate "
+                             'and --batch still analyze every section')
+    parser.add_argument('--ignore-style-attributes', action='store_true',
+                        help='leave style="" attributes out of the analysis')
+    parser.add_argument('--parse-workers', type=int, default=0,
+                        help='parse large stylesheets in this many worker processes')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='parse and analyze each stylesheet as soon as it is downloaded')
+    parser.add_argument('--compact-rules', action='store_true',
+                        help='keep parsed rules in interned columnar storage to save memory')
+    parser.add_argument('--selector-vocabulary', metavar='PATH',
+                        help='JSON file of {category: [selector token patterns]} added to the component vocabulary')
+    parser.add_argument('--palette-threshold', type=float, default=DEFAULT_PALETTE_DELTA_E,
+                        help='CIE76 delta E below which colors merge into one palette entry (needs numpy)')
+    parser.add_argument('--store', metavar='PATH',
+                        help='also load every declaration and style_guide count into the SQLite database PATH')
+    parser.add_argument('--save-aggregate', metavar='PATH',
+                        help='also save the style guide aggregate (gzipped JSON) to PATH')
+    parser.add_argument('--from-aggregate', metavar='PATH', action='append',
+                        help='render the report from saved aggregates (merged in order) without fetching')
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help='re-analyze only stylesheets changed since the snapshot at PATH, '
+                             'write a change summary and update the snapshot (uses the HTTP cache)')
+    parser.add_argument('--crawl', action='store_true',
+                        help='analyze every same-domain page reachable from the URL')
+    parser.add_argument('--max-depth', type=int, default=DEFAULT_CRAWL_DEPTH, help='crawl link depth')
+    parser.add_argument('--max-pages', type=int, default=DEFAULT_CRAWL_PAGES, help='crawl page limit')
+    parser.add_argument('--crawl-concurrency', type=int, default=DEFAULT_CRAWL_CONCURRENCY,
+                        help='pages fetched at once while crawling')
+    parser.add_argument('--batch', metavar='FILE',
+                        help='analyze every URL listed in FILE (one per line) instead of the url argument')
+    parser.add_argument('--batch-concurrency', type=int, default=DEFAULT_BATCH_CONCURRENCY,
+                        help='sites analyzed at once in batch mode')
+    parser.add_argument('--host-interval', type=float, default=DEFAULT_HOST_INTERVAL,
+                        help='minimum seconds between requests to the same host in batch mode')
+    parser.add_argument('--deadline', type=float,
+                        help='give up on unfinished batch sites after this many seconds (a soft limit: '
+                             'sites already running stop at their next request, which can take up to '
+                             'the request timeout)')
+    parser.add_argument('--output-dir', default=DEFAULT_BATCH_OUTPUT_DIR,
+                        help='directory for the per-site reports and aggregates of a batch')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='write per-phase timings, counters and cache statistics as JSON to PATH '
+                             '(with --batch, keyed by site URL)')
+    parser.add_argument('--profile', metavar='PATH', help='run under cProfile and dump the stats to PATH')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='trace allocations with tracemalloc and report the peak in the metrics')
+    parser.add_argument('--quiet', action='store_true', help='only log warnings and errors')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO, format='%(message)s',
+                        stream=sys.stdout)
+    if args.snapshot and args.crawl:
+        parser.error('--snapshot is not supported together with --crawl')
+    if args.deadline is not None and not args.batch:
+        parser.error('--deadline only applies to --batch')
+    if args.batch and args.snapshot:
+        parser.error('--snapshot is not supported together with --batch')
+    if args.batch and args.save_aggregate:
+        parser.error('--batch already saves an aggregate per site to --output-dir; '
+                     'merge them with --from-aggregate instead of --save-aggregate')
+    if args.batch and (args.profile or args.trace_memory):
+        parser.error('--profile and --trace-memory only instrument single-site runs, not --batch')
+    if args.snapshot and (args.dom_weighted or args.coverage):
+        parser.error('--snapshot reuses per-sheet results without DOM matching; '
+                     'it cannot be combined with --dom-weighted or --coverage')
+    report_sections = None
+    if args.sections:
+        report_sections = [section.strip() for section in args.sections.split(',') if section.strip()]
+        try:
+            required_analyses(report_sections)
+        except ValueError as e:
+            parser.error(str(e))
+
+    http_cache = None
+    sheet_cache = None
+    # Incremental runs always revalidate through the HTTP cache, so unchanged sheets cost a 304
+    if args.cache_dir or args.offline or args.snapshot:
+        cache_dir = args.cache_dir or DEFAULT_CACHE_DIR
+        http_cache = HTTPCache(cache_dir, max_bytes=args.cache_max_mb * 1024 * 1024, offline=args.offline)
+        sheet_cache = ParsedSheetCache(cache_dir)
+
+    if args.from_aggregate:
+        aggregate = StyleGuideAggregate.merged(StyleGuideAggregate.load(path) for path in args.from_aggregate)
+        analyzer = DesignStyleAnalyzer(', '.join(aggregate.sources) or args.url,
+                                       palette_threshold=args.palette_threshold, report_sections=report_sections)
+        print(analyzer.write_report(style_guide=aggregate))
+        return
+
+    selector_classifier = SelectorClassifier()
+    if args.selector_vocabulary:
+        with open(args.selector_vocabulary, encoding='utf-8') as f:
+            selector_classifier.extend(json.load(f))
+
+    options = dict(http_cache=http_cache, sheet_cache=sheet_cache, parser_backend=args.parser,
+                   parse_workers=args.parse_workers, pipeline=args.pipeline, compact_rules=args.compact_rules,
+                   selector_classifier=selector_classifier, palette_threshold=args.palette_threshold,
+                   request_timeout=args.timeout, max_body_bytes=int(args.max_body_mb * 1024 * 1024),
+                   spill_bytes=int(args.spill_mb * 1024 * 1024), html_backend=args.html_parser,
+                   style_attributes=not args.ignore_style_attributes, dom_weighting=args.dom_weighted,
+                   report_sections=report_sections)
+
+    if args.batch:
+        crawl = (args.max_depth, args.max_pages, args.crawl_concurrency) if args.crawl else None
+        summary = run_batch(read_url_list(args.batch), args.output_dir, args.batch_concurrency,
+                            args.host_interval, args.deadline, crawl, store_path=args.store,
+                            coverage=bool(args.coverage), metrics_path=args.metrics, **options)
+        succeeded = sum(entry['status'] == 'ok' for entry in summary)
+        print(f" Batch complete: {succeeded} of {len(summary)} sites analyzed, results in {args.output_dir}/")
+        sys.exit(0 if succeeded == len(summary) else 1)
 
     # Create analyzer and run
-    analyzer = DesignStyleAnalyzer(url)
-    report = analyzer.run_analysis()
+    analyzer = DesignStyleAnalyzer(args.url, coverage=bool(args.coverage),
+                                   full_aggregate=bool(args.store or args.save_aggregate), **options)
+    if args.crawl:
+        run = partial(analyzer.run_crawl, args.max_depth, args.max_pages, args.crawl_concurrency)
+    elif args.snapshot:
+        # A store replaces all of the site's rows, so it needs the rules of reused sheets too
+        run = partial(analyzer.run_incremental, args.snapshot, keep_rules=bool(args.store))
+    else:
+        run = analyzer.run_analysis
+    report = run_instrumented(run, analyzer.metrics, args.profile, args.trace_memory)
+
+    metrics = analyzer.collect_metrics()
+    logger.info(" Run metrics:")
+    metrics.log_summary()
+    if args.metrics:
+        metrics.write(args.metrics)
+        logger.info(f" Metrics saved to: {args.metrics}")
+
+    if report and args.store:
+        with DeclarationStore(args.store) as store:
+            store.add_analysis(analyzer)
+        logger.info(f" Declarations stored in: {args.store}")
+
+    if report and args.coverage:
+        with open(args.coverage, 'w', encoding='utf-8') as f:
+            f.write(analyzer.generate_coverage_report())
+        logger.info(f" Coverage report saved to: {args.coverage}")
+
+    if report and args.save_aggregate:
+        analyzer.style_guide.save(args.save_aggregate)
+        logger.info(f" Aggregate saved to: {args.save_aggregate}")
 
     if report:
         print(report)
-        print("\n\n Style guide analysis complete!")
-        print(f" Full report saved to: style_guide_analysis.md")
+        logger.info("\n\n Style guide analysis complete!")
+        logger.info(f" Full report saved to: style_guide_analysis.md")
     else:
-        print(" Analysis failed")
+        logger.error(" Analysis failed")
 
 
 if __name__ == "__main__":
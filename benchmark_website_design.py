@@ -0,0 +1,722 @@
+#!/usr/bin/env python3
+"""
+Website Design Style Analyzer - Benchmarks
+Micro-benchmarks for the hot paths of analyze_website_design.py
+"""
+
+import argparse
+import contextlib
+import datetime
+import difflib
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+from collections import Counter
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Tuple
+
+import analyze_website_design as analyzer
+
+
+def legacy_extract_colors(value: str) -> List[str]:
+    """The original three-regex plus substring-scan color extraction, kept as a baseline"""
+    colors = []
+    colors.extend(re.findall(r'#[0-9a-fA-F]{3,8}', value))
+    colors.extend(re.findall(r'rgba?\([^)]+\)', value))
+    colors.extend(re.findall(r'hsla?\([^)]+\)', value))
+    for color in ['white', 'black', 'red', 'blue', 'green', 'yellow', 'gray', 'grey']:
+        if color in value.lower():
+            colors.append(color)
+    return colors
+
+
+def legacy_normalize_color(color: str) -> str:
+    """The original per-call re.match normalization, kept as a baseline"""
+    color = color.lower().strip()
+    if re.match(r'^#[0-9a-f]{3}$', color):
+        color = '#' + ''.join([c*2 for c in color[1:]])
+    return color
+
+
+# The substring lists the analyzer used before SelectorClassifier, kept as a baseline
+LEGACY_SELECTOR_LISTS = {
+    'heading': ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', '.heading', '.title'],
+    'body': ['body', 'p', '.text', '.content', 'main'],
+    'button': ['button', '.btn', '.button', '[type="submit"]', 'a.button'],
+    'card': ['.card', '.box', '.panel', '.tile'],
+    'navigation': ['nav', '.navigation', '.menu', 'header'],
+}
+
+
+def legacy_classify(selector: str) -> Tuple[str, ...]:
+    selector = selector.lower()
+    return tuple(category for category, needles in LEGACY_SELECTOR_LISTS.items()
+                 if any(needle in selector for needle in needles))
+
+
+def bench_selectors(rules: int, repeat: int):
+    """Classify the selectors of a synthetic stylesheet with the legacy lists and SelectorClassifier"""
+    selectors = [selector for selector, _, _ in
+                 analyzer.parse_stylesheet(synthetic_stylesheet(rules), 'streaming')]
+
+    def classifier_run():
+        classifier = analyzer.SelectorClassifier()
+        for selector in selectors:
+            classifier.classify(selector)
+
+    # Substring scanning over the full vocabulary, for a like-for-like pattern count
+    needles = {category: [pattern.replace('*', '') for pattern in patterns]
+               for category, patterns in analyzer.DEFAULT_SELECTOR_VOCABULARY.items()}
+
+    def legacy_full_run():
+        for selector in selectors:
+            lowered = selector.lower()
+            [category for category, words in needles.items() if any(word in lowered for word in words)]
+
+    legacy = min(timeit.repeat(lambda: [legacy_classify(s) for s in selectors], number=1, repeat=repeat))
+    legacy_full = min(timeit.repeat(legacy_full_run, number=1, repeat=repeat))
+    current = min(timeit.repeat(classifier_run, number=1, repeat=repeat))
+    print(f"Classifying {len(selectors)} selectors "
+          f"({len(analyzer.DEFAULT_SELECTOR_VOCABULARY)} categories, "
+          f"{sum(map(len, analyzer.DEFAULT_SELECTOR_VOCABULARY.values()))} patterns vs "
+          f"{sum(map(len, LEGACY_SELECTOR_LISTS.values()))} substrings)")
+    print(f"   legacy substrings:   {legacy * 1000:8.1f} ms")
+    print(f"   same, full vocab:    {legacy_full * 1000:8.1f} ms")
+    print(f"   SelectorClassifier:  {current * 1000:8.1f} ms (cold cache)")
+
+
+def synthetic_page(elements: int, seed: int = 0) -> str:
+    """A CMS-like page: deep markup, a few stylesheets and <style> blocks, style="" on some elements"""
+    rng = random.Random(seed)
+    head = [f'<link rel="stylesheet" href="/assets/sheet{i}.css">' for i in range(5)]
+    head += [f'<style>.block-{i} {{ margin: {i}px; }}</style>' for i in range(3)]
+    body = []
+    for i in range(elements):
+        tag = rng.choice(['div', 'span', 'p', 'li', 'section', 'a'])
+        attrs = f' class="block-{i % 50} col-{i % 12}"'
+        if tag == 'a':
+            attrs += f' href="/page{i % 200}.html"'
+        if rng.random() < 0.05:
+            attrs += f' style="color: #{rng.randrange(1 << 24):06x}; padding: {rng.randrange(24)}px"'
+        body.append(f'<{tag}{attrs}>Item {i} &amp; more text</{tag}>')
+    return (f"<!DOCTYPE html><html><head><title>Bench</title>{''.join(head)}</head>"
+            f"<body>{''.join(body)}</body></html>")
+
+
+def bench_html(elements: int, repeat: int):
+    """Extract the page assets of a synthetic page with every HTML backend"""
+    html = synthetic_page(elements)
+    expected = None
+    print(f"Extracting assets from a {len(html) // 1024} KiB page with {elements} elements")
+    for name, backend in sorted(analyzer.HTML_BACKENDS.items()):
+        assets = backend.extract(html)
+        found = (assets.stylesheets, assets.style_blocks, assets.style_attributes, assets.links)
+        if expected is None:
+            expected = found
+        agrees = 'agrees' if found == expected else 'DIFFERS'
+        best = min(timeit.repeat(partial(backend.extract, html), number=1, repeat=repeat))
+        print(f"   {name:12} {best * 1000:8.1f} ms  {len(assets.style_attributes)} style attributes ({agrees})")
+
+
+def bench_match(elements: int, rules: int, repeat: int):
+    """Match a synthetic stylesheet against a synthetic page with RuleHash and with a naive scan"""
+    dom = analyzer.HTML_BACKENDS['stream'].extract(synthetic_page(elements), dom=True).dom
+    selectors = [selector for selector, _, _ in analyzer.parse_stylesheet(synthetic_stylesheet(rules), 'streaming')]
+    # Rules that do hit the page, in the shapes CMS themes use
+    selectors += [shape.format(i=i) for i in range(50) for shape in
+                  ("section .block-{i}", "div.col-{i} > a", ".block-{i}:hover", "li.block-{i} + li")]
+
+    def index():
+        rule_hash = analyzer.RuleHash()
+        for key, selector in enumerate(selectors):
+            rule_hash.add(key, selector)
+        return rule_hash
+
+    indexed = min(timeit.repeat(index, number=1, repeat=repeat))
+    rule_hash = index()
+    matched = rule_hash.match(dom)
+    hashed = min(timeit.repeat(partial(rule_hash.match, dom), number=1, repeat=repeat))
+
+    # The naive scan tries every selector on every element; time a sample and scale it up
+    sample = [analyzer.parse_selector_list(selector) for selector in selectors[::max(1, len(selectors) // 200)]]
+    start = time.perf_counter()
+    for element in dom.elements:
+        for selector_list in sample:
+            any(analyzer.match_selector(selector, element) for selector in selector_list)
+    naive = (time.perf_counter() - start) * len(selectors) / len(sample)
+
+    print(f"Matching {len(selectors)} selectors against {len(dom)} elements "
+          f"({len(matched)} selectors match, {sum(map(len, matched.values()))} matches)")
+    print(f"   naive scan:  {naive * 1000:10.1f} ms (estimated from {len(sample)} selectors)")
+    print(f"   RuleHash:    {hashed * 1000:10.1f} ms (+ {indexed * 1000:.1f} ms to parse and index the selectors)")
+
+
+def palette_counts(distinct: int, seed: int = 0) -> Counter:
+    """Distinct color tokens in mixed notations with skewed usage counts, as real sites have"""
+    rng = random.Random(seed)
+    counts = Counter()
+    while len(counts) < distinct:
+        r, g, b = (rng.randrange(256) for _ in range(3))
+        notation = rng.random()
+        if notation < 0.6:
+            token = f"#{r:02x}{g:02x}{b:02x}"
+        elif notation < 0.85:
+            token = f"rgba({r}, {g}, {b}, {rng.choice(['1', '0.5', '0.9'])})"
+        else:
+            token = f"hsl({rng.randrange(360)}, {rng.randrange(101)}%, {rng.randrange(101)}%)"
+        counts[token] += int(rng.paretovariate(1.2))
+    return counts
+
+
+def bench_palette(distinct: int, threshold: float, repeat: int):
+    """Time cluster_palette over synthetic weighted colors"""
+    counts = palette_counts(distinct)
+
+    def run():
+        analyzer.color_rgba.cache_clear()
+        return analyzer.cluster_palette(counts, threshold)
+
+    elapsed = min(timeit.repeat(run, number=1, repeat=repeat))
+    palette = run()
+    print(f"Clustering {distinct} distinct colors ({sum(counts.values())} uses) at delta E {threshold:g}")
+    print(f"   cluster_palette: {elapsed * 1000:8.1f} ms (cold parse cache)")
+    for entry in palette[:5]:
+        print(f"   {entry['color']} {entry['share']:6.1%} from {len(entry['members'])} colors")
+
+
+def color_values(count: int, distinct: int, seed: int = 0) -> List[str]:
+    """Deterministic color-bearing declaration values with realistic repetition"""
+    rng = random.Random(seed)
+    templates = [
+        '#{:03x}', '#{:06x}', '1px solid #{:06x}', 'rgba({0}, {0}, {0}, 0.5)',
+        'hsl({0}, 50%, 50%)', '{name}', 'url(bg.png) no-repeat {name}',
+        'linear-gradient(#{:06x}, {name})', '0 1px 2px rgba(0, 0, 0, .{0})',
+    ]
+    names = sorted(analyzer.CSS_NAMED_COLORS)
+    pool = []
+    for i in range(distinct):
+        template = templates[i % len(templates)]
+        number = rng.randrange(0x1000 if template == '#{:03x}' else 0x1000000)
+        pool.append(template.format(number % 256 if '{0}' in template else number, name=rng.choice(names)))
+    return [rng.choice(pool) for _ in range(count)]
+
+
+def bench_colors(count: int, distinct: int, repeat: int):
+    """Compare the legacy and tokenized/memoized color paths over the same values"""
+    values = color_values(count, distinct)
+
+    def legacy():
+        for value in values:
+            for color in legacy_extract_colors(value):
+                legacy_normalize_color(color)
+
+    def tokenized():
+        analyzer.normalized_colors.cache_clear()
+        for value in values:
+            analyzer.normalized_colors(value)
+
+    legacy_time = min(timeit.repeat(legacy, number=1, repeat=repeat))
+    tokenized_time = min(timeit.repeat(tokenized, number=1, repeat=repeat))
+
+    print(f"Color extraction over {count} values ({distinct} distinct), best of {repeat}")
+    print(f"   legacy:    {legacy_time * 1000:8.1f} ms")
+    print(f"   tokenized: {tokenized_time * 1000:8.1f} ms")
+    print(f"   speedup:   {legacy_time / tokenized_time:8.1f}x")
+
+
+# Conformance corpus for the parser backends. Constructs cssutils rejects
+# outright (CSS nesting, case-insensitive attribute flags, vendor
+# pseudo-elements it does not know) are left out on purpose.
+CONFORMANCE_CORPUS = [
+    'h1, h2 { font-family: \'Georgia\', serif; font-size: 2rem; font-weight: 700; color: #FFF; }',
+    'a   >  b,\n .X:hover{ COLOR : RED !important; color: blue; --v:  foo  bar ; *zoom:1; _h:1px; content:"a;b}"}',
+    'a{margin:1.0em +1px .5em 10.00%} a{x:1e3px;y:-.5} a{m:1.50e2}',
+    'a{color:red;color:blue!important;color:green} a{margin:0 !IMPORTANT}',
+    'a{background:url( \'a b.png\' ) no-repeat} a{background-image:url(data:image/svg+xml;charset=utf8,%3Csvg%3E)}',
+    'a{transition: opacity .3s,transform .3s} a{transform:rotate(45DEG) translateY( -1px )}',
+    'a::before , b  ~  c + d{top:0} *{} p{color:red;;}',
+    '.card{box-shadow:0 1px 2px rgba(0,0,0,.2);border:1px solid hsl(0, 0%, 80%);background-color:#ff0000}',
+    '@media screen { p { color: red } } q{a:b} @import "x.css"; @charset "utf-8"; r{s:t}',
+    '@media screen and (max-width:600px){ .a{color:red} @media (hover:hover){ .b{color:blue} } } .c{top:0}',
+    '@font-face { font-family: X; src: url(x.woff) } @keyframes k { from { top: 0 } to { top: 1px } } s{t:u}',
+    '@supports (display:grid) { .g{display:grid} @media (min-width:1px){.h{top:0}} } @layer x, y; i{top:1px}',
+    '@layer base{p{margin:0}} @container card (min-width:400px){.c{color:blue}} @media print{@supports not (x:y){.d{top:1px}}}',
+    '@media(min-width:1px){a{top:0}} b{background:url("{;}.png")} /* @supports x { c{top:0} } */ d{content:"}"}',
+    'a{b:c}/* comment { with } braces; */e{f:g /* inline */ h}',
+    'button, [type="submit"] { border-radius: 999px; padding: 8px 16px; grid-area: 1 / 2 / 3 }',
+    '.md\\:flex{display:flex} .w-1\\/2{width:50%}',
+    'p { color: red',
+]
+
+_CSS_ESCAPE_PATTERN = re.compile(r'\\([0-9a-fA-F]{1,6}\s?|.)', re.DOTALL)
+_ZERO_UNIT_PATTERN = re.compile(r'(?<![\w.])0(?:px|em|rem|%)(?![\w%])')
+
+
+def _unescape(match) -> str:
+    escape = match.group(1)
+    if re.match(r'[0-9a-fA-F]', escape):
+        return chr(int(escape.strip(), 16) or 0xFFFD)
+    return escape
+
+
+def canonical_css(text: str) -> str:
+    """Serialization-independent form of a selector or value for backend comparison"""
+    text = _CSS_ESCAPE_PATTERN.sub(_unescape, text)
+    text = _ZERO_UNIT_PATTERN.sub('0', text.lower())
+    return re.sub(r'\s+', '', text).replace("'", '"')
+
+
+def compare_backends(css_text: str) -> Tuple[int, List[str], Counter]:
+    """Compare every backend against cssutils on one stylesheet
+
+    Returns (rules compared, disagreements, declarations only the fast
+    backends kept because cssutils' validation dropped them).
+    """
+    reference = analyzer.parse_stylesheet(css_text, analyzer.CssutilsBackend.name)
+    problems = []
+    unvalidated = Counter()
+
+    for name in analyzer.PARSER_BACKENDS:
+        if name == analyzer.CssutilsBackend.name:
+            continue
+        records = analyzer.PARSER_BACKENDS[name].parse(css_text)
+        expected = [canonical_css(selector + media) for selector, _, media in reference]
+        actual = [canonical_css(selector + media) for selector, _, media in records]
+
+        # Align rules by selector so a rule cssutils rejected does not shift the rest
+        matcher = difflib.SequenceMatcher(None, expected, actual, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                for (selector, styles, _), (_, other, _) in zip(reference[i1:i2], records[j1:j2]):
+                    problems.extend(_compare_styles(name, selector, styles, other, unvalidated))
+            elif tag in ('replace', 'delete'):
+                problems.extend(f"{name}: missing rule {selector!r}" for selector, _, _ in reference[i1:i2])
+            if tag in ('replace', 'insert'):
+                unvalidated['rules'] += j2 - j1
+
+    return len(reference), problems, unvalidated
+
+
+def _compare_styles(name: str, selector: str, expected: Dict[str, str], actual: Dict[str, str],
+                    unvalidated: Counter) -> List[str]:
+    problems = []
+    for prop, value in expected.items():
+        if prop not in actual:
+            problems.append(f"{name}: {selector!r} lost {prop}")
+        elif canonical_css(value) != canonical_css(actual[prop]):
+            problems.append(f"{name}: {selector!r} {prop}: {value!r} != {actual[prop]!r}")
+    unvalidated['declarations'] += len(set(actual) - set(expected))
+    return problems
+
+
+def check_conformance(paths: List[str]) -> bool:
+    """Check that all parser backends agree with cssutils on the corpus and the given files"""
+    corpus = [('corpus', css_text) for css_text in CONFORMANCE_CORPUS]
+    for path in paths:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            corpus.append((path, f.read()))
+
+    total_rules = 0
+    total_problems = 0
+    unvalidated = Counter()
+    for source, css_text in corpus:
+        rules, problems, extra = compare_backends(css_text)
+        total_rules += rules
+        total_problems += len(problems)
+        unvalidated.update(extra)
+        for problem in problems[:10]:
+            print(f"   {source}: {problem}")
+
+    print(f"Parser conformance over {len(corpus)} stylesheets, {total_rules} rules")
+    print(f"   disagreements: {total_problems}")
+    print(f"   kept only by non-validating backends: {unvalidated['rules']} rules, "
+          f"{unvalidated['declarations']} declarations")
+    return total_problems == 0
+
+
+def bench_parsers(paths: List[str], repeat: int):
+    """Time every parser backend over the given stylesheets"""
+    sheets = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            sheets.append(f.read())
+    size = sum(len(sheet) for sheet in sheets)
+
+    print(f"Parsing {len(sheets)} stylesheets ({size / 1024:.0f} KiB), best of {repeat}")
+    for name, backend in analyzer.PARSER_BACKENDS.items():
+        elapsed = min(timeit.repeat(lambda: [backend.parse(sheet) for sheet in sheets], number=1, repeat=repeat))
+        print(f"   {name:10} {elapsed * 1000:8.1f} ms")
+
+
+# Building blocks of the synthetic stylesheets: a utility-framework-like mix
+# of component classes, states and a small set of design tokens
+SYNTHETIC_COMPONENTS = ['btn', 'card', 'nav', 'tile', 'panel', 'modal', 'badge', 'alert', 'grid', 'row', 'col',
+                        'booking-card', 'equipment-tile', 'header', 'footer', 'menu', 'list', 'form', 'input']
+SYNTHETIC_STATES = ['', ':hover', ':focus', ':active', '::before', ' > a', ' .icon', ' + .label']
+SYNTHETIC_DECLARATIONS = [
+    ('display', ['block', 'flex', 'grid', 'inline-flex', 'none']),
+    ('color', ['#333', '#ffffff', 'rgba(0, 0, 0, 0.5)', 'white', 'var(--text)', '#0055aa']),
+    ('background-color', ['#fff', '#f5f5f5', 'hsl(210, 50%, 40%)', 'transparent', 'black']),
+    ('margin', ['0', '0 auto', '8px', '16px 0', '1rem']),
+    ('padding', ['4px', '8px 16px', '1rem 2rem', '0']),
+    ('font-size', ['12px', '14px', '16px', '1.25rem', '2rem']),
+    ('font-family', ['"Helvetica", sans-serif', 'Georgia, serif', 'var(--font-body)']),
+    ('font-weight', ['400', '600', '700']),
+    ('line-height', ['1.2', '1.5', '24px']),
+    ('border', ['1px solid #ccc', '2px solid red', 'none']),
+    ('border-radius', ['4px', '8px', '50%', '999px']),
+    ('box-shadow', ['0 1px 2px rgba(0, 0, 0, 0.2)', 'none', '0 4px 20px rgba(0, 0, 0, 0.1)']),
+    ('transition', ['all 0.2s ease', 'opacity 0.3s']),
+    ('transform', ['translateY(-1px)', 'scale(1.05)']),
+    ('max-width', ['1200px', '100%', '640px']),
+]
+
+
+# Report section selections timed by bench_sections, from everything down to one section
+SECTION_SELECTIONS = [None, ['tone'], ['colors'], ['typography']]
+
+
+def bench_sections(rules: int, repeat: int):
+    """Time the analysis pass and report rendering for a few report section selections"""
+    records = analyzer.parse_stylesheet(synthetic_stylesheet(rules), 'streaming')
+    print(f"Analyzing and rendering {len(records)} synthetic rules")
+    for selection in SECTION_SELECTIONS:
+        def run():
+            design = analyzer.DesignStyleAnalyzer('https://example.com/', report_sections=selection)
+            design.add_page_source(design.url, records)
+            design.fold_rules(design.analysis_sections)
+            design.generate_markdown_report()
+            return design
+
+        best = min(timeit.repeat(run, number=1, repeat=repeat))
+        label = ','.join(selection) if selection else 'all'
+        print(f"   {label:12} {best * 1000:8.1f} ms  (analyzes {', '.join(run().analysis_sections)})")
+
+
+def synthetic_stylesheet(rules: int, seed: int = 0, media_every: int = 0) -> str:
+    """Deterministic framework-like stylesheet with the given number of style rules
+
+    With media_every > 0, every media_every-th rule is wrapped in an @media block.
+    """
+    rng = random.Random(seed)
+    lines = []
+    for i in range(rules):
+        component = rng.choice(SYNTHETIC_COMPONENTS)
+        selector = f".{component}-{i % 997}{rng.choice(SYNTHETIC_STATES)}"
+        declarations = '; '.join(f"{name}: {rng.choice(values)}"
+                                 for name, values in rng.sample(SYNTHETIC_DECLARATIONS, rng.randint(2, 7)))
+        rule = f"{selector} {{ {declarations} }}"
+        if media_every and i % media_every == 0:
+            rule = f"@media (min-width: {rng.choice([576, 768, 992, 1200])}px) {{ {rule} }}"
+        lines.append(rule)
+    return '\n'.join(lines)
+
+
+def _retained_bytes(build) -> int:
+    """Memory still allocated after build() returns, with its result kept alive"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def bench_memory(rules: int):
+    """Compare the memory an analyzer retains for css_rules and its indexes, plain and compact"""
+    css_text = synthetic_stylesheet(rules)
+
+    def build(compact_rules: bool):
+        design = analyzer.DesignStyleAnalyzer('https://example.com/', compact_rules=compact_rules)
+        design.add_source('stylesheet', design.url, analyzer.parse_stylesheet(css_text, 'streaming'))
+        return design
+
+    # The analyzer's session and aggregate are the same in both layouts; measure them once to subtract
+    empty_bytes = _retained_bytes(partial(analyzer.DesignStyleAnalyzer, 'https://example.com/'))
+    plain_bytes = _retained_bytes(partial(build, False)) - empty_bytes
+    compact_bytes = _retained_bytes(partial(build, True)) - empty_bytes
+    store_bytes = build(True).css_rules.memory_bytes()
+
+    print(f"Analyzer memory for {rules} synthetic rules (css_rules plus property and selector indexes)")
+    print(f"   list of dicts: {plain_bytes / 1024 / 1024:8.1f} MiB")
+    print(f"   compact:       {compact_bytes / 1024 / 1024:8.1f} MiB ({store_bytes / 1024 / 1024:.1f} MiB of it "
+          f"in the rule store)")
+    print(f"   reduction:     {plain_bytes / compact_bytes:8.1f}x")
+
+
+# Synthetic sites for the scaling suite: total rules, linked stylesheets and
+# the depth of the @import chain behind each linked sheet
+SUITE_CORPORA = {
+    '1k': {'rules': 1000, 'sheets': 2, 'import_depth': 0},
+    '10k': {'rules': 10000, 'sheets': 4, 'import_depth': 1},
+    '50k': {'rules': 50000, 'sheets': 8, 'import_depth': 1},
+    '100k': {'rules': 100000, 'sheets': 12, 'import_depth': 2},
+    '500k': {'rules': 500000, 'sheets': 24, 'import_depth': 3},
+}
+DEFAULT_SUITE_CORPORA = ['1k', '10k', '100k']
+
+# run_analysis phases, timed one by one
+SUITE_PHASES = ['fetch', 'extract', 'parse', 'analyze_typography', 'analyze_colors', 'analyze_layout',
+                'analyze_visual_effects', 'analyze_ui_patterns', 'report']
+
+
+def write_synthetic_site(directory: str, rules: int, sheets: int, import_depth: int, seed: int = 0):
+    """Write index.html and its stylesheets for a deterministic synthetic site
+
+    Every linked sheet heads an @import chain import_depth sheets deep, the
+    rules are spread unevenly over all files and one in twenty rules sits in
+    an @media block. A small inline <style> block is added too.
+    """
+    rng = random.Random(seed)
+    files = [f"s{sheet}-{level}.css" for sheet in range(sheets) for level in range(import_depth + 1)]
+    weights = [rng.uniform(0.2, 1.8) for _ in files]
+    counts = [int(rules * weight / sum(weights)) for weight in weights]
+    counts[0] += rules - sum(counts)
+
+    for index, (name, count) in enumerate(zip(files, counts)):
+        sheet, level = name[1:-4].split('-')
+        css_text = synthetic_stylesheet(count, seed=seed * 1000 + index, media_every=20)
+        if int(level) < import_depth:
+            css_text = f'@import url("s{sheet}-{int(level) + 1}.css");\n' + css_text
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+            f.write(css_text)
+
+    links = '\n'.join(f'<link rel="stylesheet" href="s{sheet}-0.css">' for sheet in range(sheets))
+    with open(os.path.join(directory, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(f"<!doctype html>\n<html><head>\n{links}\n"
+                f"<style>body {{ font-family: Georgia, serif; color: #222 }}</style>\n"
+                f"</head><body><nav class=\"menu\"></nav><main><p>Synthetic</p></main></body></html>\n")
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve_directory(directory: str) -> Iterator[str]:
+    """Serve directory over HTTP on a free localhost port, yielding the base URL"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(_QuietHandler, directory=directory))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@contextlib.contextmanager
+def quiet_analyzer() -> Iterator[None]:
+    """Silence the analyzer's progress logging while a run is timed"""
+    level = analyzer.logger.level
+    analyzer.logger.setLevel(logging.ERROR)
+    try:
+        yield
+    finally:
+        analyzer.logger.setLevel(level)
+
+
+def run_phases(url: str, options: Dict) -> Tuple[Dict[str, float], Dict[str, int]]:
+    """Run the staged analysis of url one phase at a time; returns phase seconds and sizes"""
+    site = analyzer.DesignStyleAnalyzer(url, **options)
+    phases = {}
+
+    def timed(name, call):
+        start = time.perf_counter()
+        result = call()
+        phases[name] = time.perf_counter() - start
+        return result
+
+    with quiet_analyzer():
+        timed('fetch', site.fetch_html)
+        css_contents = timed('extract', site.extract_css_files)
+        timed('parse', lambda: site.parse_css(css_contents))
+        for name in SUITE_PHASES[3:-1]:
+            timed(name, getattr(site, name))
+        timed('report', site.generate_markdown_report)
+
+    sizes = {'sources': len(css_contents), 'css_chars': sum(len(text) for text in css_contents),
+             'parsed_rules': len(site.css_rules)}
+    return phases, sizes
+
+
+def peak_memory(url: str, options: Dict) -> int:
+    """Peak traced allocation of one full phase run"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run_phases(url, options)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def bench_suite(corpora: List[str], repeat: int, options: Dict, measure_memory: bool, output: str):
+    """Time every phase on each synthetic corpus and write the results as JSON"""
+    results = []
+    for name in corpora:
+        corpus = SUITE_CORPORA[name]
+        with tempfile.TemporaryDirectory(prefix=f'design-bench-{name}-') as directory:
+            write_synthetic_site(directory, **corpus)
+            with serve_directory(directory) as base:
+                url = f"{base}/index.html"
+                runs = [run_phases(url, options) for _ in range(repeat)]
+                peak = peak_memory(url, options) if measure_memory else None
+
+        phases = {phase: statistics.median(run[0][phase] for run in runs) for phase in SUITE_PHASES}
+        total = sum(phases.values())
+        sizes = runs[0][1]
+        results.append(dict(corpus, name=name, **sizes, phases=phases, total=total,
+                            rules_per_second=sizes['parsed_rules'] / total if total else 0.0,
+                            peak_bytes=peak))
+
+        print(f"{name:>5}: {sizes['parsed_rules']:>7} rules from {sizes['sources']:>3} sources "
+              f"in {total:7.3f}s" + (f", peak {peak / 1024 / 1024:7.1f} MiB" if peak is not None else ''))
+        for phase in SUITE_PHASES:
+            print(f"       {phase:<24} {phases[phase]:8.4f}s")
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'revision': _git_revision(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'options': options,
+            'repeat': repeat,
+            'results': results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+
+def compare_suites(baseline_path: str, current_path: str, threshold: float) -> bool:
+    """Print per-phase time ratios of two suite result files; False if any exceeds threshold"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {result['name']: result for result in json.load(f)['results']}
+    with open(current_path, encoding='utf-8') as f:
+        current = json.load(f)['results']
+
+    ok = True
+    for result in current:
+        before = baseline.get(result['name'])
+        if before is None:
+            continue
+        print(f"{result['name']}:")
+        rows = [(phase, before['phases'][phase], result['phases'][phase]) for phase in SUITE_PHASES]
+        rows.append(('total', before['total'], result['total']))
+        if before.get('peak_bytes') and result.get('peak_bytes'):
+            rows.append(('peak_bytes', before['peak_bytes'], result['peak_bytes']))
+        for label, old, new in rows:
+            ratio = new / old if old else 1.0
+            # Sub-millisecond phases are too noisy to flag
+            regressed = ratio > threshold and (label == 'peak_bytes' or new - old > 0.001)
+            ok = ok and not regressed
+            print(f"   {label:<24} {old:>12.4f} -> {new:>12.4f}  {ratio:5.2f}x{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[-1])
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    colors = subparsers.add_parser('colors', help='color tokenizer micro-benchmark')
+    colors.add_argument('--values', type=int, default=200000, help='declaration values to scan')
+    colors.add_argument('--distinct', type=int, default=2000, help='distinct values among them')
+    colors.add_argument('--repeat', type=int, default=5)
+
+    parsers = subparsers.add_parser('parsers', help='parser backend timings')
+    parsers.add_argument('css', nargs='+', help='stylesheet files to parse')
+    parsers.add_argument('--repeat', type=int, default=3)
+
+    palette = subparsers.add_parser('palette', help='perceptual palette clustering')
+    palette.add_argument('--distinct', type=int, default=20000, help='distinct color tokens')
+    palette.add_argument('--threshold', type=float, default=analyzer.DEFAULT_PALETTE_DELTA_E)
+    palette.add_argument('--repeat', type=int, default=3)
+
+    selectors = subparsers.add_parser('selectors', help='selector classification micro-benchmark')
+    selectors.add_argument('--rules', type=int, default=100000)
+    selectors.add_argument('--repeat', type=int, default=3)
+
+    html = subparsers.add_parser('html', help='HTML backend timings')
+    html.add_argument('--elements', type=int, default=50000)
+    html.add_argument('--repeat', type=int, default=3)
+
+    match = subparsers.add_parser('match', help='selector matching against a DOM')
+    match.add_argument('--elements', type=int, default=5000)
+    match.add_argument('--rules', type=int, default=20000)
+    match.add_argument('--repeat', type=int, default=3)
+
+    sections = subparsers.add_parser('sections', help='analysis cost per report section selection')
+    sections.add_argument('--rules', type=int, default=100000)
+    sections.add_argument('--repeat', type=int, default=3)
+
+    memory = subparsers.add_parser('memory', help='css_rules storage footprint')
+    memory.add_argument('--rules', type=int, default=100000)
+
+    suite = subparsers.add_parser('suite', help='per-phase scaling suite over synthetic sites served locally')
+    suite.add_argument('corpora', nargs='*', choices=sorted(SUITE_CORPORA), default=DEFAULT_SUITE_CORPORA,
+                       help=f"corpora to run (default: {' '.join(DEFAULT_SUITE_CORPORA)})")
+    suite.add_argument('--repeat', type=int, default=3)
+    suite.add_argument('--parser', choices=sorted(analyzer.PARSER_BACKENDS), default=analyzer.DEFAULT_PARSER_BACKEND)
+    suite.add_argument('--compact-rules', action='store_true')
+    suite.add_argument('--no-memory', action='store_true', help='skip the tracemalloc peak memory run')
+    suite.add_argument('--output', default='bench_results.json', help='JSON results file')
+
+    compare = subparsers.add_parser('compare', help='compare two suite result files')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio reported as a regression')
+
+    conformance = subparsers.add_parser('conformance', help='check parser backends agree with cssutils')
+    conformance.add_argument('css', nargs='*', help='extra stylesheet files for the corpus')
+
+    args = parser.parse_args()
+    if args.benchmark == 'colors':
+        bench_colors(args.values, args.distinct, args.repeat)
+    elif args.benchmark == 'parsers':
+        bench_parsers(args.css, args.repeat)
+    elif args.benchmark == 'palette':
+        bench_palette(args.distinct, args.threshold, args.repeat)
+    elif args.benchmark == 'selectors':
+        bench_selectors(args.rules, args.repeat)
+    elif args.benchmark == 'html':
+        bench_html(args.elements, args.repeat)
+    elif args.benchmark == 'match':
+        bench_match(args.elements, args.rules, args.repeat)
+    elif args.benchmark == 'sections':
+        bench_sections(args.rules, args.repeat)
+    elif args.benchmark == 'memory':
+        bench_memory(args.rules)
+    elif args.benchmark == 'suite':
+        options = {'parser_backend': args.parser, 'compact_rules': args.compact_rules}
+        bench_suite(args.corpora, args.repeat, options, not args.no_memory, args.output)
+    elif args.benchmark == 'compare':
+        sys.exit(0 if compare_suites(args.baseline, args.current, args.threshold) else 1)
+    elif args.benchmark == 'conformance':
+        sys.exit(0 if check_conformance(args.css) else 1)
+
+
+if __name__ == "__main__":
+    main()
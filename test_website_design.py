@@ -0,0 +1,432 @@
+"""
+Website Design Style Analyzer - Tests
+Run with: python -m pytest test_website_design.py
+"""
+
+import functools
+import http.server
+import os
+import threading
+import time
+
+import pytest
+import requests
+
+import analyze_website_design as analyzer
+from benchmark_website_design import CONFORMANCE_CORPUS, compare_backends
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def serve():
+    """Start a local HTTP server; serve(handler_class, directory=...) returns its base URL"""
+    servers = []
+
+    def start(handler=QuietHandler, **handler_options) -> str:
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(handler, **handler_options))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize('css_text', CONFORMANCE_CORPUS)
+def test_parser_backends_agree_with_cssutils(css_text):
+    _, problems, _ = compare_backends(css_text)
+    assert problems == []
+
+
+def test_parser_backends_agree_on_whole_corpus():
+    # The last corpus entry is deliberately unterminated, so it cannot be followed by more CSS
+    rules, problems, _ = compare_backends('\n'.join(CONFORMANCE_CORPUS[:-1]))
+    assert problems == []
+    assert rules > 0
+    assert len(analyzer.PARSER_BACKENDS) > 1
+
+
+@pytest.mark.parametrize('selector, tokens', [
+    ('a:not([href])', ['a']),
+    ('button:not([type="submit"])', ['button']),
+    ('a[href]:not(.x)', ['[href]', 'a']),
+    ('input[value="a:not(b)"]', ['[value=a:not(b)]', 'input']),
+    ('.NavBar > A#Main', ['#Main', '.NavBar', 'a']),
+])
+def test_selector_tokens_skip_not_arguments(selector, tokens):
+    assert analyzer.SelectorClassifier.tokens(selector) == tokens
+
+
+def test_selector_classifier_shares_selector_tokens_and_ignores_case():
+    classifier = analyzer.SelectorClassifier()
+    assert set(classifier.tokens('.NavBar a.Btn')) == analyzer.selector_tokens('.NavBar a.Btn')
+    assert classifier.classify('.NavBar a.Btn') == classifier.classify('.navbar a.btn') == ('button', 'navigation')
+
+
+MATCH_PAGE = ('<html><body><h1>Title</h1><nav><a class="btn" href="/">Home</a><button class="btn" disabled>Go</button></nav>'
+              '<p>Text</p></body></html>')
+
+
+@pytest.mark.parametrize('selector, tags, possible', [
+    ('.btn:not(:hover)', ['a', 'button'], True),
+    ('.btn:focus:not(:focus-visible)', ['a', 'button'], True),
+    ('.btn:hover', ['a', 'button'], True),
+    ('nav:hover > .btn:not(:disabled)', ['a'], True),
+    (':is(a:hover, p)', ['a', 'p'], False),
+    ('.btn:not(:hover):not(a)', ['button'], True),
+    ('p:not(:hover) .btn', [], False),
+])
+def test_match_treats_dynamic_pseudo_classes_as_possible(selector, tags, possible):
+    dom = analyzer.HTML_BACKENDS['stream'].extract(MATCH_PAGE, dom=True).dom
+    rule_hash = analyzer.RuleHash()
+    rule_hash.add(0, selector)
+    uncertain = set()
+    matched = rule_hash.match(dom, uncertain)
+    assert [element.tag for element in matched.get(0, [])] == tags
+    assert uncertain == ({0} if possible else set())
+
+
+@pytest.mark.parametrize('selector', ['h1 + div p', 'h1 ~ div > p', 'h1 + div > p', 'section h1 ~ div p'])
+def test_rule_hash_matches_through_sibling_combinators(selector):
+    dom = analyzer.HTML_BACKENDS['stream'].extract(
+        '<section><h1>Title</h1><div><p>Text</p></div></section>', dom=True).dom
+    rule_hash = analyzer.RuleHash()
+    rule_hash.add(0, selector)
+    direct = [element.tag for element in dom.elements
+              for parsed in analyzer.parse_selector_list(selector) if analyzer.match_selector(parsed, element)]
+    assert direct == ['p']
+    assert [element.tag for element in rule_hash.match(dom).get(0, [])] == direct
+
+
+def test_match_selector_is_three_valued():
+    dom = analyzer.HTML_BACKENDS['stream'].extract(MATCH_PAGE, dom=True).dom
+    paragraph = next(element for element in dom.elements if element.tag == 'p')
+    [selector] = analyzer.parse_selector_list('p:not(:hover)')
+    assert analyzer.match_selector(selector, paragraph) is None
+    [selector] = analyzer.parse_selector_list('p:not(:first-child)')
+    assert analyzer.match_selector(selector, paragraph) is True
+    [selector] = analyzer.parse_selector_list('p:not(p:hover, p)')
+    assert analyzer.match_selector(selector, paragraph) is False
+
+
+FORM_PAGE = ('<form><fieldset id="set" disabled><legend><input id="in-legend"></legend><input id="in-fieldset"></fieldset>'
+             '<select id="pick"><optgroup id="group" disabled><option id="grouped">A</option></optgroup></select>'
+             '<button id="go">Go</button><div id="box"></div><p id="text">Text</p></form>')
+
+
+@pytest.mark.parametrize('selector, ids', [
+    (':disabled', ['set', 'in-fieldset', 'group', 'grouped']),
+    (':enabled', ['in-legend', 'pick', 'go']),
+    ('div:enabled, div:disabled, div:optional', []),
+    (':optional', ['in-legend', 'in-fieldset', 'pick']),
+])
+def test_form_state_pseudo_classes_only_apply_to_form_elements(selector, ids):
+    dom = analyzer.HTML_BACKENDS['stream'].extract(FORM_PAGE, dom=True).dom
+    matched = [element.id for element in dom.elements
+               if any(analyzer.match_selector(parsed, element) for parsed in analyzer.parse_selector_list(selector))]
+    assert matched == ids
+
+
+def test_empty_is_unknown_without_text_nodes():
+    dom = analyzer.HTML_BACKENDS['stream'].extract(FORM_PAGE, dom=True).dom
+    [selector] = analyzer.parse_selector_list('p:empty')
+    paragraph = next(element for element in dom.elements if element.id == 'text')
+    assert analyzer.match_selector(selector, paragraph) is None
+
+
+def test_coverage_reports_state_dependent_rules_separately():
+    site = analyzer.DesignStyleAnalyzer('https://example.com/', coverage=True)
+    site.dom = analyzer.HTML_BACKENDS['stream'].extract(MATCH_PAGE, dom=True).dom
+    site.add_page_source('https://example.com/site.css', analyzer.parse_stylesheet(
+        '.btn:not(:hover) { color: red } .btn:focus:not(:focus-visible) { outline: 0 } '
+        '.btn { padding: 0 } .missing:not(:hover) { color: blue } '
+        'h1 + nav .btn { margin: 0 } h1 ~ p { color: green } p + nav a { color: gray }', 'streaming'))
+    [entry] = site.coverage_report()['sources']
+    assert entry['used'] == 3
+    assert entry['dead'] == ['.missing:not(:hover)', 'p + nav a']
+    assert entry['state_dependent'] == ['.btn:not(:hover)', '.btn:focus:not(:focus-visible)']
+
+
+@pytest.mark.parametrize('full_aggregate, fonts', [(False, {}), (True, {'Georgia': 1})])
+def test_full_aggregate_analyzes_sections_that_are_not_rendered(full_aggregate, fonts):
+    site = analyzer.DesignStyleAnalyzer('https://example.com/', report_sections=['colors'],
+                                        full_aggregate=full_aggregate)
+    site.add_page_source('https://example.com/site.css', analyzer.parse_stylesheet(
+        'body { font-family: Georgia; color: red }', 'streaming'))
+    site.analyze_rules(site.analysis_sections)
+    assert dict(site.style_guide['typography']['font_families']) == fonts
+    assert site.style_guide['colors']['all_colors']
+
+
+def test_read_body_enforces_the_byte_limit():
+    assert analyzer.read_body([b'a' * 4, b'b' * 4], 'utf-8', max_bytes=8) == 'aaaabbbb'
+    with pytest.raises(analyzer.BodyTooLarge):
+        analyzer.read_body([b'a' * 4, b'b' * 5], 'utf-8', max_bytes=8)
+
+
+class UndeclaredLengthHandler(http.server.BaseHTTPRequestHandler):
+    """Streams a large body without Content-Length, as a misreporting server would"""
+
+    protocol_version = 'HTTP/1.0'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/css')
+        self.end_headers()
+        self.wfile.write(b'a' * 50000)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_read_body_enforces_the_byte_limit_without_content_length(serve):
+    session = analyzer.create_session()
+    with analyzer.open_stream(session, serve(UndeclaredLengthHandler) + '/big.css', max_bytes=1000) as response:
+        with pytest.raises(analyzer.BodyTooLarge):
+            analyzer.read_body(response.iter_content(1024), 'utf-8', max_bytes=1000)
+
+
+def test_read_body_stops_at_the_deadline():
+    with pytest.raises(TimeoutError):
+        analyzer.read_body(iter([b'a', b'b']), 'utf-8', deadline=time.monotonic() - 1)
+
+
+def test_read_body_spills_large_bodies_and_closes_them():
+    body = analyzer.read_body([b'.a { color: red }', ' /* \u00e9 */'.encode('utf-8')], 'utf-8', spill_bytes=8)
+    assert isinstance(body, analyzer.SpilledBody)
+    assert len(body) == 26
+    with body:
+        assert body.text() == '.a { color: red } /* \u00e9 */'
+        assert analyzer.css_size(body) == '26 bytes'
+    assert body.map.closed and body.file.closed
+    body.close()
+    assert analyzer.read_body([b'.a {}'], 'utf-8', spill_bytes=8) == '.a {}'
+
+
+
+def write_site(directory, files) -> str:
+    directory.mkdir()
+    for name, text in files.items():
+        (directory / name).write_text(text, encoding='utf-8')
+    return str(directory)
+
+
+def test_incremental_run_skips_unchanged_sheets_without_reading_them(serve, tmp_path, monkeypatch):
+    site = write_site(tmp_path / 'site', {
+        'index.html': '<link rel="stylesheet" href="a.css"><p>Text</p>',
+        'a.css': '@import "b.css";\nbody { font-family: Georgia; color: #333 }',
+        'b.css': '.card { display: grid; color: red }',
+    })
+    url = serve(directory=site) + '/index.html'
+    snapshot = str(tmp_path / 'snapshot.json.gz')
+
+    def run():
+        site_analyzer = analyzer.DesignStyleAnalyzer(url, http_cache=analyzer.HTTPCache(str(tmp_path / 'cache')))
+        report = site_analyzer.run_incremental(snapshot, str(tmp_path / 'changes.md'))
+        return site_analyzer, report.split('\n', 6)[6]
+
+    first, report = run()
+    assert first.metrics.counters['unchanged_bodies'] == 0
+
+    read = []
+    read_body = analyzer.HTTPCache._read_body
+    monkeypatch.setattr(analyzer.HTTPCache, '_read_body',
+                        lambda cache, entry, *args: read.append(entry['url']) or read_body(cache, entry, *args))
+    second, unchanged_report = run()
+    # Only the page itself is read back; both sheets are recognised from their validators
+    assert second.metrics.counters['unchanged_bodies'] == 2
+    assert read == [url]
+    assert unchanged_report == report
+
+
+
+def test_http_cache_revalidates_and_replays_offline(serve, tmp_path):
+    base = serve(directory=write_site(tmp_path / 'site', {'a.css': 'body { color: red }'}))
+    session = requests.Session()
+    cache = analyzer.HTTPCache(str(tmp_path / 'cache'))
+    assert cache.get(session, base + '/a.css') == 'body { color: red }'
+    # SimpleHTTPRequestHandler answers If-Modified-Since with a 304
+    assert cache.get(session, base + '/a.css') == 'body { color: red }'
+    assert cache.stats == {'downloaded': 1, 'revalidated': 1}
+
+    offline = analyzer.HTTPCache(str(tmp_path / 'cache'), offline=True)
+    assert offline.get(session, base + '/a.css') == 'body { color: red }'
+    assert offline.stats == {'replayed': 1}
+    with pytest.raises(LookupError):
+        offline.get(session, base + '/missing.css')
+
+
+def test_http_cache_refetches_body_evicted_after_its_entry_was_loaded(serve, tmp_path, monkeypatch):
+    base = serve(directory=write_site(tmp_path / 'site', {'a.css': 'body { color: red }'}))
+    session = requests.Session()
+    cache = analyzer.HTTPCache(str(tmp_path / 'cache'))
+    cache.get(session, base + '/a.css')
+
+    load_entry = analyzer.HTTPCache._load_entry
+
+    def load_then_evict(cache, url):
+        entry = load_entry(cache, url)
+        os.remove(cache._body_path(entry['sha256']))
+        return entry
+    monkeypatch.setattr(analyzer.HTTPCache, '_load_entry', load_then_evict)
+    assert cache.get(session, base + '/a.css') == 'body { color: red }'
+    assert cache.stats == {'downloaded': 2}
+
+    offline = analyzer.HTTPCache(str(tmp_path / 'cache'), offline=True)
+    with pytest.raises(LookupError):
+        offline.get(session, base + '/a.css')
+
+
+def test_http_cache_evicts_least_recently_used_bodies(serve, tmp_path):
+    sheets = {f'{n}.css': f'/* {os.urandom(2000).hex()} */' for n in range(6)}
+    base = serve(directory=write_site(tmp_path / 'site', sheets))
+    session = requests.Session()
+    cache = analyzer.HTTPCache(str(tmp_path / 'cache'), max_bytes=8000)
+    for name in sheets:
+        cache.get(session, f'{base}/{name}')
+
+    bodies = [os.path.join(cache.bodies_dir, name) for name in os.listdir(cache.bodies_dir)]
+    assert cache.stats['evicted'] > 0
+    assert sum(map(os.path.getsize, bodies)) == cache._stored_bytes <= 8000
+    # The most recent download is never the one evicted
+    assert os.path.exists(cache._body_path(cache.bodies[f'{base}/5.css']))
+
+
+
+@pytest.mark.parametrize('condition, wrappers', [
+    ('', []),
+    ('all', []),
+    ('screen and (min-width: 40em)', ['@media screen and (min-width: 40em)']),
+    ('layer', []),
+    ('layer(base) print', ['@media print']),
+    ('supports(display: grid)', ['@supports (display: grid)']),
+    ('layer(base) supports(not (display: grid)) print, tv', ['@supports not (display: grid)', '@media print, tv']),
+])
+def test_import_condition_rules(condition, wrappers):
+    assert analyzer.import_condition_rules(condition) == wrappers
+
+
+def test_expand_imports_wraps_imported_sheets_in_their_conditions(serve, tmp_path):
+    base = serve(directory=write_site(tmp_path / 'site', {
+        'grid.css': '.grid { display: grid }',
+        'print.css': '@import "nested.css" (min-width: 40em);\nbody { color: black }',
+        'nested.css': '.wide { color: blue }',
+        'base.css': 'p { color: red }',
+    }))
+    site = analyzer.DesignStyleAnalyzer(base + '/index.html')
+    css = ('@import "grid.css" supports(display: grid);\n@import url(print.css) print;\n'
+           '@import "base.css" layer(base);\nh1 { color: green }')
+    try:
+        expanded = site.expand_imports(base + '/main.css', css)
+    finally:
+        site.release_imports()
+
+    site.parse_css([text for _, text in expanded])
+    assert {(rule['selector'], rule['media']) for rule in site.css_rules} == {
+        ('.grid', '@supports (display: grid)'),
+        ('.wide', '@media print @media (min-width: 40em)'),
+        ('body', '@media print'),
+        ('p', ''),
+        ('h1', ''),
+    }
+
+
+AGGREGATE_SHEETS = [
+    'body { font-family: Georgia; color: #333 } h1 { font-size: 2rem; color: red }',
+    '.grid { display: grid; gap: 1rem } h1 { font-size: 3rem } .btn { padding: 4px; border-radius: 4px }',
+    '.row { display: flex; box-shadow: 0 1px 2px #000 } body { color: #333; line-height: 1.5 }',
+]
+
+
+def fold_sheets(sheets):
+    site = analyzer.DesignStyleAnalyzer('https://example.com/')
+    for css in sheets:
+        site.add_page_source('https://example.com/site.css', analyzer.parse_stylesheet(css, 'streaming'))
+    site.analyze_rules()
+    return site
+
+
+def test_aggregate_merge_matches_folding_sheets_in_order():
+    site = fold_sheets(AGGREGATE_SHEETS)
+    parts = [site.fold_records(analyzer.parse_stylesheet(css, 'streaming')) for css in AGGREGATE_SHEETS]
+    merged = analyzer.StyleGuideAggregate.merged(parts)
+    assert merged['typography']['font_families'] and merged['layout']['grid_usage']
+    assert merged.to_dict()['sections'] == site.style_guide.to_dict()['sections']
+
+    left = analyzer.StyleGuideAggregate.merged([analyzer.StyleGuideAggregate.merged(parts[:2]), parts[2]])
+    right = analyzer.StyleGuideAggregate.merged([parts[0], analyzer.StyleGuideAggregate.merged(parts[1:])])
+    assert left.to_dict() == right.to_dict() == merged.to_dict()
+
+
+def test_aggregate_round_trips_and_rejects_other_schema_versions(tmp_path):
+    aggregate = fold_sheets(AGGREGATE_SHEETS).style_guide
+    data = aggregate.to_dict()
+    assert analyzer.StyleGuideAggregate.from_dict(data).to_dict() == data
+
+    path = str(tmp_path / 'aggregate.json.gz')
+    aggregate.save(path)
+    loaded = analyzer.StyleGuideAggregate.load(path)
+    assert loaded.to_dict() == data
+    assert loaded.sources == ['https://example.com/']
+    assert loaded['typography']['font_families'] == aggregate['typography']['font_families']
+
+    with pytest.raises(ValueError, match='schema version'):
+        analyzer.StyleGuideAggregate.from_dict(dict(data, schema_version=analyzer.STYLE_GUIDE_SCHEMA_VERSION + 1))
+
+
+def analyzed_site(url, css, **options):
+    site = analyzer.DesignStyleAnalyzer(url, **options)
+    site.add_page_source(url + 'site.css', analyzer.parse_stylesheet(css, 'streaming'))
+    site.analyze_rules(site.analysis_sections)
+    return site
+
+
+def test_declaration_store_queries_and_replaces_sites():
+    first = analyzed_site('https://a.example/', 'body { font-family: Georgia, serif; color: #333 } '
+                                                '.x { color: red } @media (min-width: 40em) { .x { color: #333 } }')
+    second = analyzed_site('https://b.example/', 'body { font-family: MyXFont; color: #333 }')
+    with analyzer.DeclarationStore(':memory:') as store:
+        store.add_analysis(first)
+        store.add_analysis(second)
+        store.add_analysis(first)
+        assert [url for url, _ in store.sites()] == ['https://a.example/', 'https://b.example/']
+
+        assert store.top_colors(1) == [('#333333', 3, 2)]
+        assert store.sites_with_font('Georgia') == [('https://a.example/', 'Georgia, serif', 1)]
+        assert store.sites_with_font('My_Font') == []
+
+        assert store.declarations('color', site='https://a.example/') == [
+            ('https://a.example/', 'https://a.example/site.css', 'body', '', '#333'),
+            ('https://a.example/', 'https://a.example/site.css', '.x', '', 'red'),
+            ('https://a.example/', 'https://a.example/site.css', '.x', '@media (min-width: 40em)', '#333'),
+        ]
+        assert sorted(row[0] for row in store.declarations('color', '#333')) == [
+            'https://a.example/', 'https://a.example/', 'https://b.example/']
+
+
+def test_declaration_store_keeps_sections_that_are_not_rendered():
+    site = analyzed_site('https://a.example/', 'body { font-family: Georgia; color: red }',
+                         report_sections=['colors'], full_aggregate=True)
+    with analyzer.DeclarationStore(':memory:') as store:
+        store.add_analysis(site)
+        assert store.sites_with_font('Georgia') == [('https://a.example/', 'Georgia', 1)]
+
+
+def test_batch_failing_site_does_not_abort_the_others(serve, tmp_path):
+    base = serve(directory=write_site(tmp_path / 'site', {
+        'index.html': '<style>body { font-family: Georgia; color: #333 }</style><p>Text</p>',
+    }))
+    urls = [base + '/missing.html', base + '/index.html', 'http://127.0.0.1:1/index.html']
+    output_dir = str(tmp_path / 'out')
+    summary = analyzer.run_batch(urls, output_dir, concurrency=2, host_interval=0)
+
+    assert [entry['status'] for entry in summary] == ['failed', 'ok', 'failed']
+    assert all(entry['error'] for entry in (summary[0], summary[2]))
+    assert os.path.exists(summary[1]['report']) and os.path.exists(summary[1]['aggregate'])
+    assert os.path.exists(os.path.join(output_dir, 'batch_summary.json'))